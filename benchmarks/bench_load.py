@@ -0,0 +1,40 @@
+"""
+Compare the round-trip and read-only loading modes of the YAML backend, with
+and without the snapshot cache.
+
+    python benchmarks/bench_load.py [GROUPS] [NODES]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from common import make_bucket_file, timeit, report
+from momo.backends.yaml import BucketDocument
+
+
+def main(groups=100, nodes=100):
+    path = make_bucket_file(groups, nodes)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        print('bucket: %d nodes, %d bytes' % (
+            groups * nodes, os.path.getsize(path)))
+        for read_only in (False, True):
+            mode = 'read-only' if read_only else 'round-trip'
+            report('%s parse' % mode, timeit(
+                lambda: BucketDocument('bench', path,
+                                       read_only=read_only).load(),
+                repeat=1))
+            document = BucketDocument('bench', path, cache_dir=cache_dir,
+                                      read_only=read_only)
+            document.load()  # make the snapshot
+            report('%s snapshot' % mode, timeit(
+                lambda: BucketDocument('bench', path, cache_dir=cache_dir,
+                                       read_only=read_only).load()))
+    finally:
+        os.remove(path)
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,50 @@
+"""
+Measure the memory used by the element tree of a generated bucket.
+
+    python benchmarks/bench_memory.py [GROUPS] [NODES]
+"""
+from __future__ import print_function
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from common import make_bucket_file
+from momo.settings import Settings
+
+
+def load_all(node):
+    """Load every element of the tree."""
+    count = 1
+    for elem in node.vals:
+        if elem.is_node:
+            count += load_all(elem)
+        else:
+            count += 1
+    return count
+
+
+def main(groups=250, nodes=100):
+    path = make_bucket_file(groups, nodes)
+    settings_dir = tempfile.mkdtemp()
+    try:
+        settings = Settings(settings_dir=settings_dir,
+                            settings_file=os.path.join(settings_dir, 'x.yml'))
+        bucket = settings.to_bucket('bench', path, read_only=True)
+        gc.collect()
+        tracemalloc.start()
+        count = load_all(bucket.root)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%d elements: %.1f MB (%.0f bytes per element), '
+              'peak %.1f MB' % (count, current / 1e6, float(current) / count,
+                                peak / 1e6))
+    finally:
+        os.remove(path)
+        shutil.rmtree(settings_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,70 @@
+"""
+Time making the markdown pages of a generated bucket with the mkdocs plugin,
+in the main process and with a pool of workers, and then again with the
+pages unchanged.
+
+    python benchmarks/bench_mkdocs.py [GROUPS] [NODES] [WORKERS]
+
+The default bucket has 100 groups of 100 nodes, which makes 10k pages with
+momo_page_level 2.
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from common import make_bucket_file, timeit, report
+from momo.settings import Settings
+from momo.utils import mkdir_p
+from momo.plugins.mkdocs import Mkdocs
+
+
+def make_plugin(settings_dir, path):
+    settings = Settings(settings_dir=settings_dir,
+                        settings_file=os.path.join(settings_dir, 'x.yml'))
+    settings._settings = {
+        'buckets': {'bench': path},
+        'plugins': {'mkdocs': {'bench': {'momo_page_level': 2}}},
+    }
+    settings.cbn = 'bench'
+    plugin = Mkdocs()
+    plugin.settings = settings
+    plugin.setup()
+    return plugin
+
+
+def make_pages(plugin, workers, clean=True):
+    """Make the pages as Mkdocs.run does, without mkdocs itself."""
+    if clean:
+        os.remove(plugin.manifest_path)
+        shutil.rmtree(plugin.docs_dir)
+    plugin.momo_configs['momo_workers'] = workers
+    plugin.manifest = plugin._load_manifest()
+    plugin.pages = {}
+    plugin.jobs = []
+    mkdir_p(plugin.docs_dir)
+    plugin._get_pages(plugin.root)
+    plugin._make_pages()
+    plugin._save_manifest()
+
+
+def main(groups=100, nodes=100, workers=None):
+    path = make_bucket_file(groups, nodes, 2)
+    settings_dir = tempfile.mkdtemp()
+    try:
+        plugin = make_plugin(settings_dir, path)
+        # load the whole tree before timing
+        make_pages(plugin, 1, clean=False)
+        report('serial (%d pages)' % len(plugin.pages),
+               timeit(lambda: make_pages(plugin, 1)))
+        report('pool (%s workers)' % (workers or 'CPU'),
+               timeit(lambda: make_pages(plugin, workers)))
+        report('pool, unchanged pages',
+               timeit(lambda: make_pages(plugin, workers, clean=False)))
+    finally:
+        os.remove(path)
+        shutil.rmtree(settings_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
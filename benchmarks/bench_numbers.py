@@ -0,0 +1,82 @@
+"""
+Time looking up an element by a deep numbered path (as in "momo ls 3 3 3"),
+by sorting every level and with Node.get_elem_by_num, which selects small
+numbers without sorting.  The sorted values of the nodes are dropped before
+each lookup, as in a new process of a one-shot command.
+
+    python benchmarks/bench_numbers.py [WIDTH] [DEPTH] [NUM]
+"""
+from __future__ import print_function
+import os
+import random
+import shutil
+import sys
+import tempfile
+from common import timeit, report
+from momo.settings import Settings
+
+
+def make_bucket_text(width, depth, num):
+    """
+    Generate a bucket with `depth` levels of `width` nodes, where the node
+    numbered `num` (by name) of each level holds the next level.
+    """
+    lines = []
+    names = ['item%06d' % i for i in range(width)]
+    random.seed(0)
+    for level in range(depth):
+        indent = '    ' * level
+        random.shuffle(names)
+        for name in names:
+            if name != 'item%06d' % (num - 1):
+                lines.append("%s%s: {size: %d}" % (
+                    indent, name, random.randint(0, 1000)))
+        lines.append('%sitem%06d:' % (indent, num - 1))
+    lines.append('%s    path: /data' % ('    ' * (depth - 1)))
+    return '\n'.join(lines) + '\n'
+
+
+def clear_sorted(node):
+    node._sorted = None
+    for child in node.node_vals:
+        if child._sorted is not None:
+            clear_sorted(child)
+
+
+def main(width=20000, depth=5, num=3):
+    fd, path = tempfile.mkstemp(suffix='.yml')
+    with os.fdopen(fd, 'w') as f:
+        f.write(make_bucket_text(width, depth, num))
+    settings_dir = tempfile.mkdtemp()
+    try:
+        settings = Settings(settings_dir=settings_dir,
+                            settings_file=os.path.join(settings_dir, 'x.yml'))
+        bucket = settings.to_bucket('bench', path, read_only=True)
+        root = bucket.root
+
+        def sort_levels():
+            clear_sorted(root)
+            node = root
+            for _ in range(depth):
+                node = node.get_vals()[num - 1]
+            return node
+
+        def select_levels():
+            clear_sorted(root)
+            node = root
+            for _ in range(depth):
+                node = node.get_elem_by_num(num, None, False, None)
+            return node
+
+        assert sort_levels() is select_levels()
+        report('sort every level (%d x %d)' % (depth, width),
+               timeit(sort_levels))
+        report('get_elem_by_num (%s)' % ' '.join([str(num)] * depth),
+               timeit(select_levels))
+    finally:
+        os.remove(path)
+        shutil.rmtree(settings_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,50 @@
+"""
+Time building the element tree of a deep generated bucket, and computing
+Element.level and Element.path of every element.
+
+    python benchmarks/bench_path.py [GROUPS] [NODES] [DEPTH]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from common import make_bucket_file, timeit, report
+from momo.settings import Settings
+
+
+def walk(node):
+    for elem in node.vals:
+        yield elem
+        if elem.is_node:
+            for sub_elem in walk(elem):
+                yield sub_elem
+
+
+def main(groups=20, nodes=100, depth=30):
+    path = make_bucket_file(groups, nodes, depth)
+    settings_dir = tempfile.mkdtemp()
+    try:
+        settings = Settings(settings_dir=settings_dir,
+                            settings_file=os.path.join(settings_dir, 'x.yml'))
+        bucket = settings.to_bucket('bench', path, read_only=True)
+        elems = []
+
+        def build():
+            bucket._root = None
+            del elems[:]
+            elems.extend(walk(bucket.root))
+
+        report('build tree (%d elements)' % len(list(walk(bucket.root))),
+               timeit(build))
+        report('level of every element',
+               timeit(lambda: [elem.level for elem in elems]))
+        report('path of every element',
+               timeit(lambda: [elem.path for elem in elems]))
+    finally:
+        os.remove(path)
+        shutil.rmtree(settings_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,51 @@
+"""
+Time sorting the nodes of a generated bucket by two attrs, with the key
+function per node that the flask plugin used before and with the sort
+engine in momo.plugins.flask.sorting.
+
+    python benchmarks/bench_sorting.py [GROUPS] [NODES]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from common import make_bucket_file, timeit, report
+from momo.settings import Settings
+from momo.plugins.flask.filters import get_attr
+from momo.plugins.flask.sorting import sort_nodes_by_terms
+
+
+TERMS = ['a.size', '-a.path']
+
+
+def main(groups=500, nodes=100):
+    path = make_bucket_file(groups, nodes)
+    settings_dir = tempfile.mkdtemp()
+    try:
+        settings = Settings(settings_dir=settings_dir,
+                            settings_file=os.path.join(settings_dir, 'x.yml'))
+        bucket = settings.to_bucket('bench', path, read_only=True)
+        all_nodes = [node for group in bucket.root.node_vals
+                     for node in group.node_vals]
+        for node in all_nodes:
+            node.attrs
+
+        def sort_by_key_lists():
+            # the descending term is not expressible with a single key
+            sorted(all_nodes, key=lambda node: [
+                get_attr(node, 'size'), get_attr(node, 'path')])
+
+        def sort_by_terms():
+            sort_nodes_by_terms(TERMS, list(all_nodes), False, {})
+
+        report('key lists (%d nodes)' % len(all_nodes),
+               timeit(sort_by_key_lists))
+        report('sort engine (%s)' % ', '.join(TERMS), timeit(sort_by_terms))
+    finally:
+        os.remove(path)
+        shutil.rmtree(settings_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
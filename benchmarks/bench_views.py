@@ -0,0 +1,51 @@
+"""
+Time requests of the index and search views of the flask plugin for buckets
+of different sizes.  The results are cached after the first request, so the
+time is mostly rendering the first page, which does not depend on the total
+number of nodes since the views only pass the nodes of the page to the
+templates.
+
+    python benchmarks/bench_views.py [TOTAL ...]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from common import make_bucket_file, timeit, report
+from momo.settings import Settings
+from momo.plugins.flask import app, plugin
+
+
+TOTALS = [1000, 10000, 50000]
+
+
+def setup_plugin(settings_dir, path):
+    settings = Settings(settings_dir=settings_dir,
+                        settings_file=os.path.join(settings_dir, 'x.yml'))
+    settings._settings = {'buckets': {'bench': path}}
+    settings.cbn = 'bench'
+    plugin.settings = settings
+    plugin.setup()
+
+
+def main(*totals):
+    for total in totals or TOTALS:
+        # one node per group, so that the index lists all of them
+        path = make_bucket_file(total, 1)
+        settings_dir = tempfile.mkdtemp()
+        try:
+            setup_plugin(settings_dir, path)
+            client = app.test_client()
+            for name, url in (('index', '/'),
+                              ('search', '/search/?q=group')):
+                client.get(url)  # cache the nodes
+                report('%s (%d nodes)' % (name, total),
+                       timeit(lambda: client.get(url), repeat=5))
+        finally:
+            os.remove(path)
+            shutil.rmtree(settings_dir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
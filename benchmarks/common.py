@@ -0,0 +1,55 @@
+"""Helpers shared by the benchmark scripts."""
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir)))
+
+
+def make_bucket_text(groups=400, nodes=100, depth=1):
+    """
+    Generate the text of a bucket document with `groups` top-level nodes,
+    each having `nodes` child nodes with a few attributes.  If `depth` is
+    larger than 1, each child node nests `depth - 1` levels of single nodes.
+    """
+    lines = []
+    for i in range(groups):
+        lines.append('group%d:' % i)
+        for j in range(nodes):
+            indent = '    '
+            lines.append('%snode%d_%d:' % (indent, i, j))
+            for k in range(1, depth):
+                indent += '    '
+                lines.append('%slevel%d:' % (indent, k))
+            indent += '    '
+            lines.append("%spath: '/data/%d/%d.pdf'" % (indent, i, j))
+            lines.append('%stags: [tag%d, tag%d]' % (indent, j % 10, i % 7))
+            lines.append('%ssize: %d' % (indent, (i * 7919 + j) % 1000))
+    return '\n'.join(lines) + '\n'
+
+
+def make_bucket_file(*args, **kwargs):
+    """Write a generated bucket to a temporary file and return its path."""
+    fd, path = tempfile.mkstemp(suffix='.yml')
+    with os.fdopen(fd, 'w') as f:
+        f.write(make_bucket_text(*args, **kwargs))
+    return path
+
+
+def timeit(func, repeat=3):
+    """Return the best wall time of calling func `repeat` times."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, seconds):
+    print('%-40s %10.2f ms' % (name, seconds * 1000))
@@ -2,9 +2,40 @@ class Document(object):
     def __init__(self, name, path):
         self.name = name
         self.path = path
+        # the journal of operations to replay on the loaded content
+        self.journal = None
+        # digest of the loaded or dumped document
+        self.digest = None
 
     def load(self):
         raise NotImplementedError
 
     def dump(self, content):
         raise NotImplementedError
+
+    def load_journal(self):
+        """
+        Load the journal entries that have not been compacted into the
+        document.
+
+        :return: a list of (op, path, args) tuples.
+        """
+        if self.journal is None:
+            return []
+        return self.journal.load(self.digest)
+
+    def record(self, op, path, args):
+        """
+        Record an operation in the journal.
+
+        :return: the number of entries in the journal, or None if the
+                 document has no journal.
+        """
+        if self.journal is None:
+            return None
+        self.journal.append(self.digest, op, path, args)
+        return len(self.journal)
+
+
+class DocumentError(Exception):
+    pass
@@ -0,0 +1,147 @@
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from momo.utils import fsync_dir
+import json
+import logging
+import os
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_VERSION = 1
+JOURNAL_EXT = '.journal'
+# extension of a journal moved aside since it does not match the document
+STALE_EXT = '.stale'
+
+
+class Journal(object):
+    """
+    An append-only journal of operations on a bucket, stored next to the
+    bucket document.
+
+    Each line is a JSON list.  The first line is a header that records the
+    digest of the document the journal applies to, so that a journal that has
+    already been compacted into the document (or that belongs to a document
+    that has since been edited) is not replayed, since its operations may
+    already be in the document.  Such a journal is moved aside (with the
+    ".stale" extension) rather than removed, and an error that tells how many
+    operations were not applied is printed, so that they can be recovered by
+    hand.  The other lines are entries in the form of [op, path, arg1, arg2,
+    ...].
+
+    :param path: path to the bucket document.
+    :param fsync_batch: the number of appended entries after which the
+                        journal is flushed to disk.  1 makes every entry
+                        durable before `append` returns; larger values batch
+                        the flushes at the risk of losing the last entries on
+                        a system crash.
+
+    """
+
+    def __init__(self, path, fsync_batch=1):
+        self.path = path + JOURNAL_EXT
+        self.fsync_batch = fsync_batch
+        self._len = None
+
+    def load(self, digest):
+        """
+        Load the journal entries.
+
+        :param digest: digest of the current bucket document.
+        :return: a list of (op, path, args) tuples.
+
+        """
+        entries = []
+        if not os.path.exists(self.path):
+            self._len = 0
+            return entries
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        header = self._decode(lines[0]) if lines else None
+        if header != ['journal', JOURNAL_VERSION, digest]:
+            self._move_aside(len(lines) - 1)
+            return entries
+        for line in lines[1:]:
+            entry = self._decode(line)
+            if entry is None:
+                # the last entry may be partially written
+                break
+            op, path, args = entry[0], entry[1], entry[2:]
+            entries.append((op, path, args))
+        self._len = len(entries)
+        return entries
+
+    def append(self, digest, op, path, args):
+        """
+        Append an entry to the journal.
+
+        :param digest: digest of the bucket document.
+        :param op: the operation, which is "add" or "delete".
+        :param path: path to the element the operation applies to.
+        :param args: a list of arguments of the operation.
+
+        """
+        if self._len is None:
+            self.load(digest)
+        lines = []
+        mode = 'a'
+        if not self._len:
+            # start a new journal
+            mode = 'w'
+            lines.append(self._encode(['journal', JOURNAL_VERSION, digest]))
+        lines.append(self._encode([op, list(path)] + list(args)))
+        with open(self.path, mode) as f:
+            f.write(''.join(lines))
+            f.flush()
+            # count by the entries of the journal rather than of this
+            # process, since each command appends in a new process
+            if (self._len + 1) % self.fsync_batch == 0:
+                os.fsync(f.fileno())
+        if mode == 'w' and self.fsync_batch == 1:
+            fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        self._len += 1
+
+    def clear(self):
+        """
+        Remove the journal.  It is only called once the journal has been
+        compacted into the document.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._len = 0
+
+    def _move_aside(self, size):
+        """
+        Move the journal aside since it does not match the document, without
+        overwriting journals that were moved aside before.
+
+        :param size: the number of entries of the journal.
+        """
+        stale_path = self.path + STALE_EXT
+        n = 1
+        while os.path.exists(stale_path):
+            stale_path = '%s%s.%d' % (self.path, STALE_EXT, n)
+            n += 1
+        os.rename(self.path, stale_path)
+        if size > 0:
+            print('error: the bucket document has changed since its last %d '
+                  'operation(s) were journaled, so they were not applied.  '
+                  'They are kept in %s.' % (size, stale_path),
+                  file=sys.stderr)
+        else:
+            logger.warning('journal %s does not match the bucket document, '
+                           'moved to %s', self.path, stale_path)
+        self._len = 0
+
+    def __len__(self):
+        return self._len or 0
+
+    def _encode(self, obj):
+        return json.dumps(obj) + '\n'
+
+    def _decode(self, line):
+        try:
+            return json.loads(line, object_pairs_hook=OrderedDict)
+        except ValueError:
+            return None
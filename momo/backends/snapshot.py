@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from momo.utils import mkdir_p, atomic_write
+from ruamel.yaml.scalarbool import ScalarBoolean
+import hashlib
+import marshal
+import os
+import six
+import sys
+
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_EXT = '.snapshot'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot(object):
+    """
+    A compact, pre-parsed copy of a bucket document stored in a cache
+    directory.
+
+    A snapshot is only valid for the exact bytes it was made from: it is keyed
+    on the document's path, mtime, size and content hash.  Mappings are stored
+    as tuples of key-value pairs and sequences as lists, so that the snapshot
+    can be written with `marshal` and loaded back into ordered dicts without
+    going through a YAML parser.
+
+    :param path: path to the bucket document.
+    :param cache_dir: directory to store the snapshot in.
+    :param mode: name of the loading mode.  Each mode has its own snapshot,
+                 since different parsers may load the same document
+                 differently.
+
+    """
+
+    def __init__(self, path, cache_dir, mode='default'):
+        self.path = os.path.abspath(path)
+        self.cache_dir = cache_dir
+        digest = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        self.cache_path = os.path.join(
+            cache_dir, '%s.%s%s' % (digest, mode, SNAPSHOT_EXT))
+
+    def make_key(self, digest):
+        """
+        Make the key of the document.
+
+        :param digest: the SHA-1 hex digest of the document's content.
+        :return: a tuple that identifies the document.
+
+        """
+        st = os.stat(self.path)
+        return (SNAPSHOT_VERSION, sys.version_info[:2], self.path,
+                st.st_mtime, st.st_size, digest)
+
+    def load(self, key):
+        """
+        Load the snapshot.
+
+        :param key: the key of the current document (see `make_key`).
+        :return: the content, or None if the snapshot is missing or stale.
+
+        """
+        try:
+            with open(self.cache_path, 'rb') as f:
+                snapshot_key, packed = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if snapshot_key != key:
+            return None
+        return unpack(packed)
+
+    def dump(self, key, content):
+        """
+        Dump the content as the snapshot of the document identified by `key`.
+        Content that cannot be packed (such as timestamps) is not cached.
+
+        :return: whether the snapshot has been written.
+
+        """
+        try:
+            packed = pack(content)
+        except SnapshotError:
+            self.clear()
+            return False
+        mkdir_p(self.cache_dir)
+        with atomic_write(self.cache_path, fsync=False) as f:
+            marshal.dump((key, packed), f)
+        return True
+
+    def clear(self):
+        """Remove the snapshot."""
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+
+def pack(content):
+    """Pack the content into the compact form."""
+    if isinstance(content, dict):
+        return tuple((pack(k), pack(v)) for k, v in content.items())
+    elif isinstance(content, list):
+        return [pack(item) for item in content]
+    elif content is None or isinstance(content, bool):
+        return content
+    elif isinstance(content, ScalarBoolean):
+        return bool(content)
+    elif isinstance(content, six.text_type):
+        return six.text_type(content)
+    elif isinstance(content, six.binary_type):
+        return six.binary_type(content)
+    elif isinstance(content, six.integer_types):
+        return int(content)
+    elif isinstance(content, float):
+        return float(content)
+    raise SnapshotError('cannot pack type %s' % type(content).__name__)
+
+
+def unpack(packed):
+    """Unpack the compact form into ordered dicts and lists."""
+    if isinstance(packed, tuple):
+        return OrderedDict((k, unpack(v)) for k, v in packed)
+    elif isinstance(packed, list):
+        return [unpack(item) for item in packed]
+    return packed
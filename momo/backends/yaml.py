@@ -1,10 +1,89 @@
 from __future__ import absolute_import
-from momo.backends.base import Document
+from collections import OrderedDict
+from momo.backends.base import Document, DocumentError
+from momo.backends.journal import Journal
+from momo.backends.snapshot import Snapshot
+from momo.utils import atomic_write
+from ruamel.yaml.comments import CommentedMap, CommentedSeq
+import hashlib
+import re
 import ruamel.yaml
+import six
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 INDENT = 4
 BLOCK_SEQ_INDENT = 4
 WIDTH = 500
+# journal entries to batch per fsync in the fast writes mode
+FAST_WRITES_FSYNC_BATCH = 100
+
+
+# implicit resolvers of YAML 1.2 (as of ruamel.yaml) for the scalars that
+# resolve differently in YAML 1.1, such as yes/no/on/off, 010 and 1:30
+YAML12_IMPLICIT_RESOLVERS = [
+    (u'tag:yaml.org,2002:bool',
+     re.compile(u'''^(?:true|True|TRUE|false|False|FALSE)$''', re.X),
+     list(u'tTfF')),
+    (u'tag:yaml.org,2002:float',
+     re.compile(u'''^(?:
+         [-+]?(?:[0-9][0-9_]*)\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
+        |[-+]?(?:[0-9][0-9_]*)(?:[eE][-+]?[0-9]+)
+        |[-+]?\\.[0-9_]+(?:[eE][-+][0-9]+)?
+        |[-+]?\\.(?:inf|Inf|INF)
+        |\\.(?:nan|NaN|NAN))$''', re.X),
+     list(u'-+0123456789.')),
+    (u'tag:yaml.org,2002:int',
+     re.compile(u'''^(?:[-+]?0b[0-1_]+
+        |[-+]?0o?[0-7_]+
+        |[-+]?[0-9_]+
+        |[-+]?0x[0-9a-fA-F_]+)$''', re.X),
+     list(u'-+0123456789')),
+]
+
+
+class ReadOnlyLoader(SafeLoader):
+    """
+    The (libyaml-accelerated if available) safe loader that loads mappings
+    into plain ordered dicts, without round-trip metadata.
+
+    Scalars are resolved as in YAML 1.2, like the round-trip loader, so that
+    a document loads the same either way.
+    """
+
+
+def _construct_ordered_mapping(loader, node):
+    loader.flatten_mapping(node)
+    return OrderedDict(loader.construct_pairs(node, deep=True))
+
+
+def _construct_yaml12_int(loader, node):
+    value = loader.construct_scalar(node).replace('_', '')
+    sign = 1
+    if value[0] in '+-':
+        if value[0] == '-':
+            sign = -1
+        value = value[1:]
+    for prefix, base in (('0b', 2), ('0o', 8), ('0x', 16)):
+        if value.startswith(prefix):
+            return sign * int(value[2:], base)
+    # leading zeros are not octal in YAML 1.2
+    return sign * int(value)
+
+
+ReadOnlyLoader.yaml_implicit_resolvers = dict(
+    (first, [(tag, regexp) for tag, regexp in resolvers
+             if tag not in [r[0] for r in YAML12_IMPLICIT_RESOLVERS]])
+    for first, resolvers in SafeLoader.yaml_implicit_resolvers.items())
+for _tag, _regexp, _first in YAML12_IMPLICIT_RESOLVERS:
+    ReadOnlyLoader.add_implicit_resolver(_tag, _regexp, _first)
+ReadOnlyLoader.add_constructor(
+    yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_ordered_mapping)
+ReadOnlyLoader.add_constructor(u'tag:yaml.org,2002:int', _construct_yaml12_int)
 
 
 class BucketDocument(Document):
@@ -13,30 +92,129 @@ class BucketDocument(Document):
 
     :param name: name of the bucket.
     :param path: path to the bucket document.
+    :param cache_dir: directory for the snapshot cache.  If None, the document
+                      is always parsed.
+    :param read_only: whether the document is only loaded and never dumped,
+                      in which case comments and quoting are not kept.
+    :param journal: whether to keep a journal of operations next to the
+                    document.
+    :param fast_writes: whether to skip flushing dumps to disk and batch the
+                        flushes of journal entries.  Writes are still atomic,
+                        but the latest ones may be lost on a system crash.
 
     """
 
-    def __init__(self, name, path):
+    def __init__(self, name, path, cache_dir=None, read_only=False,
+                 journal=False, fast_writes=False):
         super(BucketDocument, self).__init__(name, path)
+        self.read_only = read_only
+        self.fast_writes = fast_writes
+        if journal:
+            fsync_batch = FAST_WRITES_FSYNC_BATCH if fast_writes else 1
+            self.journal = Journal(path, fsync_batch=fsync_batch)
+        self.snapshot = None
+        if cache_dir is not None:
+            mode = 'safe' if read_only else 'round_trip'
+            self.snapshot = Snapshot(path, cache_dir, mode=mode)
+        # whether the last loaded content carries comments and quoting
+        self.round_trip = False
 
     def load(self):
         """
-        Load the bucket.
+        Load the bucket.  The snapshot is used if it is up to date with the
+        document; otherwise the document is parsed and the snapshot refreshed.
 
         :return: the loaded content.
 
         """
-        with open(self.path) as f:
-            return ruamel.yaml.load(f.read(), ruamel.yaml.RoundTripLoader,
-                                    preserve_quotes=True)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.digest = hashlib.sha1(data).hexdigest()
+        if self.snapshot is not None:
+            key = self.snapshot.make_key(self.digest)
+            content = self.snapshot.load(key)
+            if content is not None:
+                self.round_trip = False
+                return content
+        content = self._parse(data)
+        self.round_trip = not self.read_only
+        if self.snapshot is not None:
+            self.snapshot.dump(key, content)
+        return content
+
+    def _parse(self, data):
+        if self.read_only:
+            return yaml.load(data, ReadOnlyLoader)
+        return ruamel.yaml.load(data.decode('utf-8'),
+                                ruamel.yaml.RoundTripLoader,
+                                preserve_quotes=True)
 
     def dump(self, content):
         """
-        Dump the content to the bucket file.
+        Dump the content to the bucket file.  If the content was loaded from
+        the snapshot, the document is parsed again and the content is merged
+        into it, so that comments and quoting are written back.  The journal
+        is cleared since it has been compacted into the document.
+
+        The document is replaced atomically, so that a crash or a concurrent
+        reader never sees it half-written.
         """
-        with open(self.path, 'w') as f:
-            ruamel.yaml.round_trip_dump(content, f,
-                                        default_flow_style=False,
-                                        indent=INDENT,
-                                        block_seq_indent=BLOCK_SEQ_INDENT,
-                                        width=WIDTH, tags=None)
+        if self.read_only:
+            raise DocumentError(
+                'cannot dump read-only document "%s"' % self.name)
+        if not self.round_trip:
+            with open(self.path, 'rb') as f:
+                content = merge_content(self._parse(f.read()), content)
+        stream = six.StringIO()
+        ruamel.yaml.round_trip_dump(content, stream,
+                                    default_flow_style=False,
+                                    indent=INDENT,
+                                    block_seq_indent=BLOCK_SEQ_INDENT,
+                                    width=WIDTH, tags=None)
+        data = stream.getvalue().encode('utf-8')
+        with atomic_write(self.path, fsync=not self.fast_writes) as f:
+            f.write(data)
+        self.digest = hashlib.sha1(data).hexdigest()
+        if self.journal is not None:
+            self.journal.clear()
+        if self.snapshot is not None:
+            self.snapshot.dump(self.snapshot.make_key(self.digest), content)
+
+
+def merge_content(old, new):
+    """
+    Merge the new content into the old round-trip content.  Values that are
+    unchanged are kept, along with their comments and quoting.
+
+    :return: the merged content.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in [key for key in old if key not in new]:
+            del old[key]
+        for key, value in new.items():
+            if key in old:
+                old[key] = merge_content(old[key], value)
+            else:
+                old[key] = to_round_trip(value)
+        return old
+    elif isinstance(old, list) and isinstance(new, list):
+        merged = [merge_content(o, n) for o, n in zip(old, new)]
+        merged.extend(to_round_trip(n) for n in new[len(old):])
+        old[:] = merged
+        return old
+    elif type(old) is not type(new) and (isinstance(old, bool) or
+                                         isinstance(new, bool)):
+        return new
+    elif old == new:
+        return old
+    return to_round_trip(new)
+
+
+def to_round_trip(content):
+    """Convert plain dicts and lists to their round-trip counterparts."""
+    if isinstance(content, dict):
+        return CommentedMap(
+            (k, to_round_trip(v)) for k, v in content.items())
+    elif isinstance(content, list):
+        return CommentedSeq(to_round_trip(item) for item in content)
+    return content
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import
 import inspect
+import itertools
 import logging
 import os
 import sys
@@ -18,6 +19,8 @@ from momo.utils import (txt_type, utf8_decode, page_lines, eval_path,
 
 
 INDENT_UNIT = '  '
+# commands that never dump the bucket, for which it is loaded read-only
+READ_ONLY_COMMANDS = ('ls', 'buckets', 'e', 'cd', 'pl', 'serve')
 LINES = []  # cached lines
 # the log file for momo serve command if it's run in background
 SERVE_LOG_FILE = os.path.join(DEFAULT_SETTINGS_DIR, 'serve.log')
@@ -34,6 +37,7 @@ class MomoCliApp(App):
             )
         self.bucket = None
         self.cbn = None
+        self.read_only = False
 
     def build_option_parser(self, description, version,
                             argparse_kwargs=None):
@@ -44,13 +48,15 @@ class MomoCliApp(App):
         return parser
 
     def initialize_app(self, argv):
+        # the interactive mode (no argv) may run any command
+        self.read_only = bool(argv) and argv[0] in READ_ONLY_COMMANDS
         self.use_bucket(self.options.bucket)
 
     def use_bucket(self, bucket_name):
         settings.cbn = bucket_name
         if self.cbn != bucket_name:  # only load bucket from path if changed
             self.cbn = bucket_name
-            self.bucket = settings.bucket
+            self.bucket = settings.get_bucket(read_only=self.read_only)
 
     def configure_logging(self):
         """Create logging handlers for any log output.
@@ -330,7 +336,7 @@ class Reload(Command):
         return p
 
     def take_action(self, parsed_args):
-        self.app.bucket = settings.bucket
+        self.app.bucket = settings.get_bucket(read_only=self.app.read_only)
 
 
 class Buckets(Command):
@@ -449,15 +455,14 @@ def do_ls(bucket, args, parser):
         show_path=args.path,
         elem_type=args.type,
         expand_attr=args.expand,
-        cache_lines=True,
+        cache_lines=False,
         no_output=False,
         short_output=args.short,
         to_open=args.open,
         run=args.run,
         cmd=args.cmd,
     )
-    indexer.ls()
-    page_lines(indexer.lines)
+    page_lines(indexer.ls())
 
 
 def do_add(bucket, args, parser):
@@ -480,8 +485,10 @@ def do_add(bucket, args, parser):
                 'argument -n/--name is required for adding elements to nodes '
                 'and non-list-type attributes')
         elem.add(name, contents)
+        bucket.record('add', elem, name, contents)
     else:
         elem.add(contents)
+        bucket.record('add', elem, contents)
     if isinstance(contents, list):
         msg = 'list-type attribute "%s" added' % name
     elif isinstance(contents, OrderedDict):
@@ -506,6 +513,7 @@ def do_add_path(bucket, args, parser):
     name = args.name or os.path.basename(path)
     content = OrderedDict([('path', path)])
     elem.add(name, content)
+    bucket.record('add', elem, name, content)
     print('file "%s" added to %s "%s"' % (name, elem.type.lower(), elem))
 
 
@@ -523,6 +531,7 @@ def do_remove(bucket, args, parser):
     elem = indexer.get()
     parent = elem.parent
     parent.delete(elem.name)
+    bucket.record('delete', parent, elem.name)
     print('%s "%s" removed from %s "%s"' % (
           elem.type.lower(), elem, parent.type.lower(), parent))
 
@@ -579,12 +588,23 @@ def do_pl(plugin, args):
 
 
 class Indexer(object):
+    """
+    The Indexer class, which navigates to an element by names or numbers and
+    lists it.
+
+    :param cache_lines: whether `ls` collects all the output lines into
+                        `self.lines`.  If False, the listing of the element is
+                        generated lazily as it is consumed, so that large
+                        listings are streamed in constant memory.
+    """
+
     def __init__(self, elem, parser, names, unordered=True, show_path=False,
                  elem_type=None, expand_attr=False, cache_lines=False,
                  no_output=False, short_output=False, to_open=False, run=False,
                  cmd=False):
         self.lines = []
         self.elem = elem
+        self.cache_lines = cache_lines
         configs.no_output = no_output
         configs.short_output = short_output
         self.parser = parser
@@ -598,7 +618,18 @@ class Indexer(object):
         self.cmd = cmd
 
     def ls(self):
-        self._ls(return_elem=False)
+        """
+        Navigate to the element and list it.
+
+        :return: an iterator of output lines.  The lines printed while
+                 navigating come first, followed by the listing, which is
+                 generated lazily unless `cache_lines` is True.
+        """
+        lines = itertools.chain(self.lines, self._ls(return_elem=False))
+        if self.cache_lines:
+            self.lines = list(lines)
+            return iter(self.lines)
+        return lines
 
     def get(self):
         return self._ls(return_elem=True)
@@ -622,11 +653,12 @@ class Indexer(object):
             if names:
                 self.parser.error('too many names or numbers')
         if self._ls_action(action):
-            self.ls_elem(elem,
-                         show_path=self.show_path,
-                         elem_type=self.elem_type,
-                         unordered=self.unordered,
-                         expand_attr=self.expand_attr)
+            return self.iter_elem(elem,
+                                  show_path=self.show_path,
+                                  elem_type=self.elem_type,
+                                  unordered=self.unordered,
+                                  expand_attr=self.expand_attr)
+        return iter(())
 
     def _ls_action(self, action):
         if self.to_open:
@@ -648,8 +680,11 @@ class Indexer(object):
             return True
 
     def print_path(self, elem):
+        self.lines.append(self._path_line(elem))
+
+    def _path_line(self, elem):
         indent = INDENT_UNIT * (elem.level - 1)
-        self.lines.append('%s%s' % (indent, elem.name))
+        return '%s%s' % (indent, elem.name)
 
     def ls_elem(self, elem, *args, **kwargs):
         if elem.is_node:
@@ -657,6 +692,22 @@ class Indexer(object):
         elif elem.is_attr:
             return self.attr_ls(elem, *args, **kwargs)
 
+    def iter_elem(self, elem, show_path=False, sort_by=None, unordered=False,
+                  elem_type=None, expand_attr=False):
+        """
+        Generate the lines that list the element.  The arguments are the same
+        as those of `node_ls` and `attr_ls`.
+        """
+        if elem.is_node:
+            if show_path and not elem.is_root:
+                yield self._path_line(elem)
+            for line in self._node_ls_all(elem, show_path, sort_by,
+                                          unordered, elem_type):
+                yield line
+        elif elem.is_attr:
+            for line in self._attr_ls_all(elem, show_path, expand_attr):
+                yield line
+
     def node_ls(self, node, name_or_num=None, show_path=False, sort_by=None,
                 unordered=False, elem_type=None, **kwargs):
         """
@@ -681,8 +732,8 @@ class Indexer(object):
         if show_path and not node.is_root:
             self.print_path(node)
         if name_or_num is None:
-            self._node_ls_all(node, show_path, sort_by, unordered,
-                              elem_type)
+            self.lines.extend(self._node_ls_all(node, show_path, sort_by,
+                                                unordered, elem_type))
         else:
             elem = None
             try:
@@ -691,7 +742,7 @@ class Indexer(object):
                 pass
             if isinstance(name_or_num, int):
                 if str(name_or_num) in node.elems:
-                    elem = node.get_elem_by_name(name_or_num)
+                    elem = node.get_elem_by_name(str(name_or_num))
                 else:
                     elem = node.get_elem_by_num(
                         name_or_num, sort_by, unordered, elem_type)
@@ -708,10 +759,9 @@ class Indexer(object):
         fmt = '%s%{}d [%s] %s'.format(width)
         for num, elem in enumerate(vals, start=1):
             if not configs.short_output:
-                self.lines.append(
-                    fmt % (indent, num, elem.type[0], elem.name))
+                yield fmt % (indent, num, elem.type[0], elem.name)
             else:
-                self.lines.append(elem.name)
+                yield elem.name
 
     def attr_ls(self, attr, name_or_num=None, show_path=False,
                 expand_attr=False, **kwargs):
@@ -720,7 +770,7 @@ class Indexer(object):
         the matched item of the content.
         """
         if name_or_num is None:
-            self._attr_ls_all(attr, show_path, expand_attr)
+            self.lines.extend(self._attr_ls_all(attr, show_path, expand_attr))
         else:
             return self._attr_lsattr(attr, name_or_num, show_path, expand_attr)
 
@@ -760,24 +810,23 @@ class Indexer(object):
             content = attr.parent.action.expand_attr(attr.name)
         if attr.has_items:
             if not configs.short_output:
-                self.lines.append('%s%s:' % (indent, attr.name))
+                yield '%s%s:' % (indent, attr.name)
             indent += INDENT_UNIT
             width = len(str(len(content)))
             fmt = '%s%{}d %s'.format(width)
             for num, item in enumerate(content, start=1):
                 if not configs.short_output:
-                    self.lines.append(fmt % (indent, num, item))
+                    yield fmt % (indent, num, item)
                 else:
-                    self.lines.append(item)
+                    yield item
         elif isinstance(content, (txt_type, bool, int, float)):
             if not configs.short_output:
-                self.lines.append(
-                    '%s%s: %s' % (indent, attr.name, content))
+                yield '%s%s: %s' % (indent, attr.name, content)
             else:
-                self.lines.append(content)
+                yield content
         elif content is None:
             if not configs.short_output:
-                self.lines.append('%s%s: %s' % (indent, attr.name, ''))
+                yield '%s%s: %s' % (indent, attr.name, '')
         else:
             raise AttrError('unknown type for attribute content')
 
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import
 from operator import attrgetter
+import heapq
 from momo.utils import txt_type, PY3, utf8_decode
 from momo.actions import NodeAction, AttributeAction
 from momo.backends import OrderedDict
-import sys
+import logging
 
 
 ROOT_NODE_NAME = '(root)'
 PLACEHOLDER = '__placeholder__'
+JOURNAL_OPS = ('add', 'delete')
+# an element numbered up to this fraction of the elements is selected without
+# sorting them all, beyond which a (cached) sort is faster
+SELECT_MAX_FRACTION = 0.05
+
+logger = logging.getLogger(__name__)
 
 
 # Runtime configurations
@@ -26,6 +33,8 @@ configs = Configs()
 
 
 class Base(object):
+    __slots__ = ()
+
     def __repr__(self):
         try:
             u = self.__str__()
@@ -64,10 +73,42 @@ class Bucket(Base):
 
     def load(self):
         self._content = self.document.load()
+        self._root = None
+        self._replay(self.document.load_journal())
 
     def dump(self):
         self.document.dump(self.content)
 
+    def record(self, op, elem, *args):
+        """
+        Record an operation that has been applied to an element, so that it
+        is replayed when the bucket is loaded next time.  The bucket is dumped
+        once the journal grows to the "journal_compact_size" setting, which
+        compacts the journal into the document.  The dump runs inline, so the
+        command that records the operation pays for writing the whole
+        document.
+
+        :param op: the name of the element's method, "add" or "delete".
+        :param elem: the element.
+        :param args: the arguments passed to the method.
+        """
+        size = self.document.record(op, elem.path, args)
+        if size is not None and size >= self.settings.journal_compact_size:
+            self.dump()
+
+    def _replay(self, entries):
+        for op, path, args in entries:
+            try:
+                if op not in JOURNAL_OPS:
+                    raise ElemError('unknown operation "%s"' % op)
+                elem = self.root
+                for name in path:
+                    elem = elem.get_elem_by_name(name)
+                getattr(elem, op)(*args)
+            except (ElemError, NodeError, AttrError) as e:
+                logger.warning('cannot replay "%s" on "%s": %s',
+                               op, '/'.join(path), e)
+
     @property
     def root(self):
         """
@@ -88,7 +129,14 @@ class Bucket(Base):
 class Element(Base):
     """
     The Element class.
+
+    Elements use slots to keep large buckets compact.  The "__dict__" slot
+    still allows attaching other attributes, and the dictionary is only
+    created when it is used.
     """
+    __slots__ = ('name', 'bucket', 'parent', 'content', '_action', '_path',
+                 '_level', '__dict__')
+
     def __init__(self, name, bucket, parent, content):
         """
         :param no_output: whether to suppress output.
@@ -97,25 +145,46 @@ class Element(Base):
         self.bucket = bucket
         self.parent = parent
         self.content = content
+        self._action = None
         if parent is None:
-            self.path = []
+            self._path = ()
+            self._level = 0
         else:
-            self.path = parent.path[:]
-            self.path.append(self.name)
-        self._action = None
+            self._path = None
+            self._level = parent._level + 1
 
     @property
     def action(self):
+        """The action object of this element, which is created lazily."""
+        if self._action is None:
+            self._action = self._make_action()
         return self._action
 
+    def _make_action(self):
+        return None
+
+    @property
+    def path(self):
+        """
+        A tuple of names of the elements from the root to this element.  It is
+        built from the parent's path the first time it is asked for, and the
+        paths of ancestors are cached along the way.
+        """
+        if self._path is None:
+            elems = []
+            elem = self
+            while elem._path is None:
+                elems.append(elem)
+                elem = elem.parent
+            path = elem._path
+            for elem in reversed(elems):
+                path = path + (elem.name,)
+                elem._path = path
+        return self._path
+
     @property
     def level(self):
-        parent = self.parent
-        res = 0
-        while parent is not None:
-            parent = parent.parent
-            res += 1
-        return res
+        return self._level
 
     @property
     def is_node(self):
@@ -149,18 +218,27 @@ class Node(Element):
     """
     The Node class.
     """
+    __slots__ = ('_elems', '_vals', '_nodes', '_node_vals', '_attrs',
+                 '_attr_vals', '_sorted', '_i')
+
     def __init__(self, name, bucket, parent, content, *args, **kwargs):
         super(Node, self).__init__(name, bucket, parent, content,
                                    *args, **kwargs)
         self._elems = None
         self._vals = None
+        self._nodes = None
+        self._node_vals = None
+        self._attrs = None
+        self._attr_vals = None
+        self._sorted = None
         self._i = 0
-        self._len = None
         if not self.bucket.settings.lazy_bucket:
             # self.elems is called here so that the next-level elements are
             # loaded and the classes of the current elements are updated
-            self._len = len(self.elems)
-        self._action = NodeAction(self)
+            self.elems
+
+    def _make_action(self):
+        return NodeAction(self)
 
     @property
     def is_root(self):
@@ -170,65 +248,111 @@ class Node(Element):
     def elems(self):
         """
         Get elements of this node.
+
+        The elements are also partitioned by type into nodes and attributes
+        when they are loaded, and the partitions are maintained by `add` and
+        `delete`.  To save memory, a partition is None if it is empty, and it
+        is the same object as the elements if they are all of its type.
         """
         if self._elems is None:
-            this_is_dir = False
-            this_is_file = False
-            self._elems = OrderedDict()
             if not isinstance(self.content, dict):
                 raise NodeError('invalid content format')
+            self._elems = OrderedDict()
+            self._vals = []
             for name in self.content:
-                content = self.content[name]
-                elem, this_is_dir, this_is_file = self._make_elem(name,
-                                                                  content)
-                self._elems[name] = elem
-            self._update_class(this_is_dir, this_is_file)
-            self._vals = self._elems.values()
+                self._insert_elem(self._make_elem(name, self.content[name]))
+            self._update_class()
         return self._elems
 
-    def _update_class(self, this_is_dir, this_is_file):
-        """Update node's class to Directory or File."""
-        if this_is_dir is True:
+    def _update_class(self):
+        """
+        Update node's class to Directory or File.  A directory (such as the
+        root) stays a directory when its last child node is deleted.
+        """
+        if self._nodes or isinstance(self, Directory):
             self.__class__ = Directory
-        elif this_is_file is True:
+        elif self._attrs:
             self.__class__ = File
 
     def _make_elem(self, name, content):
         """
         Make a proper element based on the content.
 
-        :return: new child element, whether self should be a file, and whether
-                 self should be a directory.
+        :return: new child element.
         """
-        this_is_dir = self.is_dir
-        this_is_file = self.is_file
-        is_dict = isinstance(content, dict)
-        if not is_dict:
-            this_is_file = True
-            elem = (
-                Attribute(name=name,
-                          bucket=self.bucket,
-                          parent=self,
-                          content=content)
-            )
+        if not isinstance(content, dict):
+            return Attribute(name=name,
+                             bucket=self.bucket,
+                             parent=self,
+                             content=content)
+        return Node(name=name,
+                    bucket=self.bucket,
+                    parent=self,
+                    content=content)
+
+    def _insert_elem(self, elem):
+        """Insert a new element into the elements and its partition."""
+        if elem.is_node:
+            if self._nodes is None:
+                if self._attrs is None:
+                    self._nodes, self._node_vals = self._elems, self._vals
+                else:
+                    self._split_partitions()
+                    self._nodes, self._node_vals = OrderedDict(), []
+            if self._nodes is not self._elems:
+                self._nodes[elem.name] = elem
+                self._node_vals.append(elem)
+        else:
+            if self._attrs is None:
+                if self._nodes is None:
+                    self._attrs, self._attr_vals = self._elems, self._vals
+                else:
+                    self._split_partitions()
+                    self._attrs, self._attr_vals = OrderedDict(), []
+            if self._attrs is not self._elems:
+                self._attrs[elem.name] = elem
+                self._attr_vals.append(elem)
+        self._elems[elem.name] = elem
+        self._vals.append(elem)
+
+    def _remove_elem(self, name):
+        """Remove an element from the elements and its partition."""
+        elem = self._elems.pop(name)
+        self._vals.remove(elem)
+        if elem.is_node:
+            if self._nodes is not self._elems:
+                del self._nodes[name]
+                self._node_vals.remove(elem)
+                if not self._nodes:
+                    self._nodes = self._node_vals = None
+                    self._attrs, self._attr_vals = self._elems, self._vals
         else:
-            this_is_dir = True
-            elem = Node(name=name,
-                        bucket=self.bucket,
-                        parent=self,
-                        content=content)
-        return elem, this_is_dir, this_is_file
+            if self._attrs is not self._elems:
+                del self._attrs[name]
+                self._attr_vals.remove(elem)
+                if not self._attrs:
+                    self._attrs = self._attr_vals = None
+                    self._nodes, self._node_vals = self._elems, self._vals
+
+    def _split_partitions(self):
+        """Copy the partition that is the same object as the elements."""
+        if self._nodes is self._elems:
+            self._nodes = OrderedDict(self._elems)
+            self._node_vals = list(self._vals)
+        elif self._attrs is self._elems:
+            self._attrs = OrderedDict(self._elems)
+            self._attr_vals = list(self._vals)
 
     @property
     def svals(self):
         """Shortcut to get sorted element values."""
-        self.get_sorted_vals()
+        return self.get_vals()
 
     @property
     def vals(self):
         """Shortcut to get unordered element values."""
         if self._elems is None:
-            self._vals = self.elems.values()
+            self.elems
         return self._vals
 
     @property
@@ -270,9 +394,7 @@ class Node(Element):
 
     @property
     def len(self):
-        if self._len is None:
-            self._len = len(self.elems)
-        return self._len
+        return len(self.elems)
 
     def get_elem_by_name(self, name):
         try:
@@ -283,30 +405,61 @@ class Node(Element):
                     name, self.type.lower()))
 
     def get_elem_by_num(self, num, sort_by, unordered, elem_type):
-        vals = self.get_vals(sort_by, unordered, elem_type)
-        try:
-            return vals[num - 1] if vals else None
-        except IndexError:
+        """
+        Get the element by its number in the listing.  The sorted values are
+        cached per sorting key and element type (see `get_vals`), so they
+        serve as the rank index of the node.  If they are not cached yet and
+        the number is small, the element is selected with a heap of `num`
+        elements instead of sorting them all, so that a numbered path (such
+        as "ls 3 12 4") does not sort every level it passes through.
+
+        :param num: the 1-based number of the element.
+        """
+        key = (sort_by, elem_type)
+        if unordered or (self._sorted is not None and key in self._sorted):
+            vals = self.get_vals(sort_by, unordered, elem_type)
+        else:
+            vals = self.get_vals(unordered=True, elem_type=elem_type)
+            if 1 <= num <= len(vals) * SELECT_MAX_FRACTION:
+                # equivalent to sorted(vals, key=...)[:num]
+                return heapq.nsmallest(
+                    num, vals, key=_get_sort_key(sort_by))[-1]
+            vals = self.get_vals(sort_by, unordered, elem_type)
+        if not vals:
+            return None
+        if not 1 <= num <= len(vals):
             raise ElemError(
                 'element index out of range (1-%d)' % len(vals))
+        return vals[num - 1]
 
     def get_elems(self, elem_type=None):
         """
-        The generic method to get elements.
+        The generic method to get elements.  The elements of all types, nodes
+        and attributes are returned without copying, so they must not be
+        modified.
 
         :param elem_type: the element type.  If None, then all types are
                           included. Otherwise, it is one of "file",
                           "directory", "node", and "attribute".
         """
         elems = self.elems
-        if elem_type is not None:
-            items = self.elems.items()
-            if elem_type not in ('file', 'directory', 'node', 'attribute'):
-                raise NodeError('unknown element type')
-            elem_class = getattr(sys.modules[__name__], elem_type.title())
-            items = filter(lambda x: isinstance(x[1], elem_class), items)
-            elems = OrderedDict(items)
-        return elems
+        if elem_type is None:
+            return elems
+        elif elem_type == 'node':
+            return self._nodes if self._nodes is not None else OrderedDict()
+        elif elem_type == 'attribute':
+            return self._attrs if self._attrs is not None else OrderedDict()
+        elif elem_type in ('file', 'directory'):
+            # whether a node is a file or a directory is only known (and may
+            # change) once its elements are loaded, so they are not cached
+            elem_class = File if elem_type == 'file' else Directory
+            elems = OrderedDict()
+            for name, elem in self.get_elems('node').items():
+                elem.elems  # load the elements to update the class
+                if isinstance(elem, elem_class):
+                    elems[name] = elem
+            return elems
+        raise NodeError('unknown element type')
 
     def get_vals(self, sort_by=None, unordered=False, elem_type=None):
         """
@@ -315,33 +468,48 @@ class Node(Element):
         :param sort_by: the name of the sorting key.  If it is None and
                         `unordered` is False, then the sorting key is the
                         element name.  If it is a name, then the content of the
-                        attribute with this name is used as the key.
+                        attribute with this name is used as the key, and
+                        elements without the attribute come last.
         :param unordered: whether to present elements unordered.  If it is
                           True, the original order in the document is used, and
-                          `sort_by` has no effect.
+                          `sort_by` has no effect.  Unordered values of all
+                          types, nodes and attributes are returned without
+                          copying, so they must not be modified.  Sorted values
+                          are cached until elements are added or deleted, so
+                          they must not be modified either.
         :param elem_type: the element type.  If None, then all types are
                           included. Otherwise, it is one of "file",
                           "directory", "node", and "attribute".
         """
+        key = (sort_by, elem_type)
+        if not unordered and self._sorted is not None and key in self._sorted:
+            return self._sorted[key]
+
         vals = self.vals
-        if elem_type is not None:
-            if elem_type not in ('file', 'directory', 'node', 'attribute'):
-                raise NodeError('unknown element type')
-            elem_class = getattr(sys.modules[__name__], elem_type.title())
-            vals = filter(lambda elem: isinstance(elem, elem_class), vals)
+        if elem_type == 'node':
+            vals = self._node_vals if self._node_vals is not None else []
+        elif elem_type == 'attribute':
+            vals = self._attr_vals if self._attr_vals is not None else []
+        elif elem_type is not None:
+            vals = list(self.get_elems(elem_type).values())
 
         if unordered:
             return vals
 
-        if sort_by is None:
-            return sorted(vals, key=attrgetter('name'))
+        if self._sorted is None:
+            self._sorted = {}
+        if key not in self._sorted:
+            self._sorted[key] = sorted(vals, key=_get_sort_key(sort_by))
+        return self._sorted[key]
 
-        def sort_key(elem):
-            if getattr(elem, 'attrs'):
-                return elem.attrs.get(sort_by)
-            return None
-
-        return sorted(self.vals, key=sort_key)
+    def _invalidate_sorted(self):
+        """
+        Invalidate the cached sorted values of this node, and those of its
+        parent, which may be sorted by the contents of this node's attributes.
+        """
+        self._sorted = None
+        if self.parent is not None:
+            self.parent._sorted = None
 
     def add(self, name, content):
         """
@@ -349,11 +517,9 @@ class Node(Element):
         """
         if name not in self.elems:
             self.content[name] = content
-            elem, this_is_dir, this_is_file = self._make_elem(name, content)
-            self._elems[name] = elem
-            self._update_class(this_is_dir, this_is_file)
-            # update vals
-            self._vals = self.elems.values()
+            self._insert_elem(self._make_elem(name, content))
+            self._update_class()
+            self._invalidate_sorted()
         else:
             raise NodeError(
                 'element "%s" already exists in this %s' % (
@@ -362,34 +528,43 @@ class Node(Element):
     def delete(self, name):
         """Delete an element with name in this node."""
         if name in self.elems:
-            this_is_dir, this_is_file = self._delete_elem(name)
-            self._update_class(this_is_dir, this_is_file)
-            # update vals
-            self._vals = self.elems.values()
+            self._delete_elem(name)
+            self._update_class()
+            self._invalidate_sorted()
         else:
             raise NodeError(
                 'element "%s" does not exist in this %s' % (
                     name, self.type.lower()))
 
     def _delete_elem(self, name):
-        this_is_dir = self.is_dir
-        this_is_file = self.is_file
-
-        del self._elems[name]
+        self._remove_elem(name)
         del self.content[name]
 
         if not self.content:
             # add a placeholder to keep this node as a file
             self.add(PLACEHOLDER, True)
 
-        # check remaining elements
-        for elem in self.elems:
-            if self.elems[elem].is_attr:
-                this_is_file = True
-            if self.elems[elem].is_node:
-                this_is_dir = True
 
-        return this_is_dir, this_is_file
+def _get_sort_key(sort_by):
+    """Get the key function to sort elements by (see `Node.get_vals`)."""
+    if sort_by is None:
+        return attrgetter('name')
+    return lambda elem: _attr_sort_key(elem, sort_by)
+
+
+def _attr_sort_key(elem, attrname):
+    """
+    The key to sort elements by the content of their attributes named
+    `attrname`.  Numbers come before strings (which would not compare on
+    Python 3), and elements without the attribute come last.
+    """
+    attr = elem.attrs.get(attrname) if elem.is_node else None
+    if attr is None or attr.content is None:
+        return (1,)
+    content = attr.content
+    if isinstance(content, (bool, int, float)):
+        return (0, 0, content)
+    return (0, 1, txt_type(content))
 
 
 class ElemError(Exception):
@@ -405,27 +580,35 @@ class AttrError(Exception):
 
 
 class Directory(Node):
-    pass
+    __slots__ = ()
 
 
 class File(Node):
-    pass
+    __slots__ = ()
 
 
 class Attribute(Element):
     """
     The Attribute class.
     """
+    __slots__ = ('_index',)
+
     def __init__(self, name, bucket, parent, content, *args, **kwargs):
         super(Attribute, self).__init__(name, bucket, parent, content,
                                         *args, **kwargs)
-        self._action = AttributeAction(self)
         self._index = None
         self._decode_content()
 
+    def _make_action(self):
+        return AttributeAction(self)
+
     def _decode_content(self):
         if self.has_items:
-            self.content = map(utf8_decode, self.content)
+            # decode in place so that the content is shared with the bucket
+            for i, item in enumerate(self.content):
+                decoded = utf8_decode(item)
+                if decoded is not item:
+                    self.content[i] = decoded
         else:
             self.content = utf8_decode(self.content)
 
@@ -445,3 +628,4 @@ class Attribute(Element):
             raise AttrError(
                 'cannot add dict-type content to list-type attribute')
         self.content.append(content)
+        self.parent._invalidate_sorted()
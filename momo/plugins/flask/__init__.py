@@ -2,26 +2,47 @@ from __future__ import print_function, absolute_import
 import imp
 import os
 import sys
+import time
+import uuid
 import jinja2
 from momo.plugins.base import Plugin
+from momo.utils import eval_path, mkdir_p
 from momo.plugins.flask.app import (
     app,
+    bucket_lock,
     FLASK_TEMPLATE_FOLDER,
     FLASK_DEFAULT_HOST,
     FLASK_DEFAULT_PORT,
     FLASK_DEFAULT_DEBUG
 )
-from momo.plugins.flask.utils import get_public_functions, to_list
+from momo.plugins.flask.utils import get_public_functions, to_list, LRUCache
 import momo.plugins.flask.sorting
 import momo.plugins.flask.nodes
 from momo.plugins.flask.sorting import sort_nodes
+from momo.plugins.flask.search import SearchIndex
+from momo.plugins.flask.watcher import BucketWatcher
+from momo.plugins.flask.server import PreforkServer, DEFAULT_GRACEFUL_TIMEOUT
+from momo.plugins.flask.responses import DEFAULT_COMPRESS_LEVEL
+from momo.plugins.flask.build import SiteBuilder
 
 from gevent.wsgi import WSGIServer
 
+# the default number of view results to cache
+DEFAULT_CACHE_SIZE = 128
+# values of the "mode" config (see Flask.run)
+SERVER_MODES = ('debug', 'gevent', 'production')
+
+
+class FlaskError(Exception):
+    pass
+
+
 """
 app.config values of the current bucket:
 
-MOMO_ROOT_NODE: the root node of the current bucket.
+MOMO_ROOT_NODE: the root node of the current bucket.  It is replaced when the
+                bucket is reloaded, so views use g.root (see
+                app.load_bucket_state) instead.
 MOMO_FILES_FOLDER: user files folder.
 MOMO_SITENAME: sitename (defaults to bucket name).
 MOMO_HEADER_ID: what to show in the header id attribute of the node, which can
@@ -45,6 +66,8 @@ MOMO_SORTING_FUNCTIONS: a dictionary of names to default and user sorting key
 MOMO_ATTRS_SORTING: the default sorting function of node attrs. It is
                     registered as a template filter as "sort_attrs".
 MOMO_NODES_SORTING: the default sorting function of nodes.
+MOMO_SORT_NODES_ASC: whether the default sorting of nodes is ascending, or
+                     None if nodes are not sorted by default.
 MOMO_ATTRS_PINNING: the function to pin selected attrs to the top.
 MOMO_VIEW: default view, which can be "list" (default), "table", or any other
            user-defined templates prefixed with "view_".
@@ -58,6 +81,8 @@ MOMO_MERGE_NODES: whether to merge nodes with the same name (search view
                   only).
 MOMO_CASE_INSENSITIVE: whether to use case insensitive matching for search.
 MOMO_STRING_SEPARATOR: string separator used when matching nodes for search.
+MOMO_SEARCH_INDEX: the inverted index of the nodes for search (see
+                   search.SearchIndex).
 MOMO_INDEX_SORTING_TERMS: the default sorting term for index view.
 MOMO_SEARCH_SORTING_TERMS: the default sorting term for search view.
 MOMO_NODE_SORTING_TERMS: the default sorting term for node view.
@@ -65,7 +90,20 @@ MOMO_HOLDER_SIZE: holder (image placeholder) size (in the form of NxM).
 MOMO_IMAGE_MAX_WIDTH: max width (in px) of the images.
 MOMO_PARENT_INDEX: the loop index (Jinja loop.index, 1-based) of attrs to
                    insert the parent to.
-MOMO_CACHE: a simple cache.
+MOMO_CACHE: the LRU cache of the nodes computed by the views (see
+            app.get_sorted_nodes).
+MOMO_BUCKET_VERSION: the version of the bucket, which is part of the keys of
+                     MOMO_CACHE.  It is incremented when the bucket is
+                     reloaded.
+MOMO_BOOT_ID: a random id of the app run, which is part of the ETags of views
+              (see app.check_etag).
+MOMO_CACHE_CONTROL: the Cache-Control header of views (defaults to "no-cache",
+                    so clients revalidate their copies with the ETags).
+MOMO_FILES_CACHE_CONTROL: the Cache-Control header of user files (defaults to
+                          none, which leaves the Flask defaults).
+MOMO_COMPRESS: whether to compress text responses with brotli (if installed)
+               or gzip, as accepted by clients (defaults to True).
+MOMO_COMPRESS_LEVEL: the gzip compression level (defaults to 6).
 MOMO_USE_BOOTSTRAP_STYLES: whether to use Bootstrap styles (default to True).
 MOMO_USE_BOOTSTRAP_SCRIPTS: whether to use Bootstrap scripts (default to True).
 """
@@ -73,20 +111,28 @@ MOMO_USE_BOOTSTRAP_SCRIPTS: whether to use Bootstrap scripts (default to True).
 
 class Flask(Plugin):
     def setup(self):
-        bucket_name = self.settings.bucket.name
+        bucket = self.settings.get_bucket(read_only=True)
+        bucket_name = bucket.name
+        # files whose changes trigger a reload of the bucket
+        self.bucket_paths = [bucket.document.path]
+        if bucket.document.journal is not None:
+            self.bucket_paths.append(bucket.document.journal.path)
         self.configs = self.settings.plugins.get(
             'flask', {}).get(bucket_name, {})
         flask_dir = os.path.join(
             self.settings.settings_dir, 'flask', bucket_name)
+        self.flask_dir = flask_dir
         sys.path.append(flask_dir)
 
         # register user template folder
         user_template_folder = os.path.join(flask_dir, 'templates')
         self._reset_loader(user_template_folder)
+        if self.configs.get('template_bytecode_cache', True):
+            self._set_bytecode_cache(os.path.join(
+                self.settings.cache_dir, 'jinja', bucket_name))
 
         # configuration values
         # TODO: refactor these code
-        app.config['MOMO_ROOT_NODE'] = self.settings.bucket.root
         app.config['MOMO_FILES_FOLDER'] = os.path.join(flask_dir, 'files')
         app.config['MOMO_SITENAME'] = (
             self.configs.get('sitename') or bucket_name.capitalize())
@@ -123,12 +169,23 @@ class Flask(Plugin):
             'case_insensitive', False)
         app.config['MOMO_STRING_SEPARATOR'] = self.configs.get(
             'string_separator')
+        app.config.update(self._get_bucket_config(bucket))
         app.config['MOMO_HOLDER_SIZE'] = self.configs.get(
             'holder_size', '125x125')
         app.config['MOMO_IMAGE_MAX_WIDTH'] = self.configs.get(
             'image_max_width')
         app.config['MOMO_PARENT_INDEX'] = self.configs.get('parent_index', 1)
-        app.config['MOMO_CACHE'] = {}
+        app.config['MOMO_CACHE'] = LRUCache(
+            self.configs.get('cache_size', DEFAULT_CACHE_SIZE))
+        app.config['MOMO_BUCKET_VERSION'] = 0
+        app.config['MOMO_BOOT_ID'] = uuid.uuid4().hex
+        app.config['MOMO_CACHE_CONTROL'] = self.configs.get(
+            'cache_control', 'no-cache')
+        app.config['MOMO_FILES_CACHE_CONTROL'] = self.configs.get(
+            'files_cache_control')
+        app.config['MOMO_COMPRESS'] = self.configs.get('compress', True)
+        app.config['MOMO_COMPRESS_LEVEL'] = self.configs.get(
+            'compress_level', DEFAULT_COMPRESS_LEVEL)
 
         index_sorting_terms = self.configs.get('index_sorting_terms')
         app.config['MOMO_INDEX_SORTING_TERMS'] = (
@@ -172,6 +229,7 @@ class Flask(Plugin):
 
         # initialize default sorting function for nodes
         sort_nodes_asc = self.configs.get('sort_nodes_asc')
+        app.config['MOMO_SORT_NODES_ASC'] = sort_nodes_asc
         app.config['MOMO_NODES_SORTING'] = lambda nodes: nodes
         if sort_nodes_asc is not None:
             app.config['MOMO_NODES_SORTING'] = \
@@ -206,6 +264,60 @@ class Flask(Plugin):
         app.config['MOMO_USE_BOOTSTRAP_SCRIPTS'] = \
             self.configs.get('use_bootstrap_scripts', True)
 
+        # compile the templates before serving (and forking workers), now
+        # that all filters and global functions are registered
+        if self.configs.get('warm_up_templates', True):
+            self._warm_up_templates()
+
+    def _get_bucket_config(self, bucket):
+        """
+        Get the app.config values that are derived from the bucket content.
+        The whole tree is loaded here to build the search index, so that
+        requests do not load nodes lazily.
+        """
+        search_index = SearchIndex(
+            root=bucket.root,
+            case_insensitive=app.config['MOMO_CASE_INSENSITIVE'],
+            sep=app.config['MOMO_STRING_SEPARATOR'],
+        )
+        return {
+            'MOMO_ROOT_NODE': bucket.root,
+            'MOMO_SEARCH_INDEX': search_index,
+        }
+
+    def reload(self):
+        """
+        Reload the bucket.  The new tree and index are built first, and then
+        swapped in with the bucket version in one update, so that requests
+        are served from the old bucket in the meantime.
+        """
+        start = time.time()
+        bucket = self.settings.get_bucket(read_only=True)
+        config = self._get_bucket_config(bucket)
+        with bucket_lock:
+            config['MOMO_BUCKET_VERSION'] = \
+                app.config['MOMO_BUCKET_VERSION'] + 1
+            app.config.update(config)
+        # entries of the old version are never used again
+        app.config['MOMO_CACHE'].clear()
+        app.logger.info('bucket "%s" reloaded in %.2f s (version %d)',
+                        bucket.name, time.time() - start,
+                        config['MOMO_BUCKET_VERSION'])
+
+    def watch(self, callback=None):
+        """
+        Start watching the bucket files to reload the bucket.
+
+        :param callback: the function to call on changes instead of
+                         `reload`.
+        """
+        self.watcher = BucketWatcher(
+            paths=self.bucket_paths,
+            callback=callback or self.reload,
+            interval=self.configs.get('watch_interval', 1.0),
+        )
+        self.watcher.start()
+
     def _get_pinning_function(self, pinned_attrs):
         """Return a (template filter) function that reorders attrs based on
         the given pinned attrs."""
@@ -249,16 +361,99 @@ class Flask(Plugin):
             FLASK_TEMPLATE_FOLDER,
         ])
 
+    def _set_bytecode_cache(self, cache_dir):
+        """
+        Cache the compiled templates in a directory, so that they are not
+        compiled again by later runs unless they change.
+        """
+        mkdir_p(cache_dir)
+        app.jinja_env.bytecode_cache = jinja2.FileSystemBytecodeCache(
+            cache_dir)
+
+    def _warm_up_templates(self):
+        """
+        Load all the templates into the template cache of the Jinja
+        environment, so that the first requests do not compile them.
+        """
+        start = time.time()
+        env = app.jinja_env
+        count = 0
+        for name in env.list_templates(extensions=['html']):
+            try:
+                env.get_template(name)
+            except jinja2.TemplateError:
+                app.logger.exception('failed to compile template %s', name)
+            else:
+                count += 1
+        app.logger.info('%d templates loaded in %.2f s',
+                        count, time.time() - start)
+
+    def build(self, build_dir=None):
+        """
+        Build a static site of the index and node views (see
+        build.SiteBuilder) in `build_dir`, which defaults to the "build_dir"
+        config or the "site" directory of the flask settings of the bucket.
+        The pages are rendered by "build_workers" processes.
+        """
+        build_dir = eval_path(
+            build_dir or self.configs.get('build_dir') or
+            os.path.join(self.flask_dir, 'site'))
+        start = time.time()
+        builder = SiteBuilder(
+            app,
+            build_dir=build_dir,
+            workers=self.configs.get('build_workers'),
+            fingerprint_paths=list(app.jinja_loader.searchpath) + [
+                os.path.join(self.flask_dir, filename)
+                for filename in ('filters.py', 'functions.py', 'nodes.py',
+                                 'sorting.py')
+            ],
+        )
+        rendered, unchanged, removed = builder.build()
+        print('Built {} in {:.2f} s: {} pages rendered, {} unchanged, '
+              '{} removed'.format(build_dir, time.time() - start, rendered,
+                                  unchanged, removed),
+              file=sys.stderr)
+
     def run(self, args=None):
-        # args is not used for now
+        """
+        Run the server, or build a static site if args are ["build"] or
+        ["build", BUILD_DIR] (see `build`).
+
+        The server runs in the mode given by the "mode" config:
+
+            debug: the Flask development server (default if debug is true).
+            gevent: a gevent WSGIServer in one process (default otherwise).
+            production: a PreforkServer of "workers" processes, each of
+                        which serves up to "worker_pool_size" requests
+                        concurrently.  The bucket is loaded before the
+                        workers are forked, and reloaded by a graceful
+                        restart on SIGHUP (or changes of the bucket files,
+                        see "watch_bucket").
+
+        Access logs of the gevent and production modes are written to the
+        path of "access_log", or stderr if it is true.
+
+        If "watch_bucket" is true (it is false by default), the bucket files
+        are watched (polled every "watch_interval" seconds without
+        pyinotify), and the bucket is reloaded when they change.
+        """
+        if args and args[0] == 'build':
+            self.build(*args[1:2])
+            return
         host = self.configs.get('host') or FLASK_DEFAULT_HOST
         port = self.configs.get('port') or FLASK_DEFAULT_PORT
         if self.configs.get('debug') is not None:
             debug = self.configs.get('debug')
         else:
             debug = FLASK_DEFAULT_DEBUG
-        print('Serving on http://{}:{} with debug = {}...'.format(
-              host, port, debug),
+        mode = self.configs.get('mode') or ('debug' if debug else 'gevent')
+        if mode not in SERVER_MODES:
+            raise FlaskError('unknown server mode "{}"'.format(mode))
+        debug = mode == 'debug'
+        access_log = self.configs.get('access_log')
+        print('Serving on http://{}:{} in {} mode...'.format(
+              host, port, mode),
               file=sys.stderr)
 
         def _debug_run():
@@ -270,10 +465,43 @@ class Flask(Plugin):
             )
 
         def _run():
-            # TODO: make log argument (access log) configurable
-            http_server = WSGIServer((host, port), app, log=None)
+            if not access_log:
+                log = None
+            elif access_log is True:
+                log = 'default'
+            else:
+                log = open(access_log, 'a', 1)
+            http_server = WSGIServer((host, port), app, log=log)
             http_server.serve_forever()
 
+        def _production_run():
+            server = PreforkServer(
+                app, host, port,
+                workers=self.configs.get('workers'),
+                pool_size=self.configs.get('worker_pool_size'),
+                access_log=access_log,
+                reload=self.reload,
+                graceful_timeout=self.configs.get(
+                    'graceful_timeout', DEFAULT_GRACEFUL_TIMEOUT),
+            )
+
+            def watch_bucket():
+                # the workers have copies of the bucket, so they are
+                # restarted instead of reloading the bucket in place
+                self.watch(callback=server.restart)
+
+            if self.configs.get('watch_bucket', False):
+                server.serve_forever(ready=watch_bucket)
+            else:
+                server.serve_forever()
+
+        if mode == 'production':
+            _production_run()
+            return
+
+        if self.configs.get('watch_bucket', False):
+            self.watch()
+
         if debug:
             _debug_run()
         else:
@@ -1,18 +1,22 @@
+import math
 import os
+import threading
+import time
 
 from flask import (
     Flask,
     g,
     redirect,
-    render_template,
+    render_template as _render_template,
     request,
     send_from_directory,
 )
 from flask_bootstrap import Bootstrap
 from momo.plugins.flask import filters, functions
-from momo.plugins.flask.utils import get_public_functions
-from momo.plugins.flask.sorting import sort_nodes_by_request
+from momo.plugins.flask.utils import get_public_functions, str_to_bool
+from momo.plugins.flask.sorting import partial_sort_nodes_by_request
 from momo.plugins.flask.nodes import merge_nodes
+from momo.plugins.flask.responses import make_etag, compress_response
 from momo.utils import open_default
 
 
@@ -22,6 +26,13 @@ FLASK_DEFAULT_DEBUG = True
 FLASK_APP_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__)))
 FLASK_TEMPLATE_FOLDER = os.path.join(FLASK_APP_ROOT, 'templates')
 FLASK_STATIC_FOLDER = os.path.join(FLASK_APP_ROOT, 'static')
+# the number of cache lookups between reports of the cache hit rate
+CACHE_STATS_INTERVAL = 100
+# views whose responses only depend on the bucket and the request args
+CONDITIONAL_ENDPOINTS = ('index', 'node', 'search')
+
+# guards the swap of the bucket state in app.config when it is reloaded
+bucket_lock = threading.Lock()
 
 app = Flask(
     import_name=__name__,
@@ -61,13 +72,29 @@ Query strings for all views:
 """
 
 
+def render_template(template_name, **context):
+    """
+    Render a template.  In debug mode, the render time is logged and added to
+    the Server-Timing header of the response (see set_response_headers).
+    """
+    if not app.debug:
+        return _render_template(template_name, **context)
+    start = time.time()
+    res = _render_template(template_name, **context)
+    duration = (time.time() - start) * 1000
+    g.render_timings = getattr(g, 'render_timings', []) + [
+        (template_name, duration)]
+    app.logger.debug('%s rendered in %.2f ms', template_name, duration)
+    return res
+
+
 @app.route('/node')
 @app.route('/node/<path:path>')
 def node(path=None):
     if path is None:
         return redirect('/')
 
-    root = app.config['MOMO_ROOT_NODE']
+    root = g.root
     funcs = app.config['MOMO_NODES_FUNCTIONS']
     g.sorting_functions = app.config['MOMO_SORTING_FUNCTIONS']
 
@@ -102,16 +129,20 @@ def node(path=None):
         node=node,
     )
 
-    g.nodes = node.node_vals
+    def get_nodes():
+        # copy the nodes since they are sorted in-place
+        nodes = list(node.node_vals)
+
+        # apply default sorting
+        nodes = app.config['MOMO_NODES_SORTING'](nodes) \
+            if not request.args.get('ns') else nodes
+        return nodes, None
 
-    # apply default sorting
-    g.nodes = app.config['MOMO_NODES_SORTING'](g.nodes) \
-        if not request.args.get('ns') else g.nodes
     # sort nodes by request args
     default_terms = app.config['MOMO_NODE_SORTING_TERMS'] \
         if not request.args.get('ns') else None
-    g.nodes = sort_nodes_by_request(
-        g.nodes, request, g, default_terms=default_terms)
+    nodes, _ = get_sorted_nodes(cache_key(path), get_nodes, default_terms)
+    g.nodes = get_page_nodes(nodes)
 
     return render_template('node.html', node=node)
 
@@ -127,7 +158,7 @@ def search(term=None):
     treated as a path component of a search term for parse_search_term.
     """
 
-    root = app.config['MOMO_ROOT_NODE']
+    root = g.root
     funcs = app.config['MOMO_NODES_FUNCTIONS']
     g.sorting_functions = app.config['MOMO_SORTING_FUNCTIONS']
 
@@ -144,6 +175,29 @@ def search(term=None):
 
     g.case_insensitive = app.config['MOMO_CASE_INSENSITIVE']
     g.string_separator = app.config['MOMO_STRING_SEPARATOR']
+    # query plan and timing details of the search (debug mode only)
+    g.search_stats = {} if app.debug else None
+    # if the matches are not reordered, stop scanning once the current page
+    # is filled (and one more match shows that there is a next page).  The
+    # search index always answers completely, so there is no limit (and all
+    # pages share a cache entry) if it is used.
+    g.search_limit = None
+    g.search_truncated = False
+    search_index = g.search_index
+    if not ((search_index is not None and search_index.can_search(
+                root, g.case_insensitive, g.string_separator)) or
+            request.args.getlist('sort') or
+            request.args.get('desc', default=False, type=str_to_bool) or
+            app.config['MOMO_SEARCH_SORTING_TERMS'] or
+            app.config['MOMO_ROOT_REVERSED'] or
+            app.config['MOMO_MERGE_NODES'] or
+            app.config['MOMO_SORT_NODES_ASC'] is not None):
+        g.search_limit = max(functions.get_page(request), 1) * g.per_page
+
+    if g.static_build:
+        # the static site searches search_index.json in the browser
+        g.permalink = '/search/'
+        return render_template('search.html', nodes=[])
 
     funcs['pre_search'](
         root=root,
@@ -151,34 +205,45 @@ def search(term=None):
         request=request,
     )
 
-    nodes = funcs['process_search'](
-        root=root,
-        term=term,
-        request=request,
-    )
-
-    # sort nodes by request args
-    default_reverse = app.config['MOMO_ROOT_REVERSED']
-    if default_reverse:
-        nodes.reverse()
-
-    if app.config['MOMO_MERGE_NODES']:
-        nodes = merge_nodes(nodes)
-
-    nodes = funcs['post_search'](
-        root=root,
-        term=term,
-        request=request,
-        nodes=nodes,
-    )
-
-    # apply default sorting
-    nodes = app.config['MOMO_NODES_SORTING'](nodes)
-
-    default_terms = app.config['MOMO_SEARCH_SORTING_TERMS']
-    nodes = sort_nodes_by_request(
-        nodes, request, g, default_terms)
-
+    def get_nodes():
+        nodes = funcs['process_search'](
+            root=root,
+            term=term,
+            request=request,
+        )
+        if g.search_stats:
+            app.logger.debug(
+                'search %s: %s', g.permalink,
+                ', '.join('{}={}'.format(key, value) for key, value in
+                          sorted(g.search_stats.items())))
+
+        # sort nodes by request args
+        default_reverse = app.config['MOMO_ROOT_REVERSED']
+        if default_reverse:
+            nodes.reverse()
+
+        if app.config['MOMO_MERGE_NODES']:
+            nodes = merge_nodes(nodes)
+
+        nodes = funcs['post_search'](
+            root=root,
+            term=term,
+            request=request,
+            nodes=nodes,
+        )
+
+        # apply default sorting
+        nodes = app.config['MOMO_NODES_SORTING'](nodes)
+        return nodes, (g.permalink, g.search_truncated, get_view_level(nodes))
+
+    # the number of matches depends on the page if the search stops early
+    nodes, (g.permalink, g.search_truncated, view_level) = get_sorted_nodes(
+        cache_key(term, g.search_limit), get_nodes,
+        app.config['MOMO_SEARCH_SORTING_TERMS'])
+    if view_level is not None:
+        g.view_level = view_level
+
+    nodes = get_page_nodes(nodes, truncated=g.search_truncated)
     return render_template('search.html', nodes=nodes)
 
 
@@ -189,7 +254,7 @@ def index():
     case for /node/.
     """
 
-    root = app.config['MOMO_ROOT_NODE']
+    root = g.root
     funcs = app.config['MOMO_NODES_FUNCTIONS']
     g.sorting_functions = app.config['MOMO_SORTING_FUNCTIONS']
 
@@ -209,36 +274,123 @@ def index():
         request=request,
     )
 
-    nodes = funcs['process_index'](
-        root=root,
-        request=request,
-    )
+    def get_nodes():
+        nodes = funcs['process_index'](
+            root=root,
+            request=request,
+        )
 
-    # sort nodes by request args
-    default_reverse = app.config['MOMO_ROOT_REVERSED']
-    if default_reverse:
-        nodes.reverse()
+        # sort nodes by request args
+        default_reverse = app.config['MOMO_ROOT_REVERSED']
+        if default_reverse:
+            nodes.reverse()
 
-    nodes = funcs['post_index'](
-        root=root,
-        request=request,
-        nodes=nodes,
-    )
+        nodes = funcs['post_index'](
+            root=root,
+            request=request,
+            nodes=nodes,
+        )
 
-    # apply default sorting
-    nodes = app.config['MOMO_NODES_SORTING'](nodes)
+        # apply default sorting
+        nodes = app.config['MOMO_NODES_SORTING'](nodes)
+        return nodes, None
 
-    default_terms = app.config['MOMO_INDEX_SORTING_TERMS']
-    nodes = sort_nodes_by_request(
-        nodes, request, g, default_terms)
+    nodes, _ = get_sorted_nodes(
+        cache_key(), get_nodes, app.config['MOMO_INDEX_SORTING_TERMS'])
 
+    nodes = get_page_nodes(nodes)
     return render_template('index.html', nodes=nodes)
 
 
+def cache_key(*args):
+    """
+    Make the MOMO_CACHE key of the current request from the endpoint, the
+    given arguments and the request arguments other than the page, which
+    only selects the slice of the nodes to render.
+    """
+    request_args = tuple(sorted(
+        (name, tuple(values)) for name, values in request.args.lists()
+        if name != 'page'))
+    return (request.endpoint,) + args + (request_args,)
+
+
+def get_sorted_nodes(key, get_nodes, default_terms):
+    """
+    Get the nodes of the current request sorted by the request args, at
+    least up to the current page, with MOMO_CACHE.
+
+    On a cache miss, `get_nodes` is called to get the nodes in their order
+    before sorting and extra values to cache with them.  Then only the nodes
+    up to the current page are sorted if that is cheaper (see
+    partial_sort_nodes_by_request).  A later request for a deeper page sorts
+    the cached nodes again, with a full sort if needed, and the result
+    replaces the cache entry.
+
+    The key is extended with MOMO_BUCKET_VERSION, so that nodes computed from
+    an older bucket are never used.  The cached nodes are shared by requests,
+    so they must not be modified.
+
+    :return: the nodes and the extra values.
+    """
+    cache = app.config['MOMO_CACHE']
+    key += (g.bucket_version,)
+    count = max(functions.get_page(request), 1) * g.per_page
+    entry = cache.get(key)
+    if entry is None or entry[2] < min(count, len(entry[1])):
+        if entry is None:
+            unsorted_nodes, extra = get_nodes()
+        else:
+            unsorted_nodes, _, _, extra = entry
+        nodes, sorted_count = partial_sort_nodes_by_request(
+            list(unsorted_nodes), request, g, default_terms, count=count)
+        entry = (unsorted_nodes, nodes, sorted_count, extra)
+        cache.set(key, entry)
+    lookups = cache.hits + cache.misses
+    if lookups % CACHE_STATS_INTERVAL == 0:
+        app.logger.info(
+            'cache: %d hits, %d misses (%.1f%% hit rate), %d entries',
+            cache.hits, cache.misses, 100.0 * cache.hits / lookups,
+            len(cache))
+    return entry[1], entry[3]
+
+
+def get_page_nodes(nodes, truncated=False):
+    """
+    Get the nodes of the current page, and set g.pagination to the
+    pagination of all the nodes, so that templates only render the nodes
+    that are displayed.
+
+    :param nodes: all the nodes.
+    :param truncated: whether there are more nodes than given.
+    """
+    page = functions.get_page(request)
+    g.pagination = functions.paginate(
+        page=page,
+        total=len(nodes),
+        per_page=g.per_page,
+        config=app.config,
+        truncated=truncated,
+    )
+    start = g.per_page * (max(page, 1) - 1)
+    return nodes[start:start + g.per_page]
+
+
+def get_view_level(nodes):
+    """
+    Guess the most relevant level of the nodes for views, which is the
+    average level rounded half up, or None if there are no nodes.
+    """
+    if not nodes:
+        return None
+    return int(math.floor(
+        float(sum(node.level for node in nodes)) / len(nodes) + 0.5))
+
+
 @app.route('/files/<path:filename>')
 def files(filename):
-    """Get user files."""
-    return send_from_directory(app.config['MOMO_FILES_FOLDER'], filename)
+    """Get user files.  Conditional and range requests are supported."""
+    return send_from_directory(app.config['MOMO_FILES_FOLDER'], filename,
+                               conditional=True)
 
 
 @app.route("/open")
@@ -258,6 +410,20 @@ def open_file():
     return res
 
 
+@app.before_request
+def load_bucket_state():
+    """
+    Get the bucket state at once, so that a request is served from the same
+    version of the bucket even if it is reloaded in the meantime.
+    """
+    with bucket_lock:
+        g.root = app.config['MOMO_ROOT_NODE']
+        g.search_index = app.config['MOMO_SEARCH_INDEX']
+        g.bucket_version = app.config['MOMO_BUCKET_VERSION']
+    g.static_build = request.environ.get(
+        functions.STATIC_BUILD_ENVIRON_KEY, False)
+
+
 @app.before_request
 def fix_trailing():
     """Always add a single trailing slash."""
@@ -274,6 +440,56 @@ def fix_trailing():
             return redirect(rp.rstrip('/') + '/' + qs)
 
 
+@app.before_request
+def check_etag():
+    """
+    Respond with 304 Not Modified to a conditional GET of a view whose ETag
+    the client already has, without rendering it.
+
+    The ETag is derived from the boot id of the app (as the templates and
+    user functions may change between runs), the bucket version, the path
+    and the request args.  It is weak since it is the same whether the
+    response is compressed or not.
+    """
+    if (request.method not in ('GET', 'HEAD') or
+            request.endpoint not in CONDITIONAL_ENDPOINTS):
+        return
+    request_args = sorted(
+        (name, values) for name, values in request.args.lists())
+    g.etag = make_etag(app.config['MOMO_BOOT_ID'], g.bucket_version,
+                       request.path, request_args)
+    if request.if_none_match.contains_weak(g.etag):
+        return app.response_class(status=304)
+
+
+@app.after_request
+def set_response_headers(response):
+    """
+    Set the ETag and Cache-Control headers of views and files, and the
+    Server-Timing header of render times in debug mode, and compress
+    responses if MOMO_COMPRESS is true.
+    """
+    etag = getattr(g, 'etag', None)
+    if etag is not None and response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        if app.config['MOMO_CACHE_CONTROL']:
+            response.headers['Cache-Control'] = \
+                app.config['MOMO_CACHE_CONTROL']
+    elif (request.endpoint == 'files' and
+            app.config['MOMO_FILES_CACHE_CONTROL']):
+        response.headers['Cache-Control'] = \
+            app.config['MOMO_FILES_CACHE_CONTROL']
+    render_timings = getattr(g, 'render_timings', None)
+    if render_timings:
+        response.headers['Server-Timing'] = ', '.join(
+            'render;dur=%.2f;desc="%s"' % (duration, template_name)
+            for template_name, duration in render_timings)
+    if app.config['MOMO_COMPRESS']:
+        compress_response(response, request.accept_encodings,
+                          level=app.config['MOMO_COMPRESS_LEVEL'])
+    return response
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('error.html', status_code=404), 404
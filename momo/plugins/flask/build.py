@@ -0,0 +1,329 @@
+# static site build
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+
+from six.moves.urllib.parse import quote
+from momo.plugins.flask.functions import (
+    PAGE_HREF_ENVIRON_KEY,
+    STATIC_BUILD_ENVIRON_KEY,
+)
+from momo.utils import (
+    atomic_write,
+    hash_content,
+    mkdir_p,
+    utf8_encode,
+    txt_type,
+    bin_type,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# the manifest of the pages in the build dir
+MANIFEST_NAME = '.momo_manifest.json'
+SEARCH_INDEX_NAME = 'search_index.json'
+# fewer pages than this are rendered in the main process
+MIN_PARALLEL_PAGES = 200
+# app.config values that do not affect the rendered pages
+UNRENDERED_CONFIGS = ('MOMO_BOOT_ID', 'MOMO_BUCKET_VERSION')
+
+# the builder whose jobs are run by the forked workers of the pool
+_job_builder = None
+
+
+def _run_render_job(job_id):
+    """Render a page in a worker, which shares the app by fork."""
+    return _job_builder.render(_job_builder.jobs[job_id])
+
+
+class SiteBuilder(object):
+    """
+    A builder of a static site from the flask app, which renders the index
+    and node views (with all their pages) with the templates of the app, so
+    that the site can be served without Python.
+
+    Pages are written as <path>/index.html (and <path>/page/<n>/index.html
+    for pagination, whose links are rewritten to them).  A page is only
+    rendered again if the subtree of its node, the templates or the configs
+    changed since the last build, as recorded in a manifest of the build
+    dir.  The user files and the static files are copied, and the search
+    index is written as JSON for the search page, which searches it in the
+    browser.  Links to paths of the user are written as file:// links,
+    unless MOMO_FILE_SERVING_ADDRESS is set.
+
+    :param app: the flask app, which is set up with a bucket.
+    :param build_dir: the directory to build the site in.
+    :param workers: the number of processes to render pages (defaults to
+                    the number of CPUs).
+    :param fingerprint_paths: the directories and files (such as templates)
+                              whose changes invalidate all pages.
+    """
+
+    def __init__(self, app, build_dir, workers=None, fingerprint_paths=()):
+        self.app = app
+        self.build_dir = build_dir
+        self.workers = workers or multiprocessing.cpu_count()
+        self.fingerprint_paths = fingerprint_paths
+        self.manifest_path = os.path.join(build_dir, MANIFEST_NAME)
+        # (url, page paths, digest) of the pages to render
+        self.jobs = []
+        self._client = None
+
+    def build(self):
+        """
+        Build the site.
+
+        :return: the numbers of rendered, unchanged, and removed pages.
+        """
+        mkdir_p(self.build_dir)
+        fingerprint = self._get_fingerprint()
+        manifest = self._load_manifest(fingerprint)
+        pages = {}
+        self.jobs = []
+        unchanged = 0
+        for url, paths, digest in self._get_pages():
+            for path in paths:
+                pages[path] = digest
+            if all(manifest.get(path) == digest and
+                   os.path.exists(os.path.join(self.build_dir, path))
+                   for path in paths):
+                unchanged += 1
+            else:
+                self.jobs.append((url, paths, digest))
+        for (_, paths, _), ok in zip(self.jobs, self._render_jobs()):
+            if not ok:
+                # render it again next time
+                for path in paths:
+                    pages.pop(path)
+        removed = self._remove_stale_pages(manifest, pages)
+        self._write_search_index()
+        self._copy_tree(self.app.static_folder,
+                        os.path.join(self.build_dir, 'static'))
+        self._copy_tree(self.app.config['MOMO_FILES_FOLDER'],
+                        os.path.join(self.build_dir, 'files'))
+        with atomic_write(self.manifest_path, mode='w', fsync=False) as f:
+            json.dump({'fingerprint': fingerprint, 'pages': pages}, f,
+                      indent=0, sort_keys=True)
+        return len(self.jobs), unchanged, removed
+
+    def render(self, job):
+        """
+        Render a page with the test client of the app and write it.  Return
+        whether it succeeded.
+        """
+        url, paths, _ = job
+        if self._client is None:
+            self._client = self.app.test_client()
+        base_url = url.split('?', 1)[0]
+        response = self._client.get(url, environ_base={
+            PAGE_HREF_ENVIRON_KEY: base_url + 'page/{0}/',
+            STATIC_BUILD_ENVIRON_KEY: True,
+        })
+        if response.status_code != 200:
+            logger.warning('failed to render %s (status %d)',
+                           url, response.status_code)
+            return False
+        data = response.get_data()
+        for path in paths:
+            filename = os.path.join(self.build_dir, path)
+            mkdir_p(os.path.dirname(filename))
+            with atomic_write(filename, fsync=False) as f:
+                f.write(data)
+        return True
+
+    def _render_jobs(self):
+        """
+        Render the pages of self.jobs, in a pool of forked processes if there
+        are enough of them.  Return whether each job succeeded, in order.
+        """
+        if (self.workers == 1 or len(self.jobs) < MIN_PARALLEL_PAGES or
+                not hasattr(os, 'fork')):
+            return [self.render(job) for job in self.jobs]
+        global _job_builder
+        _job_builder = self
+        # keep the tree out of the collector of the workers, which would
+        # otherwise touch (and copy) all of its pages
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        # the workers get the app by fork, whatever the default start method
+        context = (multiprocessing.get_context('fork')
+                   if hasattr(multiprocessing, 'get_context')
+                   else multiprocessing)
+        pool = context.Pool(self.workers)
+        try:
+            chunksize = len(self.jobs) // (self.workers * 4) + 1
+            res = pool.map(_run_render_job, range(len(self.jobs)), chunksize)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _job_builder = None
+        return res
+
+    def _get_pages(self):
+        """
+        Generate (url, page paths, digest) of the pages of the index, the
+        search and the node views.  The digest changes with the subtree of
+        the node.
+        """
+        config = self.app.config
+        root = config['MOMO_ROOT_NODE']
+        hashes = {}
+        self._hash_subtree(root, hashes)
+        for page in self._get_view_pages(
+                '/', '', len(root.node_vals),
+                config['MOMO_PAGINATION_INDEX_PER_PAGE'], hashes[root.path]):
+            yield page
+        # the search page only loads the search index in the browser
+        yield ('/search/', [os.path.join('search', 'index.html')],
+               hash_content('search'))
+        for node in config['MOMO_SEARCH_INDEX'].nodes:
+            path = '/'.join(node.path)
+            url = '/node/%s/' % quote(utf8_encode(path))
+            for page in self._get_view_pages(
+                    url, os.path.join('node', *node.path),
+                    len(node.node_vals),
+                    config['MOMO_PAGINATION_NODE_PER_PAGE'],
+                    hashes[node.path]):
+                yield page
+
+    def _get_view_pages(self, url, dirname, total, per_page, digest):
+        """
+        Generate the pages of a view.  The first page is also written as
+        page/1 for the links of the pagination.
+        """
+        count = max((total + per_page - 1) // per_page, 1)
+        paths = [os.path.join(dirname, 'index.html')]
+        if count > 1:
+            paths.append(os.path.join(dirname, 'page', '1', 'index.html'))
+        yield url, paths, hash_content(digest + ':1')
+        for page in range(2, count + 1):
+            yield (url + '?page=%d' % page,
+                   [os.path.join(dirname, 'page', str(page), 'index.html')],
+                   hash_content(digest + ':%d' % page))
+
+    def _hash_subtree(self, node, hashes):
+        """
+        Hash the attrs and the child nodes of the node recursively, and save
+        the hashes by node paths.
+        """
+        parts = [repr(node.name)]
+        for attr in node.attr_vals:
+            parts.append(repr((attr.name, attr.content)))
+        for child in node.node_vals:
+            parts.append(self._hash_subtree(child, hashes))
+        digest = hash_content('\n'.join(parts))
+        hashes[node.path] = digest
+        return digest
+
+    def _get_fingerprint(self):
+        """
+        Hash what all pages depend on: the files of fingerprint_paths and the
+        configs of plain values.
+        """
+        parts = []
+        for name, value in sorted(self.app.config.items()):
+            if (name.startswith('MOMO_') and
+                    name not in UNRENDERED_CONFIGS and
+                    isinstance(value, (txt_type, bin_type, int, float, bool,
+                                       list, tuple, type(None)))):
+                parts.append(repr((name, value)))
+        for top in self.fingerprint_paths:
+            for filename in self._list_files(top):
+                with open(filename, 'rb') as f:
+                    parts.append('%s %s' % (filename, hash_content(f.read())))
+        return hash_content('\n'.join(parts))
+
+    def _load_manifest(self, fingerprint):
+        """
+        Load the pages of the manifest of the last build, unless anything
+        that all pages depend on has changed since then.  A manifest that
+        cannot be read (such as one left partial by a crash) makes a full
+        build.
+        """
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('fingerprint') != fingerprint:
+                return {}
+            pages = manifest['pages']
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            logger.warning('ignoring the unreadable manifest %s',
+                           self.manifest_path)
+            return {}
+        return pages if isinstance(pages, dict) else {}
+
+    def _remove_stale_pages(self, manifest, pages):
+        """
+        Remove the pages of the last build that are not built in this one,
+        and then their directories if they are empty.
+        """
+        removed = 0
+        for path in set(manifest) - set(pages):
+            filename = os.path.join(self.build_dir, path)
+            if os.path.exists(filename):
+                os.remove(filename)
+                removed += 1
+            dirname = os.path.dirname(filename)
+            while dirname != self.build_dir and not os.listdir(dirname):
+                os.rmdir(dirname)
+                dirname = os.path.dirname(dirname)
+        return removed
+
+    def _write_search_index(self):
+        """Write the search index as JSON unless it is unchanged."""
+        filename = os.path.join(self.build_dir, SEARCH_INDEX_NAME)
+        data = utf8_encode(json.dumps(
+            self.app.config['MOMO_SEARCH_INDEX'].to_dict(),
+            sort_keys=True, separators=(',', ':')))
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                if f.read() == data:
+                    return
+        with atomic_write(filename, fsync=False) as f:
+            f.write(data)
+
+    def _copy_tree(self, src, dst):
+        """
+        Copy the files of src that are new or changed to dst, and remove the
+        files of dst that are not in src.
+        """
+        if not src or not os.path.isdir(src):
+            return
+        mkdir_p(dst)
+        for dirpath, dirnames, filenames in os.walk(dst, topdown=False):
+            for filename in filenames:
+                dst_file = os.path.join(dirpath, filename)
+                src_file = os.path.join(
+                    src, os.path.relpath(dst_file, dst))
+                if not os.path.isfile(src_file):
+                    os.remove(dst_file)
+        for src_file in self._list_files(src):
+            dst_file = os.path.join(dst, os.path.relpath(src_file, src))
+            if os.path.exists(dst_file):
+                src_st = os.stat(src_file)
+                dst_st = os.stat(dst_file)
+                if (src_st.st_size == dst_st.st_size and
+                        int(src_st.st_mtime) == int(dst_st.st_mtime)):
+                    continue
+            mkdir_p(os.path.dirname(dst_file))
+            shutil.copy2(src_file, dst_file)
+
+    def _list_files(self, top):
+        """List the files under a directory (or the file itself), sorted."""
+        if os.path.isfile(top):
+            return [top]
+        res = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                res.append(os.path.join(dirpath, filename))
+        return res
@@ -18,6 +18,7 @@ def get_attr(node, attrname, default=None):
 
 
 def get_parents(node):
+    """Get the parents of a merged node (see nodes.merge_nodes)."""
     parents = getattr(node, 'parents', None)
     if parents:
         return parents.values()
@@ -2,24 +2,39 @@
 # make sure not to conflict with built-ins:
 # http://jinja.pocoo.org/docs/2.9/templates/#list-of-global-functions
 
+from flask import request as _request
 from flask.helpers import url_for as _url_for
 from flask_paginate import Pagination
 
+# the WSGI environ key of the page link format ("{0}" is the page number) of
+# pagination, which the static site build sets since query strings are lost
+PAGE_HREF_ENVIRON_KEY = 'momo.page_href'
+# the WSGI environ key that the static site build sets, so that the views
+# render links that work without the server (see g.static_build)
+STATIC_BUILD_ENVIRON_KEY = 'momo.static_build'
 
-def paginate(page, total, per_page, config):
+
+def paginate(page, total, per_page, config, truncated=False):
+    """
+    :param truncated: whether there are more records than `total`, in which
+                      case the total is displayed as "{total}+".
+    """
     record_name = config['MOMO_PAGINATION_RECORD_NAME']
     display_msg = config['MOMO_PAGINATION_DISPLAY_MSG']
+    if truncated:
+        display_msg = display_msg.replace('{total}', '{total}+')
     pagination = _paginate(
         page=page,
         total=total,
         per_page=per_page,
         record_name=record_name,
         display_msg=display_msg,
+        href=_request.environ.get(PAGE_HREF_ENVIRON_KEY),
     )
     return pagination
 
 
-def _paginate(page, total, per_page, record_name, display_msg):
+def _paginate(page, total, per_page, record_name, display_msg, href=None):
     pagination = Pagination(
         page=page,
         total=total,
@@ -28,6 +43,7 @@ def _paginate(page, total, per_page, record_name, display_msg):
         show_single_page=False,
         record_name=record_name,
         display_msg=display_msg,
+        href=href,
     )
     return pagination
 
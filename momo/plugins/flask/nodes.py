@@ -54,9 +54,14 @@ def process_search(root, term, request):
     if term:
         g.permalink += term
         nodes = search_nodes_by_term(
-            term, root, g.case_insensitive, g.string_separator)
+            term, root, g.case_insensitive, g.string_separator,
+            index=getattr(g, 'search_index', None),
+            stats=getattr(g, 'search_stats', None),
+            limit=getattr(g, 'search_limit', None))
+        g.search_truncated = nodes.truncated
     else:
-        nodes = root.node_vals
+        # copy the nodes since they are sorted in-place
+        nodes = list(root.node_vals)
     return nodes
 
 
@@ -80,7 +85,8 @@ def process_index(root, request):
     Function to process requests for index view. It generates and returns
     nodes.
     """
-    nodes = root.node_vals
+    # copy the nodes since they are sorted in-place
+    nodes = list(root.node_vals)
     return nodes
 
 
@@ -94,29 +100,49 @@ def post_index(root, request, nodes):
 
 def node_from_path(path, root):
     node = root
-    for name in path.split('/'):
+    for name in path.strip('/').split('/'):
         node = node.elems[name]
     return node
 
 
 def merge_nodes(nodes):
     """
-    Merge nodes to deduplicate same-name nodes and add a "parents"
-    attribute to each node, which is a list of Node objects.
+    Merge nodes to deduplicate same-name nodes.  Each unique node is returned
+    as a MergedNode of the first of the same-name nodes, whose "parents"
+    attribute is a dictionary of parent names to the parents of these nodes.
+    The nodes themselves are not modified, since they are shared by
+    concurrent requests.
     """
-
-    def add_parent(unique_node, parent):
-        if getattr(unique_node, 'parents', None):
-            if parent.name not in unique_node.parents:
-                unique_node.parents[parent.name] = parent
-        else:
-            unique_node.parents = {parent.name: parent}
-
     names = OrderedDict()
     for node in nodes:
-        if node.name not in names:
-            names[node.name] = node
-            add_parent(names[node.name], node.parent)
-        else:
-            add_parent(names[node.name], node.parent)
-    return names.values()
+        merged = names.get(node.name)
+        if merged is None:
+            merged = MergedNode(node, OrderedDict())
+            names[node.name] = merged
+        parent = node.parent
+        if parent is not None and parent.name not in merged.parents:
+            merged.parents[parent.name] = parent
+    return list(names.values())
+
+
+class MergedNode(object):
+    """
+    A read-only proxy of the first node of the same-name nodes.  Attributes
+    other than "node" and "parents" are looked up on the proxied node.
+
+    :param node: the proxied node.
+    :param parents: a dictionary of parent names to parents of the same-name
+                    nodes.
+    """
+
+    __slots__ = ('node', 'parents')
+
+    def __init__(self, node, parents):
+        self.node = node
+        self.parents = parents
+
+    def __getattr__(self, name):
+        return getattr(self.node, name)
+
+    def __repr__(self):
+        return 'MergedNode(%r)' % self.node
@@ -0,0 +1,93 @@
+# functions to make cacheable and compressed responses
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# responses smaller than this (in bytes) are not worth compressing
+COMPRESS_MIN_SIZE = 500
+# the default gzip compression level (1-9)
+DEFAULT_COMPRESS_LEVEL = 6
+# brotli quality (0-11), which is about as fast as gzip level 6
+BROTLI_QUALITY = 4
+COMPRESSIBLE_MIMETYPES = (
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+)
+
+
+def make_etag(*parts):
+    """Make an ETag value that changes whenever any of the parts does."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def is_compressible(response, min_size=COMPRESS_MIN_SIZE):
+    """
+    Whether the response is worth compressing.  Responses of files are
+    streamed (direct passthrough) and not compressed.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or
+            response.is_streamed or 'Content-Encoding' in response.headers):
+        return False
+    mimetype = response.mimetype or ''
+    if not (mimetype.startswith('text/') or
+            mimetype in COMPRESSIBLE_MIMETYPES):
+        return False
+    return response.content_length is None or \
+        response.content_length >= min_size
+
+
+def get_encoding(accept_encodings):
+    """
+    Get the preferred content encoding among the accepted ones, which is
+    "br" (if brotli is installed), "gzip" or None.
+
+    :param accept_encodings: the request.accept_encodings of the request.
+    """
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=DEFAULT_COMPRESS_LEVEL):
+    """Compress bytes with the content encoding ("br" or "gzip")."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # wbits of 16 + MAX_WBITS makes the gzip format
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_response(response, accept_encodings,
+                      level=DEFAULT_COMPRESS_LEVEL,
+                      min_size=COMPRESS_MIN_SIZE):
+    """
+    Compress the response in place if it is compressible and the client
+    accepts a supported encoding.
+
+    :param response: the response.
+    :param accept_encodings: the request.accept_encodings of the request.
+    :param level: the gzip compression level.
+    :param min_size: the minimum size of responses to compress.
+    """
+    if not is_compressible(response, min_size):
+        return response
+    # the response varies even if it is not compressed for this client
+    response.vary.add('Accept-Encoding')
+    encoding = get_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -1,10 +1,29 @@
 # search backend
 
+import itertools
+import time
+from collections import deque
 from momo.core import Node
 from momo.plugins.flask.filters import get_attr
-from momo.plugins.flask.utils import str_to_bool, split_by
+from momo.plugins.flask.utils import str_to_bool, split_by, LRUCache
 from momo.utils import txt_type, bin_type
 
+# the maximum number of compiled query plans to keep
+QUERY_PLAN_CACHE_SIZE = 256
+
+# the costs of sub-terms by prefix, where matching the presence of a value
+# is the cheapest, exact matches come next, and substring matches come last
+SUBTERM_COSTS = {
+    'a_': 0,
+    'n_': 0,
+    'ax': 1,
+    'nx': 1,
+    'a': 2,
+    'n': 2,
+}
+
+query_plans = LRUCache(QUERY_PLAN_CACHE_SIZE)
+
 
 class SearchError(Exception):
     pass
@@ -35,19 +54,133 @@ def parse_q(s):
         return term
 
 
-def search_nodes_by_term(term, root, case_insensitive, sep):
+def search_nodes_by_term(term, root, case_insensitive, sep, index=None,
+                         stats=None, limit=None):
+    """
+    High-level function to search nodes by search term. It does two things:
+
+    1. Get the compiled query plan of the search term (see QueryPlan).
+    2. Search the nodes with the query plan, using the search index if it is
+       given and built for the root.
+
+    :param stats: if not None, a dictionary to update with the query plan and
+                  timing details of the search.
+    :param limit: if not None, stop scanning nodes once more than `limit`
+                  nodes match (see QueryPlan.search).
+    """
+    start = time.time()
+    plan = get_query_plan(term, case_insensitive, sep)
+    if stats is not None:
+        stats['compile_ms'] = (time.time() - start) * 1000
+        stats['plan_cache'] = '{} hits, {} misses'.format(
+            query_plans.hits, query_plans.misses)
+    return plan.search(root, index=index, stats=stats, limit=limit)
+
+
+def get_query_plan(term, case_insensitive=False, sep=None):
     """
-    High-level function to search nodes by search term. It does three things:
+    Get the compiled query plan of a search term from the LRU cache, or
+    compile and cache it.
+    """
+    key = (term, case_insensitive, sep)
+    plan = query_plans.get(key)
+    if plan is None:
+        plan = compile_search_term(term, case_insensitive, sep)
+        query_plans.set(key, plan)
+    return plan
+
+
+def compile_search_term(term, case_insensitive=False, sep=None):
+    """Compile a search term into a QueryPlan."""
+    return QueryPlan(term, case_insensitive, sep)
 
-    1. Parse the search term into a list of lambda lists.
-    2. Generate a search filter function.
-    3. Search the nodes with the search filter function.
 
+class QueryPlan(object):
     """
-    parsed_term = parse_search_term(term, case_insensitive, sep)
-    search_filter = get_search_filter(parsed_term)
-    nodes = search_nodes(root, search_filter)
-    return nodes
+    The compiled form of a search term (see parse_search_term).
+
+    The sub-terms of each component are ordered by their costs (see
+    SUBTERM_COSTS), so that cheap matches are tried first when ORing them,
+    and the components are ordered by the cost of their most expensive
+    sub-terms when ANDing them.  Both stop at the first sub-term or component
+    that decides the result.
+
+    """
+
+    def __init__(self, term, case_insensitive=False, sep=None):
+        self.term = term
+        self.case_insensitive = case_insensitive
+        self.sep = sep
+        components = [
+            sorted(subterms, key=lambda subterm: SUBTERM_COSTS[subterm[0]])
+            for subterms in split_search_term(term)
+        ]
+        components.sort(key=lambda subterms: max(
+            SUBTERM_COSTS[prefix] for prefix, _, _ in subterms))
+        self.components = components
+        self.filters = [
+            [get_subterm_lambda(prefix, name, s, case_insensitive, sep)
+             for prefix, name, s in subterms]
+            for subterms in components
+        ]
+
+    def match(self, node):
+        """Whether the node matches the search term."""
+        for funcs in self.filters:
+            for func in funcs:
+                if func(node):
+                    break
+            else:
+                return False
+        return True
+
+    def search(self, root, index=None, stats=None, limit=None):
+        """
+        Search nodes under the root.
+
+        :param index: the search index, which is used if it is built for the
+                      root.
+        :param stats: if not None, a dictionary to update with the details of
+                      the search.
+        :param limit: if not None, stop scanning nodes once more than `limit`
+                      nodes match.  The result then has `limit + 1` nodes and
+                      its `truncated` is True.  Results from the index are
+                      always complete.
+        :return: a SearchResult.
+        """
+        start = time.time()
+        if index is not None and index.can_search(
+                root, self.case_insensitive, self.sep):
+            method = 'index'
+            nodes = SearchResult(index.search(self.components))
+        else:
+            method = 'scan'
+            matches = iter_search_nodes(root, self.match)
+            if limit is None:
+                nodes = SearchResult(matches)
+            else:
+                nodes = SearchResult(itertools.islice(matches, limit + 1))
+                nodes.truncated = len(nodes) > limit
+        if stats is not None:
+            stats.update(
+                plan=self.explain(),
+                method=method,
+                search_ms=(time.time() - start) * 1000,
+                matches=len(nodes),
+                truncated=nodes.truncated,
+            )
+        return nodes
+
+    def explain(self):
+        """Describe the plan as a string."""
+        return ' AND '.join(
+            '({})'.format(' OR '.join(
+                '{}.{}={}'.format(prefix, name, s)
+                for prefix, name, s in subterms))
+            for subterms in self.components)
+
+    def __repr__(self):
+        return '<QueryPlan: {}>'.format(self.explain())
 
 
 def parse_search_term(term, case_insensitive=False, sep=None):
@@ -65,49 +198,60 @@ def parse_search_term(term, case_insensitive=False, sep=None):
     by ampersand (&), they are "OR"ed together, meaning the results are those
     satisfy any of them.
 
+    """
+    return [
+        [get_subterm_lambda(prefix, name, s, case_insensitive, sep)
+         for prefix, name, s in subterms]
+        for subterms in split_search_term(term)
+    ]
+
+
+def split_search_term(term):
+    """
+    Split a search term (see parse_search_term) into a list of components,
+    each of which is a list of (prefix, name, s) tuples of its sub-terms.
     """
     res = []
     entities = term.split('/')
     for entity in entities:
         subterms = filter(lambda x: x.strip(), entity.split('&'))
-        lambdas = []
+        items = []
         for subterm in subterms:
             key, s = subterm.split('=')
             if '.' in key:
                 prefix, name = key.split('.', 1)
-                if prefix in ('a', 'ax', 'a_'):
-                    lambdas.append(
-                        lambda node, name=name, s=s, prefix=prefix:
-                        match_value(
-                            value=get_attr(node, name),
-                            s=s,
-                            exact=prefix == 'ax',
-                            without=prefix == 'a_',
-                            case_insensitive=case_insensitive,
-                            sep=sep,
-                        )
-                    )
-                elif prefix in ('n', 'nx', 'n_'):
-                    lambdas.append(
-                        lambda node, name=name, s=s, prefix=prefix:
-                        match_value(
-                            value=getattr(node, name, None),
-                            s=s,
-                            exact=prefix == 'nx',
-                            without=prefix == 'n_',
-                            case_insensitive=case_insensitive,
-                            sep=sep,
-                        )
-                    )
-                else:
+                if prefix not in ('a', 'ax', 'a_', 'n', 'nx', 'n_'):
                     raise SearchError('unknown prefix {}'.format(prefix))
+                items.append((prefix, name, s))
             else:
                 raise SearchError('no prefix specified')
-        if lambdas:
-            res.append(lambdas)
+        if items:
+            res.append(items)
     return res
 
 
+def get_subterm_lambda(prefix, name, s, case_insensitive=False, sep=None):
+    """Get the lambda that matches a node against a sub-term."""
+    if prefix in ('a', 'ax', 'a_'):
+        return lambda node: match_value(
+            value=get_attr(node, name),
+            s=s,
+            exact=prefix == 'ax',
+            without=prefix == 'a_',
+            case_insensitive=case_insensitive,
+            sep=sep,
+        )
+    else:
+        return lambda node: match_value(
+            value=getattr(node, name, None),
+            s=s,
+            exact=prefix == 'nx',
+            without=prefix == 'n_',
+            case_insensitive=case_insensitive,
+            sep=sep,
+        )
+
+
 def match_value(value, s, exact=False, without=False, case_insensitive=False,
                 sep=None):
     """
@@ -180,15 +324,20 @@ def match_bool(value, s):
 def get_search_filter(lambda_lists):
     """Generate a search filter based on the lambda lists."""
     def search_filter(node):
-        """Evaluate node and reduce lambda_lists."""
-        evaluated_list = [
-            reduce(lambda x, y: x or y, map(lambda x: x(node), lambda_list))
-            for lambda_list in lambda_lists
-        ]
-        return reduce(lambda x, y: x and y, evaluated_list)
+        """Evaluate node against lambda_lists with short-circuiting."""
+        return all(any(func(node) for func in lambda_list)
+                   for lambda_list in lambda_lists)
     return search_filter
 
 
+class SearchResult(list):
+    """
+    A list of matched nodes.  If `truncated` is True, the search has stopped
+    early and there are more matches than the list has.
+    """
+    truncated = False
+
+
 def search_nodes(root, func=lambda x: True):
     """
     Search nodes from the root in a BFS manner.
@@ -196,13 +345,190 @@ def search_nodes(root, func=lambda x: True):
     :param root: the root node.
     :param func: a filtering function.
     """
+    return list(iter_search_nodes(root, func))
+
 
-    nodes = []
-    queue = [root]
+def iter_search_nodes(root, func=lambda x: True):
+    """
+    Generate matched nodes from the root in a BFS manner, so that the search
+    can stop as soon as enough nodes are found.
+
+    :param root: the root node.
+    :param func: a filtering function.
+    """
+    queue = deque([root])
     while queue:
-        cur_node = queue.pop(0)
+        cur_node = queue.popleft()
         for node in cur_node.node_vals:
             if func(node):
-                nodes.append(node)
+                yield node
             queue.append(node)
-    return nodes
+
+
+class SearchIndex(object):
+    """
+    An in-memory inverted index of the nodes under the root, which answers
+    search terms (see parse_search_term) with set operations on node ids.
+
+    Nodes are numbered in the BFS order of search_nodes, so that results come
+    in the same order.  The index maps tokens of node names and attr contents
+    to node ids, where the tokens are the units that match_value compares
+    with: the whole value, the items of a list, or the parts of a string
+    split by `sep`.  Exact sub-terms look up a token, and substring sub-terms
+    scan the vocabulary of the name or attr instead of all the nodes.
+    Sub-terms on other node object attributes are answered by scanning the
+    candidate nodes.
+
+    :param root: the root node.
+    :param case_insensitive: whether to do case-insensitive matching.
+    :param sep: the string separator (see match_value).
+
+    """
+
+    def __init__(self, root, case_insensitive=False, sep=None):
+        self.root = root
+        self.case_insensitive = case_insensitive
+        self.sep = sep
+        self.nodes = search_nodes(root)
+        # token -> ids of nodes whose names have the token
+        self.names = {}
+        # attr name -> token -> ids of nodes whose attrs have the token
+        self.attrs = {}
+        # attr name -> bool -> ids of nodes whose attrs are the bool
+        self.bools = {}
+        # attr name -> ids of nodes that have the attr (with content)
+        self.has_attrs = {}
+        for node_id, node in enumerate(self.nodes):
+            for token in self._tokens(node.name):
+                self.names.setdefault(token, set()).add(node_id)
+            for attr in node.attr_vals:
+                content = attr.content
+                if content is None:
+                    continue
+                self.has_attrs.setdefault(attr.name, set()).add(node_id)
+                if isinstance(content, bool):
+                    self.bools.setdefault(attr.name, {}).setdefault(
+                        content, set()).add(node_id)
+                    continue
+                postings = self.attrs.setdefault(attr.name, {})
+                for token in self._tokens(content):
+                    postings.setdefault(token, set()).add(node_id)
+
+    def can_search(self, root, case_insensitive, sep):
+        """Whether the index answers searches with the given arguments."""
+        return (root is self.root and
+                case_insensitive == self.case_insensitive and
+                sep == self.sep)
+
+    def search(self, components):
+        """
+        Search nodes.
+
+        :param components: the split search term (see split_search_term).
+        :return: the list of matched nodes in BFS order.
+        """
+        ids = None
+        scanned = []
+        for subterms in components:
+            if all(self._indexed(prefix, name)
+                   for prefix, name, _ in subterms):
+                ids = self._and(ids, self._search_component(subterms))
+                if not ids:
+                    return []
+            else:
+                scanned.append(subterms)
+        # components that need scanning only scan the remaining candidates
+        for subterms in scanned:
+            ids = self._and(ids, self._search_component(subterms, ids))
+            if not ids:
+                return []
+        if ids is None:
+            return list(self.nodes)
+        return [self.nodes[node_id] for node_id in sorted(ids)]
+
+    def to_dict(self):
+        """
+        Get the index as a dictionary of JSON types for client-side search,
+        where node ids index "nodes", the node paths joined by "/".
+        """
+        def ids_of(postings):
+            return dict((token, sorted(ids))
+                        for token, ids in postings.items())
+
+        return {
+            'case_insensitive': bool(self.case_insensitive),
+            'sep': self.sep,
+            'nodes': ['/'.join(node.path) for node in self.nodes],
+            'names': ids_of(self.names),
+            'attrs': dict((name, ids_of(postings))
+                          for name, postings in self.attrs.items()),
+            'bools': dict((name, dict((str(value).lower(), sorted(ids))
+                                      for value, ids in postings.items()))
+                          for name, postings in self.bools.items()),
+            'has_attrs': ids_of(self.has_attrs),
+        }
+
+    def _and(self, ids, other):
+        return other if ids is None else ids & other
+
+    def _search_component(self, subterms, candidates=None):
+        """Search a component, whose sub-terms are ORed together."""
+        ids = set()
+        scans = []
+        for prefix, name, s in subterms:
+            if self._indexed(prefix, name):
+                ids |= self._search_subterm(prefix, name, s)
+            else:
+                scans.append(get_subterm_lambda(
+                    prefix, name, s, self.case_insensitive, self.sep))
+        if scans:
+            if candidates is None:
+                candidates = range(len(self.nodes))
+            for node_id in candidates:
+                if node_id not in ids and any(
+                        func(self.nodes[node_id]) for func in scans):
+                    ids.add(node_id)
+        return ids
+
+    def _indexed(self, prefix, name):
+        return prefix.startswith('a') or name == 'name'
+
+    def _search_subterm(self, prefix, name, s):
+        if prefix == 'n_':
+            # every node has a name
+            return set()
+        if prefix == 'a_':
+            has_attr = self.has_attrs.get(name, set())
+            return set(range(len(self.nodes))) - has_attr
+        if prefix.startswith('n'):
+            postings = self.names
+        else:
+            postings = self.attrs.get(name, {})
+        s = self._with_case(txt_type(s))
+        if prefix in ('nx', 'ax'):
+            ids = set(postings.get(s, ()))
+        else:
+            ids = set()
+            for token, token_ids in postings.items():
+                if s in token:
+                    ids |= token_ids
+        if prefix.startswith('a') and name in self.bools:
+            ids |= self.bools[name].get(str_to_bool(s), set())
+        return ids
+
+    def _tokens(self, value):
+        """Get the tokens of a name or attr content as match_value does."""
+        if (self.sep is not None and
+                isinstance(value, (txt_type, bin_type)) and
+                self.sep in value):
+            values = split_by(value, self.sep)
+        elif isinstance(value, (txt_type, bin_type, int, float, Node)):
+            values = [value.name if isinstance(value, Node) else value]
+        else:
+            values = value
+        return set(self._with_case(txt_type(v)) for v in values)
+
+    def _with_case(self, s):
+        if self.case_insensitive:
+            return s.lower()
+        return s
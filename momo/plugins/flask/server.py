@@ -0,0 +1,308 @@
+# pre-fork production server
+
+import errno
+import fcntl
+import gc
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import time
+
+import gevent
+import six
+from gevent import socket as gsocket
+from gevent.pool import Pool
+from gevent.wsgi import WSGIServer
+
+
+logger = logging.getLogger(__name__)
+
+# the default number of seconds for workers to finish their requests
+DEFAULT_GRACEFUL_TIMEOUT = 30
+# the default number of pending connections of the listening socket
+DEFAULT_BACKLOG = 1024
+# the number of seconds to wait before replacing a worker that died
+RESPAWN_DELAY = 1
+
+
+class PreforkServer(object):
+    """
+    A server that listens on a socket in the parent process and forks workers
+    to serve requests from it, each running a gevent WSGIServer.
+
+    The app (with the bucket tree and indexes) is loaded in the parent before
+    the workers are forked, so that they share its memory copy-on-write.
+    Workers that die are replaced.  Signals of the parent:
+
+        SIGHUP: graceful restart.  `reload` is called in the parent, a new
+                generation of workers is forked, and then the old workers
+                stop accepting connections and exit after finishing their
+                requests, so no request is dropped.
+        SIGTERM, SIGINT: graceful shutdown.
+        SIGQUIT: immediate shutdown.
+
+    :param app: the WSGI app.
+    :param host: the host to listen on.
+    :param port: the port to listen on.
+    :param workers: the number of worker processes (defaults to the number of
+                    CPUs).
+    :param pool_size: the max number of concurrent greenlets (requests) of a
+                      worker, or None for no limit.
+    :param access_log: where workers write access logs, which is a path, True
+                       (stderr), or None (disabled).
+    :param reload: the function to reload the app state on graceful restart.
+    :param graceful_timeout: the number of seconds for workers to finish
+                             their requests before they are killed.
+    """
+
+    def __init__(self, app, host, port, workers=None, pool_size=None,
+                 access_log=None, reload=None,
+                 graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or multiprocessing.cpu_count()
+        self.pool_size = pool_size
+        self.access_log = access_log
+        self.reload = reload
+        self.graceful_timeout = graceful_timeout
+        self.socket = None
+        # pid -> generation of the worker
+        self._workers = {}
+        self._generation = 0
+        self._signals = []
+        self._pipe = None
+        self._running = False
+        # workers that die are not replaced until then
+        self._respawn_at = 0
+
+    def serve_forever(self, ready=None):
+        """
+        Listen, fork the workers and manage them until shutdown.
+
+        :param ready: the function to call once the server handles signals
+                      and `restart`, such as to start watching the bucket.
+        """
+        self.socket = self._listen()
+        self._pipe = os.pipe()
+        for fd in self._pipe:
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT,
+                       signal.SIGQUIT, signal.SIGCHLD):
+            signal.signal(signum, self._queue_signal)
+        self._running = True
+        graceful = True
+        if ready is not None:
+            ready()
+        try:
+            while self._running:
+                self._reap_workers()
+                self._spawn_workers()
+                self._wait()
+                graceful = self._handle_signals()
+        finally:
+            self._stop_workers(self._workers, graceful)
+            self.socket.close()
+            for fd in self._pipe:
+                os.close(fd)
+
+    def restart(self):
+        """
+        Request a graceful restart.  It is safe to call from other threads.
+        """
+        self._signals.append(signal.SIGHUP)
+        if self._pipe is not None:
+            self._wakeup()
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(DEFAULT_BACKLOG)
+        return sock
+
+    def _queue_signal(self, signum, frame):
+        self._signals.append(signum)
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self._pipe[1], b'.')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+    def _wait(self):
+        """Wait for a signal, or a second to check the workers anyway."""
+        try:
+            ready = select.select([self._pipe[0]], [], [], 1.0)[0]
+        except (OSError, select.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if ready:
+            try:
+                while os.read(self._pipe[0], 1024):
+                    pass
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EINTR):
+                    raise
+
+    def _handle_signals(self):
+        """
+        Handle the queued signals.  Return False if the workers are to be
+        stopped immediately.
+        """
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum == signal.SIGHUP:
+                self._restart()
+            elif signum in (signal.SIGTERM, signal.SIGINT):
+                logger.info('shutting down gracefully')
+                self._running = False
+            elif signum == signal.SIGQUIT:
+                logger.info('shutting down')
+                self._running = False
+                return False
+        return True
+
+    def _restart(self):
+        logger.info('restarting workers')
+        if self.reload is not None:
+            try:
+                self.reload()
+            except Exception:
+                # keep serving with the old workers
+                logger.exception('failed to reload, workers not restarted')
+                return
+            # free the old bucket, whose parent and child nodes refer to each
+            # other, before the new workers are forked
+            gc.collect()
+        old_workers = dict(self._workers)
+        self._generation += 1
+        self._respawn_at = 0
+        self._spawn_workers()
+        self._stop_workers(old_workers, graceful=True, wait=False)
+
+    def _spawn_workers(self):
+        """Fork workers of the current generation until there are enough."""
+        if time.time() < self._respawn_at:
+            return
+        count = sum(1 for generation in self._workers.values()
+                    if generation == self._generation)
+        if count >= self.workers:
+            return
+        # keep the objects of the parent out of the collector of the workers,
+        # which would otherwise touch (and copy) their pages
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        for _ in range(self.workers - count):
+            pid = os.fork()
+            if pid:
+                self._workers[pid] = self._generation
+                logger.info('worker %d started', pid)
+            else:
+                self._run_worker()
+        # the parent collects as usual, so that the old buckets of graceful
+        # restarts are freed
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    def _reap_workers(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    self._workers.clear()
+                    break
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not pid:
+                break
+            generation = self._workers.pop(pid, None)
+            if generation == self._generation and self._running:
+                logger.warning('worker %d exited with status %d', pid, status)
+                self._respawn_at = time.time() + RESPAWN_DELAY
+
+    def _stop_workers(self, workers, graceful=True, wait=True):
+        """
+        Stop the workers by SIGTERM (graceful) or SIGKILL.  If `wait` is
+        True, wait for them to exit and kill them after the graceful timeout.
+        """
+        signum = signal.SIGTERM if graceful else signal.SIGKILL
+        for pid in list(workers):
+            self._kill(pid, signum)
+        if not wait:
+            return
+        deadline = time.time() + self.graceful_timeout
+        while self._workers and time.time() < deadline:
+            self._reap_workers()
+            time.sleep(0.1)
+        for pid in list(self._workers):
+            self._kill(pid, signal.SIGKILL)
+        while self._workers:
+            self._reap_workers()
+            time.sleep(0.1)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _run_worker(self):
+        """Serve requests in a forked worker.  It never returns."""
+        status = 0
+        try:
+            # the parent handles these signals and tells the workers
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            for signum in (signal.SIGTERM, signal.SIGQUIT, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            for fd in self._pipe:
+                os.close(fd)
+            gevent.reinit()
+            server = WSGIServer(
+                self._get_listener(), self.app,
+                spawn=Pool(self.pool_size) if self.pool_size else 'default',
+                log=self._get_access_log(),
+            )
+
+            def stop():
+                server.stop(timeout=self.graceful_timeout)
+
+            # until the server is started, SIGTERM kills the worker (which
+            # has no requests yet) rather than stopping a server that is
+            # not started
+            server.start()
+            # gevent.signal was renamed to gevent.signal_handler
+            signal_handler = (getattr(gevent, 'signal_handler', None) or
+                              gevent.signal)
+            signal_handler(signal.SIGTERM, stop)
+            server.serve_forever()
+        except Exception:
+            logger.exception('worker %d failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _get_listener(self):
+        if six.PY2:
+            return gsocket.socket(self.socket.family, socket.SOCK_STREAM,
+                                  _sock=self.socket)
+        return gsocket.socket(self.socket.family, socket.SOCK_STREAM,
+                              fileno=self.socket.fileno())
+
+    def _get_access_log(self):
+        if not self.access_log:
+            return None
+        if self.access_log is True:
+            return 'default'
+        return open(self.access_log, 'a', 1)
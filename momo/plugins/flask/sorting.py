@@ -1,7 +1,15 @@
 # sorting and sorting key functions
 
+import heapq
 from momo.plugins.flask.filters import get_attr
 from momo.plugins.flask.utils import str_to_bool
+from momo.utils import txt_type
+
+# the prefix of a sorting term to sort in descending order
+DESC_PREFIX = '-'
+# top-k selection is used instead of a full sort only if k is at most this
+# fraction of the nodes, beyond which a sort is faster
+TOP_K_MAX_FRACTION = 0.25
 
 
 class SortingError(Exception):
@@ -25,19 +33,152 @@ def sort_nodes_by_request(nodes, request, g, default_terms=None):
     return nodes
 
 
+def partial_sort_nodes_by_request(nodes, request, g, default_terms=None,
+                                  count=None):
+    """
+    Like sort_nodes_by_request, but only the first `count` nodes are sorted
+    if that is cheaper (see top_nodes_by_keys), which is enough to render
+    the pages up to the `count`-th node.
+
+    :return: the nodes and the number of the sorted nodes at the front.
+    """
+    sorting_terms = request.args.getlist('sort') or default_terms
+    if (not sorting_terms or count is None or
+            count > len(nodes) * TOP_K_MAX_FRACTION):
+        nodes = sort_nodes_by_request(nodes, request, g, default_terms)
+        return nodes, len(nodes)
+    desc = request.args.get('desc', default=False, type=str_to_bool)
+    funcs, descs = parse_sorting_term_orders(
+        sorting_terms, g.sorting_functions)
+    nodes = top_nodes_by_keys(
+        nodes, funcs, [term_desc != desc for term_desc in descs], count)
+    return nodes, count
+
+
 def sort_nodes_by_terms(terms, nodes, desc, functions):
     """
-    High-level function to sort nodes by sorting term. It does two things:
+    High-level function to sort nodes by sorting terms. It does two things:
+
+    1. Parse the sorting terms into a list of sorting key functions and
+       their orders.
+    2. Sort nodes in-place by the keys (see sort_nodes_by_keys).
+
+    :param desc: whether to reverse the order of every term.
+    """
+    funcs, descs = parse_sorting_term_orders(terms, functions)
+    return sort_nodes_by_keys(
+        nodes, funcs, [term_desc != desc for term_desc in descs])
+
 
-    1. Parse the sorting terms into a list of sorting key functions.
-    2. Combine the sorting key functions into a single lambda function.
-    3. Apply sorting nodes in-place with the combined lambda function.
+def sort_nodes_by_keys(nodes, funcs, descs):
     """
-    funcs = parse_sorting_terms(terms, functions)
-    sort_nodes(nodes, lambda node: [func(node) for func in funcs], desc)
+    Sort nodes in-place by multiple keys.
+
+    The keys of all the nodes are extracted in one pass and normalized (see
+    normalize_key), and then the nodes are sorted by one key at a time with
+    stable sorts, from the last key to the first, so that each key can have
+    its own order.  Nodes with missing (None) keys come last in either order.
+
+    :param nodes: list of nodes.
+    :param funcs: a list of sorting key functions.
+    :param descs: a list of whether to sort by each key in descending order.
+    """
+    if not funcs:
+        return nodes
+    keys = extract_keys(nodes, funcs, descs)
+    if len(set(descs)) == 1:
+        # all the keys are in the same order, so one sort is enough
+        order = sorted(range(len(nodes)), key=keys.__getitem__,
+                       reverse=descs[0])
+    else:
+        order = list(range(len(nodes)))
+        for index in reversed(range(len(funcs))):
+            column = [key[index] for key in keys]
+            order.sort(key=column.__getitem__, reverse=descs[index])
+    nodes[:] = [nodes[i] for i in order]
+    return nodes
+
+
+def top_nodes_by_keys(nodes, funcs, descs, count):
+    """
+    Partially sort nodes in-place by multiple keys with heap-based top-k
+    selection: the first `count` nodes are the same as those after
+    sort_nodes_by_keys, and the rest follow in their original order.
+    """
+    if not funcs:
+        return nodes
+    keys = extract_keys(nodes, funcs, descs)
+    indexes = range(len(nodes))
+    if len(set(descs)) == 1:
+        select = heapq.nlargest if descs[0] else heapq.nsmallest
+        top = select(count, indexes, key=keys.__getitem__)
+    else:
+        top = heapq.nsmallest(count, indexes, key=lambda i: tuple(
+            Reversed(key) if desc else key
+            for key, desc in zip(keys[i], descs)))
+    selected = set(top)
+    nodes[:] = [nodes[i] for i in top] + [
+        node for i, node in enumerate(nodes) if i not in selected]
     return nodes
 
 
+def extract_keys(nodes, funcs, descs):
+    """
+    Extract the normalized keys (see normalize_key) of all the nodes in one
+    pass.
+
+    :return: a list of lists of keys.
+    """
+    # attrs are looked up in the attrs of each node directly, which is shared
+    # by all the attr keys
+    specs = [(func, getattr(func, 'attrname', None), desc)
+             for func, desc in zip(funcs, descs)]
+    has_attrs = any(attrname is not None for _, attrname, _ in specs)
+    keys = []
+    for node in nodes:
+        attrs = node.attrs if has_attrs else None
+        key = []
+        for func, attrname, desc in specs:
+            if attrname is None:
+                value = func(node)
+            else:
+                attr = attrs.get(attrname)
+                value = attr.content if attr is not None else None
+            key.append(normalize_key(value, desc))
+        keys.append(key)
+    return keys
+
+
+class Reversed(object):
+    """A wrapper of a key that reverses its order."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def normalize_key(value, desc=False):
+    """
+    Normalize a sorting key so that keys of different types compare on
+    Python 3: numbers come before strings, which come before other values
+    compared as strings.  A missing (None) value is replaced with a sentinel
+    that comes last in the given order.
+    """
+    if value is None:
+        return (0,) if desc else (2,)
+    if isinstance(value, (bool, int, float)):
+        return (1, 0, value)
+    if isinstance(value, txt_type):
+        return (1, 1, value)
+    return (1, 2, txt_type(value))
+
+
 def sort_nodes(nodes, func, desc=False):
     """
     Sort nodes in-place.
@@ -57,11 +198,29 @@ def parse_sorting_terms(terms, functions):
     :param terms: a list of sorting terms.
     :param functions: a dictionary of sorting key functions.
     """
+    return parse_sorting_term_orders(terms, functions)[0]
+
+
+def parse_sorting_term_orders(terms, functions):
+    """
+    Parse a list of sorting terms, each of which can be prefixed with "-" to
+    sort in descending order (e.g. "-a.size").
+
+    :param terms: a list of sorting terms.
+    :param functions: a dictionary of sorting key functions.
+    :return: a list of sorting key functions and a list of whether to sort
+             by each of them in descending order.
+    """
     res = []
+    descs = []
     for term in terms:
+        desc = term.startswith(DESC_PREFIX)
+        if desc:
+            term = term[len(DESC_PREFIX):]
+        descs.append(desc)
         prefix, name = term.split('.')
         if prefix == 'a':
-            res.append(lambda node, name=name: get_attr(node, name))
+            res.append(AttrKey(name))
         elif prefix == 'n':
             res.append(lambda node, name=name: getattr(node, name, None))
         elif prefix == 'f':
@@ -69,7 +228,17 @@ def parse_sorting_terms(terms, functions):
             res.append(functions[name])
         else:
             raise SortingError('unknown sorting prefix')
-    return res
+    return res, descs
+
+
+class AttrKey(object):
+    """The sorting key function of the content of an attr."""
+
+    def __init__(self, attrname):
+        self.attrname = attrname
+
+    def __call__(self, node):
+        return get_attr(node, self.attrname)
 
 
 def sort_by_numnodes(node):
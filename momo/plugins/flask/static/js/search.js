@@ -0,0 +1,164 @@
+// search of the static site in the browser over search_index.json, which is
+// written by the static site build (see build.SiteBuilder) from
+// search.SearchIndex.to_dict, and answered as SearchIndex.search does
+(function () {
+  'use strict';
+
+  var FALSE_STR_PATTERN = /^(0|false|False)$/;
+  var PREFIXES = ['a', 'ax', 'a_', 'n', 'nx', 'n_'];
+
+  var container = document.getElementById('static-search');
+  if (!container) {
+    return;
+  }
+  var info = document.getElementById('static-search-info');
+  var results = document.getElementById('static-search-results');
+
+  function getQ() {
+    var match = /[?&]q=([^&]*)/.exec(window.location.search);
+    if (!match) {
+      return '';
+    }
+    return decodeURIComponent(match[1].replace(/\+/g, ' ')).trim();
+  }
+
+  // the same as search.parse_q and search.split_search_term
+  function parseQ(q) {
+    var words = q.split(/\s+/);
+    var components = [];
+    var subterms = [];
+    var i;
+    if (q.indexOf('=') === -1) {
+      for (i = 0; i < words.length; i++) {
+        components.push([['n', 'name', words[i]]]);
+      }
+      return components;
+    }
+    for (i = 0; i < words.length; i++) {
+      var word = words[i].indexOf('=') === -1 ? 'n.name=' + words[i] :
+        words[i];
+      var pos = word.indexOf('=');
+      var key = word.slice(0, pos);
+      var dot = key.indexOf('.');
+      if (dot === -1) {
+        throw new Error('no prefix specified');
+      }
+      if (PREFIXES.indexOf(key.slice(0, dot)) === -1) {
+        throw new Error('unknown prefix ' + key.slice(0, dot));
+      }
+      subterms.push([key.slice(0, dot), key.slice(dot + 1),
+                     word.slice(pos + 1)]);
+    }
+    return [subterms];
+  }
+
+  function union(ids, other) {
+    for (var i = 0; i < other.length; i++) {
+      ids[other[i]] = true;
+    }
+  }
+
+  function searchSubterm(index, prefix, name, s, ids) {
+    var postings, token;
+    if (prefix === 'a_') {
+      var hasAttr = {};
+      union(hasAttr, index.has_attrs[name] || []);
+      for (var id = 0; id < index.nodes.length; id++) {
+        if (!hasAttr[id]) {
+          ids[id] = true;
+        }
+      }
+      return;
+    }
+    if (prefix.charAt(0) === 'n') {
+      // only the names of the node objects are indexed, and every node has
+      // a name
+      if (name !== 'name' || prefix === 'n_') {
+        return;
+      }
+      postings = index.names;
+    } else {
+      postings = index.attrs[name] || {};
+    }
+    if (index.case_insensitive) {
+      s = s.toLowerCase();
+    }
+    if (prefix === 'nx' || prefix === 'ax') {
+      if (Object.prototype.hasOwnProperty.call(postings, s)) {
+        union(ids, postings[s]);
+      }
+    } else {
+      for (token in postings) {
+        if (Object.prototype.hasOwnProperty.call(postings, token) &&
+            token.indexOf(s) !== -1) {
+          union(ids, postings[token]);
+        }
+      }
+    }
+    if (prefix.charAt(0) === 'a' && index.bools[name]) {
+      union(ids, index.bools[name][
+        FALSE_STR_PATTERN.test(s) ? 'false' : 'true'] || []);
+    }
+  }
+
+  // components are ANDed and their sub-terms ORed, in the order of nodes
+  function search(index, components) {
+    var matched = null;
+    for (var i = 0; i < components.length; i++) {
+      var ids = {};
+      for (var j = 0; j < components[i].length; j++) {
+        var subterm = components[i][j];
+        searchSubterm(index, subterm[0], subterm[1], subterm[2], ids);
+      }
+      if (matched !== null) {
+        for (var id in matched) {
+          if (!ids[id]) {
+            delete matched[id];
+          }
+        }
+      } else {
+        matched = ids;
+      }
+    }
+    var res = [];
+    for (var k = 0; k < index.nodes.length; k++) {
+      if (matched === null || matched[k]) {
+        res.push(index.nodes[k]);
+      }
+    }
+    return res;
+  }
+
+  function render(paths) {
+    info.textContent = paths.length + ' results';
+    for (var i = 0; i < paths.length; i++) {
+      var item = document.createElement('li');
+      var link = document.createElement('a');
+      link.href = '/node/' + paths[i].split('/').map(
+        encodeURIComponent).join('/') + '/';
+      link.textContent = paths[i];
+      item.appendChild(link);
+      results.appendChild(item);
+    }
+  }
+
+  var q = getQ();
+  if (!q) {
+    return;
+  }
+  document.getElementById('search-box').value = q;
+  var request = new XMLHttpRequest();
+  request.open('GET', container.getAttribute('data-index'));
+  request.onload = function () {
+    if (request.status !== 200) {
+      info.textContent = 'Failed to load the search index.';
+      return;
+    }
+    try {
+      render(search(JSON.parse(request.responseText), parseQ(q)));
+    } catch (e) {
+      info.textContent = e.message;
+    }
+  };
+  request.send();
+})();
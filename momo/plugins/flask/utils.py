@@ -1,4 +1,6 @@
 import re
+import threading
+from collections import OrderedDict
 from inspect import getmembers, isfunction
 from momo.utils import txt_type, bin_type
 
@@ -32,3 +34,45 @@ def to_list(value, sep=','):
 
 def split_by(s, sep=','):
     return [item.strip() for item in filter(lambda x: x.strip(), s.split(sep))]
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping bounded to `maxsize` items, which evicts the least
+    recently used item when it is full.  It counts hits and misses of `get`.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
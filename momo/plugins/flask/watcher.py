@@ -0,0 +1,110 @@
+# bucket file watcher
+
+import logging
+import os
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class BucketWatcher(threading.Thread):
+    """
+    A daemon thread that watches the files of a bucket (the document and its
+    journal) and calls `callback` when they change.
+
+    inotify is used if pyinotify is installed; otherwise the files are polled
+    for changes of their mtime, size and inode.  Either way, `callback` is
+    called once the changes have settled for `interval` seconds, so that a
+    burst of writes only triggers one call.  Exceptions raised by `callback`
+    are logged, and watching goes on.
+
+    :param paths: paths of the files to watch, which do not have to exist.
+    :param callback: the function to call in the watcher thread.
+    :param interval: the polling interval in seconds.
+    """
+
+    def __init__(self, paths, callback, interval=1.0):
+        super(BucketWatcher, self).__init__(name='momo-bucket-watcher')
+        self.daemon = True
+        self.paths = set(os.path.abspath(path) for path in paths)
+        self.callback = callback
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        if pyinotify is not None:
+            self._watch()
+        else:
+            self._poll()
+
+    def _changed(self):
+        try:
+            self.callback()
+        except Exception:
+            logger.exception('failed to handle changes of %s',
+                             ', '.join(sorted(self.paths)))
+
+    def _stat(self):
+        res = []
+        for path in sorted(self.paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                res.append(None)
+            else:
+                res.append((st.st_mtime, st.st_size, st.st_ino))
+        return res
+
+    def _poll(self):
+        last = self._stat()
+        pending = False
+        while not self._stopped.wait(self.interval):
+            cur = self._stat()
+            if cur != last:
+                last = cur
+                pending = True
+            elif pending:
+                pending = False
+                self._changed()
+
+    def _watch(self):
+        paths = self.paths
+        events = []
+
+        class EventHandler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.pathname in paths:
+                    events.append(event)
+
+        # the directories are watched since files are replaced atomically
+        wm = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MODIFY)
+        for dirname in set(os.path.dirname(path) for path in paths):
+            wm.add_watch(dirname, mask)
+        notifier = pyinotify.Notifier(wm, EventHandler(),
+                                      timeout=int(self.interval * 1000))
+        pending = False
+        try:
+            while not self._stopped.is_set():
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+                    if events:
+                        del events[:]
+                        pending = True
+                elif pending:
+                    pending = False
+                    self._changed()
+        finally:
+            notifier.stop()
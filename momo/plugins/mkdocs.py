@@ -1,12 +1,42 @@
 import os
+import gc
+import json
+import multiprocessing
 import shutil
 import yaml
 import glob
-from momo.utils import run_cmd, mkdir_p, utf8_encode, txt_type, eval_path
+from momo.utils import (
+    run_cmd,
+    mkdir_p,
+    utf8_encode,
+    txt_type,
+    eval_path,
+    atomic_write,
+    hash_content,
+)
 from momo.plugins.base import Plugin
 
 
 BASE_CONFIG_NAME = '__base__'
+# the manifest of the pages in docs_dir, which is a hidden file in mkdocs_dir
+MANIFEST_NAME = '.momo_manifest.json'
+# fewer pages than this are made in the main process
+MIN_PARALLEL_PAGES = 200
+
+# the plugin whose page jobs are run by the forked workers of the pool
+_job_plugin = None
+
+
+def _run_page_job(job_id):
+    """
+    Run a page job in a worker, which shares the tree of the plugin by fork.
+    Return the items of the pages it made, for the manifest.
+    """
+    plugin = _job_plugin
+    func, args = plugin.jobs[job_id]
+    plugin.pages = {}
+    func(*args)
+    return list(plugin.pages.items())
 
 
 class Mkdocs(Plugin):
@@ -21,11 +51,13 @@ class Mkdocs(Plugin):
         'momo_docs_dir': None,
         'momo_docs_pathname': 'docs',
         'momo_control_attr': False,  # whether rendering control attriutes
+        'momo_workers': None,  # processes to make pages (defaults to CPUs)
     }
 
     def setup(self):
-        self.root = self.settings.bucket.root
-        bucket_name = self.settings.bucket.name
+        bucket = self.settings.get_bucket(read_only=True)
+        self.root = bucket.root
+        bucket_name = bucket.name
         base_configs = self.settings.plugins.get(
             'mkdocs', {}).get(BASE_CONFIG_NAME, {})
         configs = self.settings.plugins.get(
@@ -50,25 +82,112 @@ class Mkdocs(Plugin):
                                        bucket_name)
         self.docs_dir = os.path.join(self.mkdocs_dir, 'docs')
         self.site_dir = os.path.join(self.mkdocs_dir, 'site')
-        if os.path.exists(self.docs_dir):
-            shutil.rmtree(self.docs_dir)
+        self.manifest_path = os.path.join(self.mkdocs_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        # the page paths to hashes of the pages made in this run
+        self.pages = {}
+        # the (function, args) of the pages to make
+        self.jobs = []
         mkdir_p(self.docs_dir)
         mkdir_p(self.site_dir)
-        assets = glob.glob(os.path.join(self.mkdocs_dir, '*'))
-        for asset in assets:
-            filename = os.path.basename(asset)
-            if filename not in set(['docs', 'site', 'mkdocs.yml']):
-                os.symlink(asset, os.path.join(self.docs_dir, filename))
+        self._link_assets()
 
         self.root.name = self.momo_configs['momo_root_name']
 
+    def _load_manifest(self):
+        """
+        Load the manifest of page paths (relative to docs_dir) to the hashes
+        of their contents.  Without a manifest, docs_dir was made by an older
+        version or by hand, so it is cleared to avoid stale pages.  So is it
+        with a manifest that cannot be read (such as one left partial by a
+        crash), which makes a full rebuild.
+        """
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as f:
+                    pages = json.load(f)['pages']
+                if isinstance(pages, dict):
+                    return pages
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                pass
+        if os.path.exists(self.docs_dir):
+            shutil.rmtree(self.docs_dir)
+        return {}
+
+    def _save_manifest(self):
+        with atomic_write(self.manifest_path, mode='w', fsync=False) as f:
+            json.dump({'pages': self.pages}, f, indent=0, sort_keys=True)
+
+    def _link_assets(self):
+        """
+        Link the assets in mkdocs_dir into docs_dir.  Existing links are kept
+        and links to removed assets are removed.
+        """
+        assets = set(
+            asset for asset in glob.glob(os.path.join(self.mkdocs_dir, '*'))
+            if os.path.basename(asset) not in set(
+                ['docs', 'site', 'mkdocs.yml'])
+        )
+        for filename in os.listdir(self.docs_dir):
+            link = os.path.join(self.docs_dir, filename)
+            if (os.path.islink(link) and
+                    os.path.dirname(os.readlink(link)) == self.mkdocs_dir and
+                    os.readlink(link) not in assets):
+                os.remove(link)
+        for asset in assets:
+            link = os.path.join(self.docs_dir, os.path.basename(asset))
+            if os.path.islink(link):
+                if os.readlink(link) == asset:
+                    continue
+                os.remove(link)
+            os.symlink(asset, link)
+
+    def _write_page(self, res, content):
+        """
+        Write the content of a page to docs_dir, unless it is unchanged since
+        the last run, so that mkdocs only sees the changed pages.
+
+        :param res: the path of the page relative to docs_dir.
+        :param content: the content (text or bytes) of the page.
+        """
+        content = utf8_encode(content)
+        digest = hash_content(content)
+        self.pages[res] = digest
+        filename = os.path.join(self.docs_dir, res)
+        if self.manifest.get(res) == digest and os.path.exists(filename):
+            return
+        dirname = os.path.dirname(filename)
+        if dirname:
+            mkdir_p(dirname)
+        with atomic_write(filename, fsync=False) as f:
+            f.write(content)
+
+    def _remove_stale_pages(self):
+        """
+        Remove the pages of the last run that are not made in this run, and
+        then their directories if they are empty.
+        """
+        for res in set(self.manifest) - set(self.pages):
+            filename = os.path.join(self.docs_dir, res)
+            if os.path.exists(filename):
+                os.remove(filename)
+            dirname = os.path.dirname(filename)
+            while dirname != self.docs_dir and not os.listdir(dirname):
+                os.rmdir(dirname)
+                dirname = os.path.dirname(dirname)
+
     def _get_pages(self, root, level=0):
+        """
+        Get the pages structure of mkdocs.yml, and add the jobs to make the
+        pages to self.jobs.
+        """
         if level == self.momo_configs['momo_page_level']:
-            filename = self._make_page(root)
-            return filename
+            self.jobs.append((self._make_page, (root,)))
+            return self._get_page_path(root)
         else:
+            self.jobs.append((self._make_index_page, (root, level + 1)))
             pages = [
-                {'Index': self._make_index_page(root, level + 1)}
+                {'Index': self._get_index_page_path(root)}
             ]
             pages += [
                 {elem.name: self._get_pages(elem, level + 1)}
@@ -76,6 +195,45 @@ class Mkdocs(Plugin):
             ]
             return pages
 
+    def _make_pages(self):
+        """
+        Run the page jobs, in a pool of forked processes if there are enough
+        of them.  The pages made by the workers are merged into self.pages in
+        the order of the jobs.
+        """
+        workers = (self.momo_configs['momo_workers'] or
+                   multiprocessing.cpu_count())
+        if (workers == 1 or len(self.jobs) < MIN_PARALLEL_PAGES or
+                not hasattr(os, 'fork')):
+            for func, args in self.jobs:
+                func(*args)
+            return
+        global _job_plugin
+        _job_plugin = self
+        # keep the tree out of the collector of the workers, which would
+        # otherwise touch (and copy) all of its pages
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        pages = self.pages
+        # the workers get the tree by fork, whatever the default start method
+        context = (multiprocessing.get_context('fork')
+                   if hasattr(multiprocessing, 'get_context')
+                   else multiprocessing)
+        pool = context.Pool(workers)
+        try:
+            chunksize = len(self.jobs) // (workers * 4) + 1
+            for items in pool.imap(_run_page_job, range(len(self.jobs)),
+                                   chunksize):
+                pages.update(items)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _job_plugin = None
+        self.pages = pages
+
     def _get_docs(self):
         if self.momo_configs['momo_docs_dir'] is None:
             return []
@@ -83,17 +241,15 @@ class Mkdocs(Plugin):
         if os.path.isdir(src_momo_docs_dir):
             markdown_paths = glob.glob(
                 os.path.join(src_momo_docs_dir, '*.md'))
-            momo_docs_dir = os.path.join(
-                self.docs_dir, self.momo_configs['momo_docs_pathname'])
-            mkdir_p(momo_docs_dir)
             docs = []
             for markdown_path in markdown_paths:
-                shutil.copy(markdown_path, momo_docs_dir)
                 markdown_basename = os.path.basename(markdown_path)
                 doc_title = os.path.splitext(markdown_basename)[0].title()
                 doc_path = os.path.join(
                     self.momo_configs['momo_docs_pathname'], markdown_basename
                 )
+                with open(markdown_path, 'rb') as f:
+                    self._write_page(doc_path, f.read())
                 docs.append({doc_title: doc_path})
             return [{'Docs': docs}]
 
@@ -126,12 +282,15 @@ class Mkdocs(Plugin):
             return (width, height)
         return this_lazy_load_size
 
+    def _get_page_path(self, elem):
+        return '%s.md' % os.path.join(*elem.path)
+
+    def _get_index_page_path(self, elem):
+        base = os.path.join(*elem.path) if elem.path else ''
+        return os.path.join(base, 'index.md')
+
     def _make_page(self, elem):
-        res = '%s.md' % os.path.join(*elem.path)
-        filename = os.path.join(self.docs_dir, res)
-        dirname = os.path.dirname(filename)
-        if dirname:
-            mkdir_p(dirname)
+        res = self._get_page_path(elem)
         kwargs = {}
         this_kwargs = {}
         lazy_load_size = self._get_lazy_load_size(elem)
@@ -141,31 +300,24 @@ class Mkdocs(Plugin):
         if this_lazy_load_size is not None:
             this_kwargs['lazy_load_size'] = this_lazy_load_size
         buf = []
-        with open(filename, 'w') as f:
-            buf.append(self._make_title(elem))
-            buf.append(self._make_attrs(elem, **this_kwargs))
-            buf.append(self._make_nodes(elem, **kwargs))
-            f.write(utf8_encode('\n'.join(buf)))
+        buf.append(self._make_title(elem))
+        buf.append(self._make_attrs(elem, **this_kwargs))
+        buf.append(self._make_nodes(elem, **kwargs))
+        self._write_page(res, '\n'.join(buf))
         return res
 
     def _make_index_page(self, elem, level):
-        base = os.path.join(*elem.path) if elem.path else ''
-        res = os.path.join(base, 'index.md')
-        filename = os.path.join(self.docs_dir, res)
-        dirname = os.path.dirname(filename)
-        if dirname:
-            mkdir_p(dirname)
+        res = self._get_index_page_path(elem)
         kwargs = {}
         lazy_load_size = self._get_lazy_load_size(elem)
         if lazy_load_size is not None:
             kwargs['lazy_load_size'] = lazy_load_size
         buf = []
-        with open(filename, 'w') as f:
-            buf.append(self._make_title(elem))
-            buf.append(self._make_attrs(elem))
-            buf.append(self._make_nodes(elem, index=True, level=level,
-                                        **kwargs))
-            f.write(utf8_encode('\n'.join(buf)))
+        buf.append(self._make_title(elem))
+        buf.append(self._make_attrs(elem))
+        buf.append(self._make_nodes(elem, index=True, level=level,
+                                    **kwargs))
+        self._write_page(res, '\n'.join(buf))
         return res
 
     def _make_title(self, elem):
@@ -290,10 +442,16 @@ class Mkdocs(Plugin):
         return '\n'.join(buf)
 
     def _make_mkdocs_yml(self):
+        """Write mkdocs.yml unless it is unchanged."""
         mkdocs_yml = os.path.join(self.mkdocs_dir, 'mkdocs.yml')
-        with open(mkdocs_yml, 'w') as f:
-            yaml.dump(self.mkdocs_configs, f, default_flow_style=False,
-                      allow_unicode=True)
+        content = utf8_encode(yaml.dump(
+            self.mkdocs_configs, default_flow_style=False, allow_unicode=True))
+        if os.path.exists(mkdocs_yml):
+            with open(mkdocs_yml, 'rb') as f:
+                if f.read() == content:
+                    return
+        with atomic_write(mkdocs_yml, fsync=False) as f:
+            f.write(content)
 
     def _serve(self, args=None):
         os.chdir(self.mkdocs_dir)
@@ -307,8 +465,11 @@ class Mkdocs(Plugin):
 
     def run(self, args=None):
         pages = self._get_pages(self.root)
+        self._make_pages()
         docs = self._get_docs()
         self.mkdocs_configs['pages'] = pages + docs
+        self._remove_stale_pages()
+        self._save_manifest()
         self._make_mkdocs_yml()
         self._serve(args)
 
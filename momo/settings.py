@@ -11,6 +11,7 @@ ENV_DEFAULT_BUCKET = 'MOMO_DEFAULT_BUCKET'
 DEFULT_BUCKET_PATH = eval_path('~/.momo/buckets/default.yml')
 DEFAULT_SETTINGS_DIR = eval_path('~/.momo')
 DEFAULT_SETTINGS_FILE = os.path.join(DEFAULT_SETTINGS_DIR, 'settings.yml')
+CACHE_DIRNAME = 'cache'
 BUCKET_FILE_TYPES = {
     'yaml': ('.yaml', '.yml')
 }
@@ -34,6 +35,10 @@ class Settings(object):
     _defaults = {
         'backend': 'yaml',
         'lazy_bucket': True,
+        'bucket_snapshot': True,
+        'bucket_journal': True,
+        'journal_compact_size': 1000,
+        'fast_writes': False,
         'plugins': {},
         'action': 'default'
     }
@@ -108,15 +113,26 @@ class Settings(object):
             }
         return self._buckets
 
-    def to_bucket(self, name, path):
+    @property
+    def cache_dir(self):
+        """Directory for caches such as bucket snapshots."""
+        return os.path.join(self.settings_dir, CACHE_DIRNAME)
+
+    def to_bucket(self, name, path, read_only=False):
         BucketDocument = getattr(self.backend, 'BucketDocument')
-        document = BucketDocument(name, path)
+        cache_dir = self.cache_dir if self.bucket_snapshot else None
+        document = BucketDocument(name, path, cache_dir=cache_dir,
+                                  read_only=read_only,
+                                  journal=self.bucket_journal,
+                                  fast_writes=self.fast_writes)
         return Bucket(document, self)
 
-    @property
-    def bucket(self):
+    def get_bucket(self, read_only=False):
         """
         Load the bucket (named self.cbn) from path.
+
+        :param read_only: whether to load the bucket in read-only mode, which
+                          is faster but the bucket cannot be dumped.
         """
         name = self.cbn
         if name not in self.buckets:
@@ -124,7 +140,14 @@ class Settings(object):
         path = self.buckets[name]
         if not os.path.exists(path):
             self._create_empty_bucket(path)
-        return self.to_bucket(name, path)
+        return self.to_bucket(name, path, read_only=read_only)
+
+    @property
+    def bucket(self):
+        """
+        Load the bucket (named self.cbn) from path.
+        """
+        return self.get_bucket()
 
     @property
     def backend(self):
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import
+from contextlib import contextmanager
 import errno
+import hashlib
+import itertools
 import os
 import platform
-import pydoc
 import sh
+import shutil
 import six
 import shlex
+import subprocess
 import sys
+import tempfile
 
 
 MIN_PAGE_LINES = 50
@@ -92,12 +97,150 @@ def mkdir_p(path):
             raise
 
 
+# os.replace is not available in Python 2, where os.rename replaces the
+# destination atomically on POSIX
+replace_file = getattr(os, 'replace', os.rename)
+
+
+def fsync_dir(path):
+    """Flush the directory entry changes (such as renames) of a directory."""
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_write(path, mode='wb', fsync=True):
+    """
+    Open a temporary file in the same directory as `path` for writing, and
+    replace `path` with it on success, so that readers see either the old or
+    the new file, and a failed write leaves the old file intact.
+
+    :param path: the path to write to.
+    :param mode: the mode to open the temporary file with.
+    :param fsync: whether to flush the file and the rename to disk before
+                  returning.  Without it, the replacement is still atomic for
+                  readers but may be lost on a system crash.
+    """
+    # replace the target of a symlink rather than the link itself
+    path = os.path.realpath(path)
+    dirname = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname, prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        replace_file(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync:
+        fsync_dir(dirname)
+
+
+def hash_content(content):
+    """
+    Get the hex digest of the content (text or bytes), which changes whenever
+    the content does.
+    """
+    return hashlib.sha1(utf8_encode(content)).hexdigest()
+
+
 def page_lines(lines):
-    if not lines:
+    """
+    Print lines, through the pager if there are at least `MIN_PAGE_LINES` of
+    them and the output is a terminal.  Only the first `MIN_PAGE_LINES` lines
+    are buffered to decide whether to page, and the rest are streamed as they
+    are generated.
+
+    As with pydoc.pager, the pager is $PAGER, or less (or more if less is not
+    installed), and the lines are printed if no pager can be started.  A
+    reader that quits early, such as the pager or "head", ends the output
+    without errors.
+
+    :param lines: an iterable of lines.
+    """
+    lines = iter(lines)
+    head = list(itertools.islice(lines, MIN_PAGE_LINES))
+    if not head:
         return
-    text = '\n'.join(lines)
-    os.environ['LESS'] = 'FRSX'
-    if len(lines) >= MIN_PAGE_LINES:
-        pydoc.pager(text)
-    else:
-        print(utf8_encode(text))
+    lines = itertools.chain(head, lines)
+    if len(head) >= MIN_PAGE_LINES and _can_page():
+        os.environ['LESS'] = 'FRSX'
+        pager = os.environ.get('PAGER')
+        for cmd_str in ([pager] if pager else ['less', 'more']):
+            if pipe_lines(lines, cmd_str):
+                return
+    try:
+        for line in lines:
+            print(_native_line(line))
+        sys.stdout.flush()
+    except (IOError, OSError) as e:
+        # the reader of the output has quit before reading all the lines
+        if e.errno != errno.EPIPE:
+            raise
+        _discard_stdout()
+
+
+def pipe_lines(lines, cmd_str):
+    """
+    Pipe lines to the standard input of a command, such as a pager.
+
+    :return: whether the command has been started.
+    """
+    try:
+        proc = subprocess.Popen(shlex.split(cmd_str), stdin=subprocess.PIPE)
+    except OSError:
+        return False
+    try:
+        try:
+            for line in lines:
+                proc.stdin.write(utf8_encode(_native_line(line)) + b'\n')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            proc.stdin.close()
+    except (IOError, OSError) as e:
+        # the pager has quit before reading all the lines
+        if e.errno != errno.EPIPE:
+            raise
+    while True:
+        try:
+            proc.wait()
+            break
+        except KeyboardInterrupt:
+            # let the pager handle interrupts
+            pass
+    return True
+
+
+def _can_page():
+    """Whether the output is a terminal that a pager can use."""
+    return (sys.stdin.isatty() and sys.stdout.isatty() and
+            os.environ.get('TERM') not in ('dumb', 'emacs'))
+
+
+def _discard_stdout():
+    """
+    Point stdout to devnull, so that the output still buffered is not flushed
+    to the closed pipe (with an error) on exit.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+
+def _native_line(line):
+    if not isinstance(line, (txt_type, bin_type)):
+        line = txt_type(line)
+    return line if PY3 else utf8_encode(line)
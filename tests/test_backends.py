@@ -0,0 +1,107 @@
+import os
+import pytest
+from collections import OrderedDict
+from momo.backends.base import DocumentError
+from momo.backends.yaml import BucketDocument
+from conftest import TEST_DIR
+
+
+BUCKET = u"""\
+# my books
+Books:
+    Designing Data-Intensive Applications:
+        author: 'Martin Kleppmann'
+        tags: [databases, distributed]
+    # by Donovan and Kernighan
+    The Go Programming Language:
+        path: /books/gopl.pdf
+"""
+
+
+@pytest.fixture
+def bucket_file(request):
+    path = os.path.join(TEST_DIR, 'bucket.yml')
+    with open(path, 'w') as f:
+        f.write(BUCKET)
+    return path
+
+
+@pytest.mark.usefixtures('testdir')
+class TestBucketDocument:
+
+    def test_snapshot(self, bucket_file):
+        cache_dir = os.path.join(TEST_DIR, 'cache')
+        document = BucketDocument('test', bucket_file, cache_dir=cache_dir)
+        content = document.load()
+        assert document.round_trip
+        assert os.path.exists(document.snapshot.cache_path)
+
+        document = BucketDocument('test', bucket_file, cache_dir=cache_dir)
+        assert document.load() == content
+        assert not document.round_trip
+
+        # the snapshot is invalidated when the document changes
+        with open(bucket_file, 'a') as f:
+            f.write(u'Anime: {}\n')
+        document = BucketDocument('test', bucket_file, cache_dir=cache_dir)
+        assert 'Anime' in document.load()
+        assert document.round_trip
+
+    def test_dump_from_snapshot(self, bucket_file):
+        """Dumping snapshot content gives the same result as round trip."""
+        cache_dir = os.path.join(TEST_DIR, 'cache')
+        document = BucketDocument('test', bucket_file)
+        content = document.load()
+        content['Books']['The Go Programming Language']['author'] = 'Donovan'
+        document.dump(content)
+        with open(bucket_file) as f:
+            expected = f.read()
+
+        with open(bucket_file, 'w') as f:
+            f.write(BUCKET)
+        BucketDocument('test', bucket_file, cache_dir=cache_dir).load()
+        document = BucketDocument('test', bucket_file, cache_dir=cache_dir)
+        content = document.load()
+        assert not document.round_trip
+        content['Books']['The Go Programming Language']['author'] = 'Donovan'
+        document.dump(content)
+        with open(bucket_file) as f:
+            text = f.read()
+        assert text == expected
+        assert "author: 'Martin Kleppmann'" in text
+        assert BucketDocument('test', bucket_file).load() == content
+
+    def test_read_only(self, bucket_file):
+        document = BucketDocument('test', bucket_file, read_only=True)
+        content = document.load()
+        assert type(content) is OrderedDict
+        assert list(content['Books']) == [
+            'Designing Data-Intensive Applications',
+            'The Go Programming Language',
+        ]
+        assert content == BucketDocument('test', bucket_file).load()
+        with pytest.raises(DocumentError):
+            document.dump(content)
+
+        # scalars are resolved as in YAML 1.2, like the round-trip loader
+        with open(bucket_file, 'w') as f:
+            f.write(u"Movie:\n    rating: 010\n    length: 1:30\n"
+                    u"    watched: yes\n    subtitles: on\n"
+                    u"    seen: true\n    size: 0o10\n")
+        content = BucketDocument('test', bucket_file, read_only=True).load()
+        assert dict(content['Movie']) == {
+            'rating': 10, 'length': '1:30', 'watched': 'yes',
+            'subtitles': 'on', 'seen': True, 'size': 8}
+        assert content == BucketDocument('test', bucket_file).load()
+
+    def test_atomic_dump(self, bucket_file):
+        os.chmod(bucket_file, 0o640)
+        for fast_writes in (False, True):
+            document = BucketDocument('test', bucket_file,
+                                      fast_writes=fast_writes)
+            content = document.load()
+            content['Anime'] = OrderedDict([('Sakura Quest', True)])
+            document.dump(content)
+            assert os.stat(bucket_file).st_mode & 0o777 == 0o640
+            assert os.listdir(TEST_DIR) == ['bucket.yml']
+            assert BucketDocument('test', bucket_file).load() == content
@@ -0,0 +1,99 @@
+import os
+import pytest
+from momo.core import AttrError
+from momo.settings import Settings
+from conftest import TEST_DIR
+
+# the command line and its dependencies are optional
+cli = pytest.importorskip('momo.cli')
+
+
+BUCKET = u"""\
+Books:
+    Designing Data-Intensive Applications:
+        author: Martin Kleppmann
+        tags: [databases, distributed]
+        year: 2017
+    The Go Programming Language:
+        path: /books/gopl.pdf
+        Notes:
+            path: /notes/gopl.md
+    SICP: mit
+Anime:
+    Sakura Quest:
+        path: /anime/sakura_quest
+        tags: [P.A. Works]
+"""
+
+DDIA = 'Designing Data-Intensive Applications'
+GOPL = 'The Go Programming Language'
+
+# the output of "ls" before it was streamed, by names and Indexer options
+LS_OUTPUTS = [
+    ([], {}, ['1 [N] Books', '2 [N] Anime']),
+    ([], {'show_path': True}, ['1 [N] Books', '2 [N] Anime']),
+    (['Books'], {}, ['1 [N] %s' % DDIA, '2 [N] %s' % GOPL, '3 [A] SICP']),
+    (['1'], {}, ['1 [N] %s' % DDIA, '2 [N] %s' % GOPL, '3 [A] SICP']),
+    (['2'], {'unordered': False},
+     ['1 [N] %s' % DDIA, '2 [A] SICP', '3 [N] %s' % GOPL]),
+    (['1', '1'], {'show_path': True},
+     ['Books', '  %s' % DDIA, '    1 [A] author', '    2 [A] tags',
+      '    3 [A] year']),
+    (['Books', '2'], {}, ['1 [A] path', '2 [N] Notes']),
+    (['Books', '1', 'tags'], {},
+     ['tags:', '  1 databases', '  2 distributed']),
+    (['2', '1', '2'], {'unordered': False},
+     ['tags:', '  1 databases', '  2 distributed']),
+    (['Books', '1', 'tags', '2'], {'show_path': True},
+     ['Books', '  %s' % DDIA, '        tags[2]: distributed']),
+    (['1', '1', 'author'], {}, ['author: Martin Kleppmann']),
+    (['Books', DDIA], {'expand_attr': True},
+     ['1 [A] author', '2 [A] tags', '3 [A] year']),
+    (['Books', GOPL], {'show_path': True},
+     ['Books', '  %s' % GOPL, '    1 [A] path', '    2 [N] Notes']),
+    (['Books'], {'short_output': True}, [DDIA, GOPL, 'SICP']),
+    (['Books', '1'], {'short_output': True, 'show_path': True},
+     ['Books', '  %s' % DDIA, 'author', 'tags', 'year']),
+]
+
+
+@pytest.fixture
+def root(request):
+    settings_dir = os.path.join(TEST_DIR, 'momo')
+    settings = Settings(settings_dir=settings_dir,
+                        settings_file=os.path.join(settings_dir,
+                                                   'settings.yml'))
+    path = os.path.join(TEST_DIR, 'bucket.yml')
+    with open(path, 'w') as f:
+        f.write(BUCKET)
+
+    @request.addfinalizer
+    def reset_configs():
+        cli.configs.no_output = False
+        cli.configs.short_output = False
+
+    return settings.to_bucket('test', path).root
+
+
+def make_indexer(root, names, **kwargs):
+    kwargs.setdefault('unordered', True)
+    return cli.Indexer(elem=root, parser=None, names=names, run=None,
+                       cmd=None, **kwargs)
+
+
+@pytest.mark.usefixtures('testdir')
+class TestIndexer:
+
+    @pytest.mark.parametrize('names,kwargs,lines', LS_OUTPUTS)
+    def test_ls(self, root, names, kwargs, lines):
+        assert list(make_indexer(root, names, **kwargs).ls()) == lines
+
+    @pytest.mark.parametrize('names,kwargs,lines', LS_OUTPUTS[:6])
+    def test_cache_lines(self, root, names, kwargs, lines):
+        indexer = make_indexer(root, names, cache_lines=True, **kwargs)
+        assert list(indexer.ls()) == lines
+        assert indexer.lines == lines
+
+    def test_ls_error(self, root):
+        with pytest.raises(AttrError):
+            list(make_indexer(root, ['1', '1', 'year', '1']).ls())
@@ -1,2 +1,229 @@
+import os
+import pytest
+from momo.backends import OrderedDict
+from momo.core import ElemError
+from momo.settings import Settings
+from conftest import TEST_DIR
+
+
+BUCKET = u"""\
+Books:
+    Designing Data-Intensive Applications:
+        author: Martin Kleppmann
+        tags: [databases, distributed]
+    The Go Programming Language:
+        path: /books/gopl.pdf
+Anime:
+    Sakura Quest:
+        path: /anime/sakura_quest
+"""
+
+
+@pytest.fixture
+def settings(request):
+    settings_dir = os.path.join(TEST_DIR, 'momo')
+    return Settings(settings_dir=settings_dir,
+                    settings_file=os.path.join(settings_dir, 'settings.yml'))
+
+
+@pytest.fixture
+def bucket_file(request):
+    path = os.path.join(TEST_DIR, 'bucket.yml')
+    with open(path, 'w') as f:
+        f.write(BUCKET)
+    return path
+
+
+@pytest.mark.usefixtures('testdir')
 class TestBucket:
-    pass
+
+    def test_journal(self, settings, bucket_file):
+        bucket = settings.to_bucket('test', bucket_file)
+        books = bucket.root.get_elem_by_name('Books')
+        books.add('SICP', 'mit')
+        bucket.record('add', books, 'SICP', 'mit')
+        tags = books.get_elem_by_name(
+            'Designing Data-Intensive Applications').get_elem_by_name('tags')
+        tags.add('storage')
+        bucket.record('add', tags, 'storage')
+        bucket.root.delete('Anime')
+        bucket.record('delete', bucket.root, 'Anime')
+        with open(bucket_file) as f:
+            assert f.read() == BUCKET
+
+        # operations are replayed on load
+        for read_only in (False, True):
+            bucket = settings.to_bucket('test', bucket_file,
+                                        read_only=read_only)
+            assert list(bucket.content) == ['Books']
+            books = bucket.content['Books']
+            assert books['SICP'] == 'mit'
+            assert books['Designing Data-Intensive Applications'][
+                'tags'] == ['databases', 'distributed', 'storage']
+
+        # and compacted into the document on dump
+        bucket = settings.to_bucket('test', bucket_file)
+        bucket.dump()
+        assert not os.path.exists(bucket.document.journal.path)
+        bucket = settings.to_bucket('test', bucket_file)
+        assert bucket.content['Books']['SICP'] == 'mit'
+        assert 'Anime' not in bucket.content
+
+    def test_stale_journal(self, settings, bucket_file, capsys):
+        bucket = settings.to_bucket('test', bucket_file)
+        books = bucket.root.get_elem_by_name('Books')
+        books.add('SICP', 'mit')
+        bucket.record('add', books, 'SICP', 'mit')
+        journal_path = bucket.document.journal.path
+        with open(bucket_file, 'a') as f:
+            f.write('# edited\n')
+
+        # a journal of another version of the document is not replayed, but
+        # moved aside instead of removed, with an error
+        for i in range(2):
+            bucket = settings.to_bucket('test', bucket_file, read_only=True)
+            assert 'SICP' not in bucket.content['Books']
+            err = capsys.readouterr().err
+            if i == 0:
+                assert '1 operation(s)' in err
+                assert journal_path + '.stale' in err
+            else:
+                assert not err
+        assert not os.path.exists(journal_path)
+        with open(journal_path + '.stale') as f:
+            assert 'SICP' in f.read()
+
+    def test_elements(self, settings, bucket_file):
+        bucket = settings.to_bucket('test', bucket_file)
+        root = bucket.root
+        books = root.get_elem_by_name('Books')
+        book = books.get_elem_by_name('Designing Data-Intensive Applications')
+        tags = book.get_elem_by_name('tags')
+        assert root.is_dir and books.is_dir and book.is_file
+        assert tags.is_attr and tags.has_items
+        assert root.path == () and root.level == 0
+        assert tags.path == ('Books', 'Designing Data-Intensive Applications',
+                             'tags')
+        assert tags.level == 3
+        assert book.action.elem is book
+        assert tags.action.elem is tags
+        assert not hasattr(book, '__dict__') or not book.__dict__
+
+        # a file becomes a directory once a node is added
+        book.add('Notes', OrderedDict([('path', '/notes/ddia.md')]))
+        assert book.is_dir
+        notes = book.get_elem_by_name('Notes')
+        assert notes.len == 1 and notes.is_file
+        assert list(book.nodes) == ['Notes']
+        assert list(book.attrs) == ['author', 'tags']
+        assert book.node_vals == [notes]
+
+        # and stays a directory once its nodes are deleted
+        book.delete('Notes')
+        assert book.is_dir
+        assert not book.nodes and not book.node_vals
+        assert book.attr_vals == book.vals
+
+    def test_classes(self, settings, bucket_file):
+        # the root of an empty bucket only has the placeholder attr
+        with open(bucket_file, 'w') as f:
+            f.write(u'__placeholder__: true\n')
+        root = settings.to_bucket('test', bucket_file).root
+        assert root.is_dir
+        root.add('Books', OrderedDict([('SICP', OrderedDict())]))
+        root.delete('Books')
+        assert root.is_dir
+        assert list(root.elems) == ['__placeholder__']
+
+    def test_partitions(self, settings, bucket_file):
+        bucket = settings.to_bucket('test', bucket_file)
+        books = bucket.root.get_elem_by_name('Books')
+
+        def check(node, nodes, attrs, elem_class):
+            assert list(node.nodes) == nodes
+            assert [elem.name for elem in node.node_vals] == nodes
+            assert list(node.attrs) == attrs
+            assert [elem.name for elem in node.attr_vals] == attrs
+            assert sorted(node.elems) == sorted(nodes + attrs)
+            assert node.__class__.__name__ == elem_class
+
+        # node-only
+        check(books, ['Designing Data-Intensive Applications',
+                      'The Go Programming Language'], [], 'Directory')
+        books.add('count', 2)
+        check(books, ['Designing Data-Intensive Applications',
+                      'The Go Programming Language'], ['count'],
+              'Directory')
+        books.delete('Designing Data-Intensive Applications')
+        books.delete('The Go Programming Language')
+        check(books, [], ['count'], 'Directory')
+        books.delete('count')
+        check(books, [], ['__placeholder__'], 'Directory')
+
+        # attr-only
+        book = bucket.root.get_elem_by_name('Anime').get_elem_by_name(
+            'Sakura Quest')
+        check(book, [], ['path'], 'File')
+        book.add('year', 2017)
+        check(book, [], ['path', 'year'], 'File')
+        book.delete('path')
+        check(book, [], ['year'], 'File')
+
+        # mixed
+        book.add('Episode 1', OrderedDict([('path', '/e1')]))
+        check(book, ['Episode 1'], ['year'], 'Directory')
+        book.add('Episode 2', OrderedDict([('path', '/e2')]))
+        book.delete('year')
+        check(book, ['Episode 1', 'Episode 2'], [], 'Directory')
+        book.add('year', 2017)
+        book.delete('Episode 1')
+        check(book, ['Episode 2'], ['year'], 'Directory')
+        book.delete('Episode 2')
+        check(book, [], ['year'], 'Directory')
+
+    def test_sorted_vals(self, settings, bucket_file):
+        bucket = settings.to_bucket('test', bucket_file)
+        books = bucket.root.get_elem_by_name('Books')
+        names = ['Designing Data-Intensive Applications',
+                 'The Go Programming Language']
+        assert [elem.name for elem in books.svals] == names
+        assert books.svals is books.svals
+
+        # the sorted views are invalidated when elements change
+        books.add('SICP', OrderedDict([('year', 1985)]))
+        assert [elem.name for elem in books.svals] == names[:1] + [
+            'SICP'] + names[1:]
+
+        # sorting by an attribute honors the element type, and elements
+        # without the attribute come last
+        assert [elem.name for elem in books.get_vals(
+            sort_by='year', elem_type='file')] == ['SICP'] + names
+        book = books.get_elem_by_name(names[1])
+        book.add('year', 2015)
+        assert [elem.name for elem in books.get_vals(
+            sort_by='year', elem_type='file')] == ['SICP', names[1], names[0]]
+        assert not books.get_vals(sort_by='year', elem_type='attribute')
+
+    def test_elem_by_num(self, settings, bucket_file):
+        bucket = settings.to_bucket('test', bucket_file)
+        root = bucket.root
+        assert root.get_elem_by_num(1, None, False, None).name == 'Anime'
+        assert root.get_elem_by_num(1, None, True, None).name == 'Books'
+        books = root.get_elem_by_num(2, None, False, None)
+        book = books.get_elem_by_num(1, None, False, 'file')
+        assert book.name == 'Designing Data-Intensive Applications'
+        for num in (0, 3):
+            with pytest.raises(ElemError):
+                root.get_elem_by_num(num, None, False, None)
+
+        # small numbers are selected without sorting all the elements
+        for i in range(100):
+            books.add('book%02d' % ((i * 37) % 100),
+                      OrderedDict([('year', (i * 13) % 7)]))
+        books._sorted = None
+        for sort_by in (None, 'year'):
+            for num in (1, 2, 5, 50, 102):
+                elem = books.get_elem_by_num(num, sort_by, False, None)
+                assert books._sorted is None or num > 5
+                assert elem is books.get_vals(sort_by)[num - 1]
+                books._sorted = None
@@ -0,0 +1,771 @@
+import gzip
+import json
+import os
+import pytest
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from six.moves.urllib.parse import unquote
+from momo.settings import Settings
+from conftest import TEST_DIR
+
+# the flask plugin and its dependencies are optional
+search = pytest.importorskip('momo.plugins.flask.search')
+sorting = pytest.importorskip('momo.plugins.flask.sorting')
+responses = pytest.importorskip('momo.plugins.flask.responses')
+utils = pytest.importorskip('momo.plugins.flask.utils')
+watcher = pytest.importorskip('momo.plugins.flask.watcher')
+
+# the links and sources of the pages of a static site
+LINK_PATTERN = re.compile(r'(?:href|src|data-index)="([^"]*)"')
+
+
+BUCKET = u"""\
+Books:
+    Designing Data-Intensive Applications:
+        author: Martin Kleppmann
+        tags: [databases, distributed]
+        year: 2017
+        read: true
+    The Go Programming Language:
+        author: Alan Donovan, Brian Kernighan
+        tags: [go]
+        read: false
+    SICP:
+        path: /books/sicp.pdf
+Anime:
+    Sakura Quest:
+        tags: [P.A. Works, Drama]
+        read: true
+    Shirobako:
+        tags: [p.a. works]
+        Season 1:
+            episodes: 24
+"""
+
+SORT_BUCKET = u"""\
+a:
+    size: 3
+b:
+    size: 1
+c:
+    path: /c
+d:
+    size: 3
+e:
+    size: big
+f:
+    size: 2.5
+g:
+    path: /g
+"""
+
+TERMS = [
+    'n.name=go',
+    'n.name=Go',
+    'nx.name=SICP',
+    'nx.name=sicp',
+    'n_.name=SICP',
+    'n.parent=Books',
+    'n_.foo=1',
+    'a.author=Donovan',
+    'ax.author=Brian Kernighan',
+    'ax.author=Martin Kleppmann',
+    'a.tags=data',
+    'ax.tags=databases',
+    'ax.tags=P.A. Works',
+    'a.year=201',
+    'ax.episodes=24',
+    'a_.path=1',
+    'a_.tags=1',
+    'a.read=true',
+    'ax.read=false',
+    'a.read=yes',
+    'a.tags=go&a_.read=1',
+    'a.tags=o/n.name=Go',
+    'a.read=true/ax.tags=drama',
+    'n.parent=Books/a_.tags=1',
+]
+
+
+SERVER_SCRIPT = u"""\
+import gc, os, sys
+from momo.plugins.flask.server import PreforkServer
+state = {'version': 0, 'frozen': 0}
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [('%(version)d %(frozen)d ' % state + str(os.getpid())).encode()]
+
+def reload():
+    state['version'] += 1
+    state['frozen'] = gc.get_freeze_count()
+
+PreforkServer(app, '127.0.0.1', int(sys.argv[1]), workers=2,
+              reload=reload, graceful_timeout=5).serve_forever()
+"""
+
+
+def load_root(content):
+    settings_dir = os.path.join(TEST_DIR, 'momo')
+    settings = Settings(settings_dir=settings_dir,
+                        settings_file=os.path.join(settings_dir,
+                                                   'settings.yml'))
+    path = os.path.join(TEST_DIR, 'bucket.yml')
+    with open(path, 'w') as f:
+        f.write(content)
+    return settings.to_bucket('test', path).root
+
+
+def setup_plugin(content, configs=None):
+    """Set up the flask plugin with a bucket and return the plugin."""
+    import momo.plugins.flask
+    settings_dir = os.path.join(TEST_DIR, 'momo')
+    settings = Settings(settings_dir=settings_dir,
+                        settings_file=os.path.join(settings_dir,
+                                                   'settings.yml'))
+    path = os.path.join(TEST_DIR, 'bucket.yml')
+    with open(path, 'w') as f:
+        f.write(content)
+    settings._settings = {
+        'buckets': {'test': path},
+        'plugins': {'flask': {'test': dict(configs or {})}},
+    }
+    settings.cbn = 'test'
+    plugin = momo.plugins.flask.plugin
+    plugin.settings = settings
+    plugin.setup()
+    return plugin
+
+
+@pytest.fixture
+def root(request):
+    return load_root(BUCKET)
+
+
+@pytest.fixture
+def nodes(request):
+    return list(load_root(SORT_BUCKET).node_vals)
+
+
+def sort_names(nodes, terms, desc=False):
+    return ''.join(node.name for node in sorting.sort_nodes_by_terms(
+        terms, list(nodes), desc, functions={}))
+
+
+@pytest.mark.usefixtures('testdir')
+class TestSearchIndex:
+
+    @pytest.mark.parametrize('case_insensitive', [False, True])
+    @pytest.mark.parametrize('sep', [None, ', '])
+    def test_search(self, root, case_insensitive, sep):
+        index = search.SearchIndex(
+            root, case_insensitive=case_insensitive, sep=sep)
+        for term in TERMS:
+            plan = search.compile_search_term(term, case_insensitive, sep)
+            assert plan.search(root, index=index) == \
+                plan.search(root, index=None), term
+
+
+def make_sizes_bucket(count):
+    """A bucket of nodes with sizes that tie, and some without a size."""
+    lines = []
+    for i in range(count):
+        lines.append(u'node%02d:' % ((i * 7) % count))
+        if i % 5:
+            lines.append(u'    size: %d' % ((i * 3) % 11))
+        else:
+            lines.append(u'    path: /%d' % i)
+    return u'\n'.join(lines) + u'\n'
+
+
+class Request(object):
+    def __init__(self, args):
+        from werkzeug.datastructures import MultiDict
+        self.args = MultiDict(args)
+
+
+class Globals(object):
+    sorting_functions = {}
+
+
+@pytest.mark.usefixtures('testdir')
+class TestQueryPlan:
+
+    def test_plan_cache(self, monkeypatch):
+        monkeypatch.setattr(search, 'query_plans', utils.LRUCache(2))
+        plan = search.get_query_plan('n.name=go')
+        assert search.get_query_plan('n.name=go') is plan
+        assert search.get_query_plan('n.name=go', True) is not plan
+        assert (search.query_plans.hits, search.query_plans.misses) == (1, 2)
+        # the least recently used plan is evicted
+        search.get_query_plan('n.name=go')
+        search.get_query_plan('a.tags=go')
+        assert search.get_query_plan('n.name=go') is plan
+        assert search.get_query_plan('n.name=go', True) is not plan
+
+    def test_order(self):
+        plan = search.compile_search_term(
+            'a.tags=data&ax.read=true&a_.path=1/n_.name=x/ax.tags=go&n.name=G')
+        assert plan.explain() == (
+            '(n_.name=x) AND (a_.path=1 OR ax.read=true OR a.tags=data) AND '
+            '(ax.tags=go OR n.name=G)')
+
+    def test_short_circuit(self, root):
+        plan = search.compile_search_term(
+            'a.author=Donovan&ax.read=false/a_.path=1&n.name=Go')
+        calls = []
+
+        def record(func, subterm):
+            def wrapper(node):
+                calls.append(subterm)
+                return func(node)
+            return wrapper
+
+        plan.filters = [
+            [record(func, '%s.%s' % subterm[:2])
+             for func, subterm in zip(funcs, subterms)]
+            for funcs, subterms in zip(plan.filters, plan.components)
+        ]
+        books = root.get_elem_by_name('Books')
+        # a matching sub-term decides its component
+        assert plan.match(
+            books.get_elem_by_name('The Go Programming Language'))
+        assert calls == ['ax.read', 'a_.path']
+        # and a component that does not match decides the term
+        del calls[:]
+        assert not plan.match(books.get_elem_by_name('SICP'))
+        assert calls == ['ax.read', 'a.author']
+
+
+@pytest.mark.usefixtures('testdir')
+class TestSearchLimit:
+
+    def test_truncated(self, root):
+        # names with "o" are Books, Designing..., The Go..., Shirobako and
+        # Season 1
+        plan = search.compile_search_term('n.name=o')
+        everything = plan.search(root)
+        assert len(everything) == 5 and not everything.truncated
+        for limit in range(7):
+            nodes = plan.search(root, limit=limit)
+            if limit < 5:
+                assert nodes == everything[:limit + 1] and nodes.truncated
+            else:
+                assert nodes == everything and not nodes.truncated
+            # the index always answers completely
+            nodes = plan.search(root, index=search.SearchIndex(root),
+                                limit=limit)
+            assert nodes == everything and not nodes.truncated
+
+    def test_pages(self, monkeypatch):
+        setup_plugin(BUCKET)
+        app = sys.modules['momo.plugins.flask.app'].app
+        monkeypatch.setitem(app.config, 'MOMO_SEARCH_INDEX', None)
+        client = app.test_client()
+
+        def get(query):
+            data = client.get('/search/?q=o&' + query).get_data(as_text=True)
+            info = re.search(r'pagination-page-info">([^<]*)<', data)
+            return (info and info.group(1),
+                    re.findall(r'<h2 data-toc-text="([^"]*)"', data))
+
+        # the scan stops after the match that shows that there is a next
+        # page, so the total is a lower bound until the last page
+        assert get('per_page=2') == (
+            '3+ nodes.', ['Books', 'Designing Data-Intensive Applications'])
+        assert get('per_page=2&page=2') == (
+            '5+ nodes.', ['The Go Programming Language', 'Shirobako'])
+        assert get('per_page=2&page=3') == ('5 nodes.', ['Season 1'])
+        assert get('per_page=2&page=4') == ('5 nodes.', [])
+        assert get('per_page=4')[0] == '5+ nodes.'
+        assert get('per_page=5')[0] == '5 nodes.'
+
+
+@pytest.mark.usefixtures('testdir')
+class TestSorting:
+
+    def test_sort_by_terms(self, nodes):
+        # numbers come before strings, and ties are broken by the next term
+        assert sort_names(nodes, ['a.size', '-n.name']) == 'bfdaegc'
+        assert sort_names(nodes, ['a.size', 'n.name']) == 'bfadecg'
+        assert sort_names(nodes, ['-a.size', '-n.name']) == 'edafbgc'
+        assert sort_names(nodes, ['n.name']) == 'abcdefg'
+
+    def test_missing_last(self, nodes):
+        # c and g have no size, and stay in their order
+        assert sort_names(nodes, ['a.size']) == 'bfadecg'
+        assert sort_names(nodes, ['-a.size']) == 'eadfbcg'
+
+    def test_desc(self, nodes):
+        # desc flips the order of each term, but not of missing values
+        assert sort_names(nodes, ['a.size', '-n.name'], desc=True) == \
+            sort_names(nodes, ['-a.size', 'n.name']) == 'eadfbcg'
+        assert sort_names(nodes, ['-a.size'], desc=True) == \
+            sort_names(nodes, ['a.size'])
+
+    def test_top_nodes(self, nodes):
+        for terms in (['a.size'], ['-a.size'], ['n.name'],
+                      ['a.size', '-n.name'], ['-a.size', 'n.name']):
+            for desc in (False, True):
+                funcs, descs = sorting.parse_sorting_term_orders(terms, {})
+                descs = [term_desc != desc for term_desc in descs]
+                expected = sorting.sort_nodes_by_keys(
+                    list(nodes), funcs, descs)
+                for count in range(1, len(nodes) + 1):
+                    top = sorting.top_nodes_by_keys(
+                        list(nodes), funcs, descs, count)
+                    assert top[:count] == expected[:count], (terms, desc)
+                    # the rest are kept in their order
+                    assert top[count:] == [node for node in nodes
+                                           if node not in top[:count]]
+
+    @pytest.mark.parametrize('args', [
+        [('sort', 'a.size')],
+        [('sort', '-a.size'), ('sort', 'n.name')],
+        [('sort', 'a.size'), ('desc', 'true')],
+    ])
+    def test_partial_sort(self, args):
+        nodes = list(load_root(make_sizes_bucket(40)).node_vals)
+        request = Request(args)
+        expected = sorting.sort_nodes_by_request(list(nodes), request,
+                                                 Globals())
+        for count in range(1, len(nodes) + 1):
+            res, sorted_count = sorting.partial_sort_nodes_by_request(
+                list(nodes), request, Globals(), count=count)
+            assert res[:count] == expected[:count], count
+            if count > len(nodes) * sorting.TOP_K_MAX_FRACTION:
+                # pages past the fraction are fully sorted
+                assert sorted_count == len(nodes) and res == expected
+            else:
+                assert sorted_count == count
+        # no count or terms sort fully as well
+        assert sorting.partial_sort_nodes_by_request(
+            list(nodes), request, Globals()) == (expected, len(nodes))
+        assert sorting.partial_sort_nodes_by_request(
+            list(nodes), Request([]), Globals(), count=1) == (
+                nodes, len(nodes))
+
+    def test_pages(self):
+        setup_plugin(make_sizes_bucket(40),
+                     {'pagination_index_per_page': 3})
+        app = sys.modules['momo.plugins.flask.app'].app
+        client = app.test_client()
+        nodes = list(app.config['MOMO_ROOT_NODE'].node_vals)
+        request = Request([('sort', '-a.size'), ('sort', 'n.name')])
+        expected = [node.name for node in sorting.sort_nodes_by_request(
+            nodes, request, Globals())]
+
+        # deeper pages sort the cached nodes again, and fully once they are
+        # past the fraction
+        names = []
+        for page in range(1, 15):
+            data = client.get('/?sort=-a.size&sort=n.name&page=%d' % page)
+            names += re.findall(r'<h2 data-toc-text="([^"]*)"',
+                                data.get_data(as_text=True))
+        assert names == expected
+
+    def test_normalize_key(self):
+        keys = [sorting.normalize_key(value) for value in
+                ('b', None, 2, 'a', 1.5, True, [1])]
+        assert sorted(keys) == [sorting.normalize_key(value) for value in
+                                (True, 1.5, 2, 'a', 'b', [1], None)]
+        assert sorted(keys, key=sorting.Reversed)[0] == (2,)
+        assert min(sorting.normalize_key(value, desc=True)
+                   for value in (None, 0, 'a')) == (0,)
+
+
+class TestLRUCache:
+
+    def test_eviction(self):
+        cache = utils.LRUCache(maxsize=3)
+        for key in 'abc':
+            cache.set(key, key.upper())
+        # a get and a set make a key the most recently used
+        assert cache.get('a') == 'A'
+        cache.set('b', 'B2')
+        cache.set('d', 'D')
+        assert 'c' not in cache and len(cache) == 3
+        cache.set('e', 'E')
+        assert 'a' not in cache
+        assert [cache.get(key) for key in 'bde'] == ['B2', 'D', 'E']
+        cache.clear()
+        assert len(cache) == 0 and 'b' not in cache
+
+    def test_stats(self):
+        cache = utils.LRUCache(maxsize=1)
+        assert cache.get('a') is None
+        assert cache.get('a', 0) == 0
+        cache.set('a', None)
+        assert cache.get('a', 0) is None
+        cache.set('b', 1)
+        assert cache.get('b') == 1 and cache.get('a') is None
+        # set and __contains__ are not lookups
+        assert 'b' in cache
+        assert (cache.hits, cache.misses) == (2, 3)
+
+
+@pytest.mark.usefixtures('testdir')
+class TestViewCache:
+
+    def test_reload(self, monkeypatch):
+        plugin = setup_plugin(BUCKET)
+        app = sys.modules['momo.plugins.flask.app'].app
+        client = app.test_client()
+        cache = app.config['MOMO_CACHE']
+        assert b'Anime' in client.get('/').get_data()
+        # the page is not part of the key, as the nodes are sorted for it
+        for url in ('/', '/?page=1', '/node/Books/'):
+            assert client.get(url).status_code == 200
+        assert (cache.hits, cache.misses) == (2, 2)
+
+        # the nodes of an older bucket are not used, even if they are still
+        # in the cache
+        monkeypatch.setattr(cache, 'clear', lambda: None)
+        with open(os.path.join(TEST_DIR, 'bucket.yml'), 'w') as f:
+            f.write(BUCKET.replace('Anime', 'Manga'))
+        plugin.reload()
+        data = client.get('/').get_data()
+        assert b'Manga' in data and b'Anime' not in data
+        assert (cache.hits, cache.misses) == (2, 3)
+        assert len(cache) == 3
+
+
+@pytest.mark.usefixtures('testdir')
+class TestResponses:
+
+    @pytest.fixture
+    def client(self):
+        self.plugin = setup_plugin(BUCKET)
+        self.app = sys.modules['momo.plugins.flask.app'].app
+        return self.app.test_client()
+
+    def test_etag(self, client):
+        res = client.get('/node/Books/')
+        etag = res.headers['ETag']
+        assert res.status_code == 200 and etag.startswith('W/')
+
+        # views are not rendered again for a client with the same version
+        res = client.get('/node/Books/', headers={'If-None-Match': etag})
+        assert res.status_code == 304 and not res.get_data()
+        assert res.headers['ETag'] == etag
+        res = client.get('/node/Books/?page=2',
+                         headers={'If-None-Match': etag})
+        assert res.status_code == 200
+
+        # and the ETag changes with the version of the bucket
+        self.plugin.reload()
+        res = client.get('/node/Books/', headers={'If-None-Match': etag})
+        assert res.status_code == 200
+        assert res.headers['ETag'] != etag
+
+    def test_compress(self, client):
+        data = client.get('/').get_data()
+        res = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in res.headers['Vary']
+        assert gzip.decompress(res.get_data()) == data
+
+        # the response varies even if it is not compressed for this client
+        res = client.get('/')
+        assert 'Content-Encoding' not in res.headers
+        assert 'Accept-Encoding' in res.headers['Vary']
+
+    def test_compress_min_size(self, client):
+        from werkzeug.datastructures import Accept
+        accept_encodings = Accept([('gzip', 1)])
+        for size in (responses.COMPRESS_MIN_SIZE - 1,
+                     responses.COMPRESS_MIN_SIZE):
+            res = self.app.response_class('x' * size, mimetype='text/html')
+            responses.compress_response(res, accept_encodings)
+            compressed = size >= responses.COMPRESS_MIN_SIZE
+            assert ('Content-Encoding' in res.headers) == compressed
+            assert (len(res.get_data()) == size) != compressed
+
+    def test_files(self, client):
+        files_folder = self.app.config['MOMO_FILES_FOLDER']
+        os.makedirs(files_folder)
+        data = b'momo\n' * 1000
+        with open(os.path.join(files_folder, 'notes.txt'), 'wb') as f:
+            f.write(data)
+
+        # files are streamed as they are, for range requests in particular
+        headers = {'Accept-Encoding': 'gzip'}
+        res = client.get('/files/notes.txt/', headers=headers)
+        assert res.status_code == 200 and res.get_data() == data
+        assert 'Content-Encoding' not in res.headers
+        headers['Range'] = 'bytes=100-199'
+        res = client.get('/files/notes.txt/', headers=headers)
+        assert res.status_code == 206 and res.get_data() == data[100:200]
+        assert 'Content-Encoding' not in res.headers
+        assert res.headers['Content-Range'] == 'bytes 100-199/%d' % len(data)
+
+
+@pytest.mark.usefixtures('testdir')
+class TestBucketWatcher:
+
+    interval = 0.2
+
+    @pytest.fixture(params=['poll', 'inotify'])
+    def watch(self, request, monkeypatch):
+        if request.param == 'poll':
+            monkeypatch.setattr(watcher, 'pyinotify', None)
+        elif watcher.pyinotify is None:
+            pytest.skip('pyinotify is not installed')
+        self.path = os.path.join(TEST_DIR, 'bucket.yml')
+        self.calls = []
+
+        def start(callback=None):
+            bucket_watcher = watcher.BucketWatcher(
+                [self.path, self.path + '.journal'],
+                callback or (lambda: self.calls.append(time.time())),
+                interval=self.interval)
+            bucket_watcher.start()
+            request.addfinalizer(bucket_watcher.stop)
+            # let the watcher take its first look at the files
+            time.sleep(self.interval / 2)
+            return bucket_watcher
+
+        return start
+
+    def write(self, content, path=None):
+        with open(path or self.path, 'a') as f:
+            f.write(content)
+
+    def settle(self):
+        time.sleep(self.interval * 4)
+
+    def test_debounce(self, watch):
+        watch()
+        # a burst of writes is handled once, after it ends
+        for i in range(10):
+            self.write(u'a: %d\n' % i)
+            time.sleep(self.interval / 10)
+        end = time.time()
+        self.settle()
+        assert len(self.calls) == 1 and self.calls[0] >= end
+        self.settle()
+        assert len(self.calls) == 1
+
+        # and so is a change of the journal or a new document
+        self.write(u'[]\n', self.path + '.journal')
+        self.settle()
+        assert len(self.calls) == 2
+        os.remove(self.path)
+        self.write(u'b: 1\n', os.path.join(TEST_DIR, 'new.yml'))
+        os.rename(os.path.join(TEST_DIR, 'new.yml'), self.path)
+        self.settle()
+        assert len(self.calls) == 3
+
+    def test_callback_error(self, watch):
+        def callback():
+            self.calls.append(time.time())
+            raise ValueError('cannot reload')
+
+        bucket_watcher = watch(callback)
+        for i in range(2):
+            self.write(u'a: %d\n' % i)
+            self.settle()
+            assert len(self.calls) == i + 1
+        assert bucket_watcher.is_alive()
+        bucket_watcher.stop()
+        bucket_watcher.join(self.interval * 5)
+        assert not bucket_watcher.is_alive()
+
+
+@pytest.mark.usefixtures('testdir')
+class TestPagination:
+
+    @pytest.mark.parametrize('query,nodes,page,has_prev,has_next', [
+        ('', [0, 1, 2], 1, False, True),
+        ('page=1', [0, 1, 2], 1, False, True),
+        ('page=2', [3, 4, 5], 2, True, True),
+        ('page=3', [6, 7], 3, True, False),
+        # out of range
+        ('page=4', [], 4, True, False),
+        ('page=0', [0, 1, 2], 1, False, True),
+        ('page=-1', [0, 1, 2], 1, False, True),
+        ('page=x', [0, 1, 2], 1, False, True),
+    ])
+    def test_page_nodes(self, query, nodes, page, has_prev, has_next):
+        setup_plugin(BUCKET)
+        app_module = sys.modules['momo.plugins.flask.app']
+        g = app_module.g
+        with app_module.app.test_request_context('/?' + query):
+            g.per_page = 3
+            assert app_module.get_page_nodes(list(range(8))) == nodes
+            pagination = g.pagination
+            assert (pagination.page, pagination.total,
+                    pagination.total_pages) == (page, 8, 3)
+            assert (pagination.has_prev, pagination.has_next) == (
+                has_prev, has_next)
+            assert '8 nodes.' in pagination.info
+
+    def test_truncated(self):
+        setup_plugin(BUCKET)
+        app_module = sys.modules['momo.plugins.flask.app']
+        g = app_module.g
+        with app_module.app.test_request_context('/?page=2'):
+            g.per_page = 3
+            assert app_module.get_page_nodes(list(range(7)),
+                                             truncated=True) == [3, 4, 5]
+            assert '7+ nodes.' in g.pagination.info
+            assert app_module.get_page_nodes([]) == []
+            assert g.pagination.total == 0 and not g.pagination.has_next
+
+
+@pytest.mark.usefixtures('testdir')
+class TestTemplates:
+
+    def test_warm_up(self, monkeypatch):
+        plugin = setup_plugin(BUCKET)
+        env = sys.modules['momo.plugins.flask.app'].app.jinja_env
+        names = env.list_templates(extensions=['html'])
+        cache_dir = os.path.join(plugin.settings.cache_dir, 'jinja', 'test')
+        # the templates of earlier setups may be in memory already
+        env.cache.clear()
+        plugin._warm_up_templates()
+        assert len(os.listdir(cache_dir)) == len(names)
+
+        compiled = []
+        compile_source = env.compile
+
+        def compile(source, *args, **kwargs):
+            compiled.append(source)
+            return compile_source(source, *args, **kwargs)
+
+        monkeypatch.setattr(env, 'compile', compile)
+
+        # the templates are loaded from the bytecode cache by later runs
+        env.cache.clear()
+        plugin._warm_up_templates()
+        assert not compiled
+        assert len(env.cache) == len(names)
+
+        # unless they change
+        user_template_folder = os.path.join(plugin.flask_dir, 'templates')
+        os.makedirs(user_template_folder)
+        with open(os.path.join(user_template_folder, 'error.html'), 'w') as f:
+            f.write(u'{{ status_code }}')
+        env.cache.clear()
+        plugin._warm_up_templates()
+        assert compiled == [u'{{ status_code }}']
+
+
+@pytest.mark.usefixtures('testdir')
+class TestSiteBuilder:
+
+    def test_links(self, capsys):
+        plugin = setup_plugin(BUCKET, {'pagination_node_per_page': 2,
+                                       'build_workers': 1})
+        build_dir = os.path.join(TEST_DIR, 'site')
+        plugin.build(build_dir)
+        jobs = int(re.search(r'(\d+) pages rendered',
+                             capsys.readouterr().err).group(1))
+
+        def resolve(link):
+            path = unquote(link.split('#', 1)[0].split('?', 1)[0])
+            filename = os.path.join(build_dir, path.lstrip('/'))
+            if os.path.isdir(filename):
+                filename = os.path.join(filename, 'index.html')
+            return filename
+
+        pages = 0
+        for dirpath, _, filenames in os.walk(build_dir):
+            for filename in filenames:
+                if not filename.endswith('.html'):
+                    continue
+                pages += 1
+                with open(os.path.join(dirpath, filename)) as f:
+                    links = LINK_PATTERN.findall(f.read())
+                for link in links:
+                    if link.startswith('/') and not link.startswith('//'):
+                        assert os.path.isfile(resolve(link)), (dirpath, link)
+                    else:
+                        # links to user paths are not served by the site
+                        assert not link.startswith('/open/'), link
+        # the index, search, and node pages with pagination of Books
+        assert pages == 1 + 1 + 8 + 2
+
+        # and the results of the search page are node pages
+        with open(os.path.join(build_dir, 'search_index.json')) as f:
+            index = json.load(f)
+        for path in index['nodes']:
+            assert os.path.isfile(resolve('/node/%s/' % path)), path
+        with open(resolve('/search/')) as f:
+            assert 'js/search.js' in f.read()
+
+        # nothing is rendered again, unless the manifest cannot be read
+        plugin.build(build_dir)
+        assert '0 pages rendered, %d unchanged' % jobs in \
+            capsys.readouterr().err
+        with open(os.path.join(build_dir, '.momo_manifest.json'), 'w') as f:
+            f.write(u'{"fingerprint": ')
+        plugin.build(build_dir)
+        assert '%d pages rendered, 0 unchanged' % jobs in \
+            capsys.readouterr().err
+
+
+class TestPreforkServer:
+
+    def get(self, port):
+        sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        try:
+            sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+            data = b''
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close()
+        return data.split(b'\r\n\r\n', 1)[1].decode().split()
+
+    def wait_for(self, func, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                res = func()
+                if res:
+                    return res
+            except (IOError, OSError, IndexError):
+                pass
+            assert time.time() < deadline
+            time.sleep(0.1)
+
+    def test_restart(self):
+        pytest.importorskip('gevent')
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        proc = subprocess.Popen(
+            [sys.executable, '-c', SERVER_SCRIPT, str(port)], env=env)
+        try:
+            version, _, pid = self.wait_for(lambda: self.get(port))
+            assert version == '0' and int(pid) != proc.pid
+
+            # a new generation of workers is forked with the reloaded state,
+            # and the parent does not keep its objects frozen
+            proc.send_signal(signal.SIGHUP)
+            version, frozen, new_pid = self.wait_for(
+                lambda: [res for res in [self.get(port)] if res[0] == '1'][0])
+            assert frozen == '0' and new_pid != pid
+            assert self.get(port)[0] == '1'
+
+            proc.send_signal(signal.SIGTERM)
+            assert proc.wait(timeout=10) == 0
+        finally:
+            if proc.poll() is None:
+                # shut down immediately, killing the workers
+                proc.send_signal(signal.SIGQUIT)
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
@@ -0,0 +1,133 @@
+import os
+import pytest
+import shutil
+from momo.settings import Settings
+from conftest import TEST_DIR
+
+# the mkdocs plugin and its dependencies are optional
+mkdocs = pytest.importorskip('momo.plugins.mkdocs')
+
+
+BUCKET = u"""\
+Books:
+    Designing Data-Intensive Applications:
+        author: Martin Kleppmann
+    The Go Programming Language:
+        path: /books/gopl.pdf
+Anime:
+    Sakura Quest:
+        path: /anime/sakura_quest
+"""
+
+
+def make_plugin(content, workers=1):
+    """Set up the mkdocs plugin with a bucket of the content."""
+    settings_dir = os.path.join(TEST_DIR, 'momo')
+    settings = Settings(settings_dir=settings_dir,
+                        settings_file=os.path.join(settings_dir,
+                                                   'settings.yml'))
+    path = os.path.join(TEST_DIR, 'bucket.yml')
+    with open(path, 'w') as f:
+        f.write(content)
+    settings._settings = {
+        'buckets': {'test': path},
+        'plugins': {'mkdocs': {'test': {'momo_page_level': 2,
+                                        'momo_workers': workers}}},
+    }
+    settings.cbn = 'test'
+    plugin = mkdocs.Mkdocs()
+    plugin.settings = settings
+    plugin.setup()
+    return plugin
+
+
+def make_docs(content, workers=1):
+    """Make the pages of the bucket as `run` does, without serving them."""
+    plugin = make_plugin(content, workers)
+    plugin.mkdocs_configs['pages'] = plugin._get_pages(plugin.root)
+    plugin._make_pages()
+    plugin._remove_stale_pages()
+    plugin._save_manifest()
+    return plugin
+
+
+def read_docs(docs_dir):
+    res = {}
+    for path in list_docs(docs_dir):
+        with open(os.path.join(docs_dir, path), 'rb') as f:
+            res[path] = f.read()
+    return res
+
+
+def list_docs(docs_dir):
+    res = {}
+    for dirpath, _, filenames in os.walk(docs_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            res[os.path.relpath(path, docs_dir)] = os.stat(path).st_mtime
+    return res
+
+
+@pytest.mark.usefixtures('testdir')
+class TestMkdocs:
+
+    def test_rename(self):
+        docs_dir = make_docs(BUCKET).docs_dir
+        docs = list_docs(docs_dir)
+        assert sorted(docs) == [
+            os.path.join('Anime', 'Sakura Quest.md'),
+            os.path.join('Anime', 'index.md'),
+            os.path.join('Books', 'Designing Data-Intensive Applications.md'),
+            os.path.join('Books', 'The Go Programming Language.md'),
+            os.path.join('Books', 'index.md'),
+            'index.md',
+        ]
+        for path in docs:
+            os.utime(os.path.join(docs_dir, path), (0, 0))
+
+        # only the pages of the renamed node and its parent are written
+        make_docs(BUCKET.replace('The Go Programming Language', 'GOPL'))
+        new_docs = list_docs(docs_dir)
+        assert os.path.join('Books', 'GOPL.md') in new_docs
+        assert os.path.join('Books',
+                            'The Go Programming Language.md') not in new_docs
+        for path, mtime in new_docs.items():
+            changed = path in (os.path.join('Books', 'GOPL.md'),
+                               os.path.join('Books', 'index.md'))
+            assert (mtime != 0) == changed, path
+
+    def test_corrupt_manifest(self):
+        plugin = make_docs(BUCKET)
+        stale_page = os.path.join(plugin.docs_dir, 'Stale.md')
+        with open(stale_page, 'w') as f:
+            f.write(u'# Stale')
+        for content in (u'{"pages": {"index.md": ', u'[]', u'{}'):
+            with open(plugin.manifest_path, 'w') as f:
+                f.write(content)
+
+            # the docs are rebuilt from scratch
+            plugin = make_docs(BUCKET)
+            assert not os.path.exists(stale_page)
+            assert sorted(plugin.pages) == sorted(list_docs(plugin.docs_dir))
+
+    def test_workers(self, monkeypatch):
+        content = u''.join(
+            u'Group %d:\n' % i + u''.join(
+                u'    Node %d:\n        size: %d\n' % (j, i * j)
+                for j in range(5))
+            for i in range(10))
+        plugin = make_docs(content)
+        docs = read_docs(plugin.docs_dir)
+        pages = dict(plugin.pages)
+        mkdocs_pages = plugin.mkdocs_configs['pages']
+        assert len(docs) == 1 + 10 + 50
+
+        # the pages made by a pool of workers are the same, and in the same
+        # order
+        monkeypatch.setattr(mkdocs, 'MIN_PARALLEL_PAGES', 0)
+        shutil.rmtree(plugin.mkdocs_dir)
+        plugin = make_docs(content, workers=3)
+        assert read_docs(plugin.docs_dir) == docs
+        assert plugin.pages == pages
+        assert list(plugin.pages) == list(pages)
+        assert plugin.mkdocs_configs['pages'] == mkdocs_pages
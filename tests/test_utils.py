@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import pytest
+from momo import utils
+
+
+LINES = ['line %d' % i for i in range(utils.MIN_PAGE_LINES * 2)]
+
+PAGE_SCRIPT = u"""\
+from momo.utils import page_lines
+page_lines('line %d' % i for i in range(100000))
+"""
+
+
+def fail_popen(*args, **kwargs):
+    raise AssertionError('no pager should be started')
+
+
+class TestPageLines:
+
+    def test_not_a_tty(self, capsys, monkeypatch):
+        # the output is written directly even if the input is a terminal
+        monkeypatch.setattr(sys.stdin, 'isatty', lambda: True)
+        monkeypatch.setattr(subprocess, 'Popen', fail_popen)
+        utils.page_lines(iter(LINES))
+        assert capsys.readouterr().out.splitlines() == LINES
+
+    def test_short_output(self, capsys, monkeypatch):
+        monkeypatch.setattr(utils, '_can_page', lambda: True)
+        monkeypatch.setattr(subprocess, 'Popen', fail_popen)
+        utils.page_lines([1, 2.5, u'caf\xe9'])
+        assert capsys.readouterr().out.splitlines() == ['1', '2.5',
+                                                        u'caf\xe9']
+        utils.page_lines([])
+        assert capsys.readouterr().out == ''
+
+    @pytest.mark.parametrize('pager', [None, 'momo-no-such-pager -R'])
+    def test_missing_pager(self, capsys, monkeypatch, tmpdir, pager):
+        # neither less nor more is found in the empty PATH
+        monkeypatch.setattr(utils, '_can_page', lambda: True)
+        monkeypatch.setenv('PATH', str(tmpdir))
+        if pager is None:
+            monkeypatch.delenv('PAGER', raising=False)
+        else:
+            monkeypatch.setenv('PAGER', pager)
+        utils.page_lines(LINES)
+        assert capsys.readouterr().out.splitlines() == LINES
+
+    def test_pager_quits(self):
+        # the pager reads a line and quits
+        cmd_str = '%s -c "import sys; sys.stdin.readline()"' % sys.executable
+        lines = ('line %d' % i for i in range(100000))
+        assert utils.pipe_lines(lines, cmd_str)
+
+    def test_reader_quits(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        proc = subprocess.Popen([sys.executable, '-c', PAGE_SCRIPT],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        assert proc.stdout.readline() == b'line 0\n'
+        proc.stdout.close()
+        assert proc.wait() == 0
+        assert proc.stderr.read() == b''
+        proc.stderr.close()